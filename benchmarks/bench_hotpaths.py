@@ -0,0 +1,192 @@
+"""
+Benchmarks the bot's hot paths over fixed corpora, reporting operations per second and
+the peak memory allocated by one operation.
+
+Results can be saved as a baseline and later runs checked against it, failing (exit status 1)
+when a path gets slower or allocates more than the tolerance allows. Throughput depends on the
+machine, so save the baseline on the machine that runs the check (e.g. the deploy host).
+Cases are warmed before timing, so memoized paths are timed twice: as they usually run (cache hits)
+and with their caches cleared before every operation ("cold cache"), which times the parser itself
+
+python -m benchmarks.bench_hotpaths                 (print results)
+python -m benchmarks.bench_hotpaths --save          (write benchmarks/baselines.json)
+python -m benchmarks.bench_hotpaths --check         (compare against benchmarks/baselines.json)
+python -m benchmarks.bench_hotpaths --only stats    (cases whose name contains "stats")
+"""
+import json
+import tracemalloc
+
+from argparse import ArgumentParser
+from asyncio import new_event_loop
+from functools import cmp_to_key
+from os import path
+from sys import exit
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple
+
+from bot.cogs.birthdays import compare_people
+from bot.cogs.poll import parse_time, render_results, time_string
+from bot.cogs.roll import RollManager
+from bot.cogs.stats import render_categories, render_stats, render_uses
+from bot.util import extract_emojis, get_local_date
+from bot.util.timeparse import parse_absolute_on, parse_duration
+
+from .fakes import FakeRedis, categories_hash, messages, people, poll_message, stats_hash
+
+BASELINES = path.join(path.dirname(path.abspath(__file__)), "baselines.json")
+# how long each timing repeat runs for
+REPEAT_SECONDS = 0.2
+REPEATS = 3
+
+class Case(NamedTuple):
+  name: str
+  # runs `items` operations
+  run: Callable[[], object]
+  items: int
+
+class Result(NamedTuple):
+  ops_per_second: float
+  peak_bytes: int
+
+def cases() -> List[Case]:
+  corpus = messages()
+  fake = FakeRedis()
+  fake.hmset("1:2", stats_hash())
+  fake.hmset("2:categories", categories_hash())
+  some_emojis = list(fake.hgetall("1:2"))[1:200:10]
+  timings = ["30s", "5", "1d3h10m35s", "3h5m", "2d", "10d3h2m30s", "45m", "1h"]
+  durations = [parse_time(timing) for timing in timings]
+  dates = [
+    "3/27/20 15:39 EDT",
+    "1/1/11 2:01 pm CST",
+    "12/25/2020 12:00 am AKST",
+    "7/4/21 9:30 PM America/Chicago",
+    "in 2h30m"
+  ]
+  rows = people()
+  [content, reactions] = poll_message()
+  roller = RollManager(None)
+  loop = new_event_loop()
+
+  def roll(input: str) -> Callable[[], object]:
+    return lambda: roller.describe(loop.run_until_complete(roller.make_roll(input)))
+
+  def cold(parse: Callable[[str], object], inputs: List[str]) -> Callable[[], object]:
+    def run():
+      for input in inputs:
+        parse_duration.cache_clear()
+        parse_absolute_on.cache_clear()
+        parse(input)
+
+    return run
+
+  return [
+    Case("extract_emojis", lambda: [extract_emojis(message) for message in corpus], len(corpus)),
+    Case("render_stats 5000 emojis", lambda: render_stats(fake.hgetall("1:2"), 10), 1),
+    Case("render_categories 5000 emojis", lambda: render_categories(fake.hgetall("1:2"),
+      fake.hgetall("2:categories"), 5), 1),
+    Case("render_uses 20 emojis", lambda: render_uses(fake.hgetall("1:2"), some_emojis), 1),
+    Case("parse_time", lambda: [parse_time(timing) for timing in timings], len(timings)),
+    Case("parse_time cold cache", cold(parse_time, timings), len(timings)),
+    Case("time_string", lambda: [time_string(duration) for duration in durations], len(durations)),
+    Case("make_roll 1d20", roll("1d20"), 1),
+    Case("make_roll 100d6", roll("100d6"), 1),
+    Case("make_roll 10000d6dl10", roll("10000d6dl10"), 1),
+    Case("make_roll 1000000d100", roll("1000000d100"), 1),
+    Case("get_local_date", lambda: [get_local_date(date) for date in dates], len(dates)),
+    Case("get_local_date cold cache", cold(get_local_date, dates), len(dates)),
+    Case("compare_people sort 1000", lambda: sorted(rows, key=cmp_to_key(compare_people)), 1),
+    Case("render_results 20 reactions", lambda: render_results(content, reactions), 1)
+  ]
+
+def measure(case: Case) -> Result:
+  """
+  Times a case (best of REPEATS, each running for about REPEAT_SECONDS),
+  then runs it once more under tracemalloc to find its peak allocation
+  """
+  # warm caches, then calibrate the number of calls per repeat from a single call
+  case.run()
+  start = perf_counter()
+  case.run()
+  elapsed = perf_counter() - start
+  calls = max(1, int(REPEAT_SECONDS / max(elapsed, 1e-9)))
+  best = float("inf")
+
+  for _ in range(REPEATS):
+    start = perf_counter()
+
+    for _ in range(calls):
+      case.run()
+
+    best = min(best, perf_counter() - start)
+
+  tracemalloc.start()
+  case.run()
+  [_, peak] = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return Result(calls * case.items / best, peak // case.items)
+
+def regressions(results: Dict[str, Result], baselines: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+  """
+  Describes every result that is slower, or allocates more, than its baseline by more than the tolerance
+  """
+  problems = []
+
+  for [name, result] in results.items():
+    baseline = baselines.get(name)
+
+    if baseline is None:
+      continue
+
+    if result.ops_per_second < baseline["ops_per_second"] * (1 - tolerance):
+      problems.append(f"{name}: {result.ops_per_second:,.0f} ops/s, baseline {baseline['ops_per_second']:,.0f}")
+
+    if result.peak_bytes > baseline["peak_bytes"] * (1 + tolerance) + 1024:
+      problems.append(f"{name}: {result.peak_bytes:,} bytes/op, baseline {baseline['peak_bytes']:,}")
+
+  return problems
+
+def main():
+  parser = ArgumentParser(description="Benchmarks the bot's hot paths")
+  parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+  parser.add_argument("--check", action="store_true", help="fail if a result regressed from the baseline")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression (0.25 = 25%%)")
+  parser.add_argument("--only", default="", help="only run cases whose name contains this")
+  args = parser.parse_args()
+
+  results: Dict[str, Result] = {}
+
+  for case in cases():
+    if args.only in case.name:
+      results[case.name] = measure(case)
+      print(f"{case.name:32} {results[case.name].ops_per_second:14,.1f} ops/s {results[case.name].peak_bytes:12,} bytes/op")
+
+  if args.check:
+    with open(BASELINES) as file:
+      problems = regressions(results, json.load(file), args.tolerance)
+
+    for problem in problems:
+      print(f"REGRESSION {problem}")
+
+    if problems:
+      exit(1)
+
+  if args.save:
+    baselines = {}
+
+    if path.exists(BASELINES):
+      with open(BASELINES) as file:
+        baselines = json.load(file)
+
+    baselines.update({
+      name: { "ops_per_second": round(result.ops_per_second, 1), "peak_bytes": result.peak_bytes }
+      for [name, result] in results.items()
+    })
+
+    with open(BASELINES, "w") as file:
+      json.dump(baselines, file, indent=2, sort_keys=True)
+      file.write("\n")
+
+if __name__ == "__main__":
+  main()
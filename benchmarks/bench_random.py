@@ -0,0 +1,39 @@
+"""
+Compares draws per second of the shared buffered random source against the old
+one-SystemRandom-call-per-die path
+
+python -m benchmarks.bench_random
+"""
+from random import SystemRandom
+from time import perf_counter
+from typing import Callable
+
+from bot.util.rand import BufferedRandom
+
+def draws_per_second(fn: Callable[[int], object], draws: int) -> float:
+  start = perf_counter()
+  fn(draws)
+  return draws / (perf_counter() - start)
+
+def main():
+  draws = 200000
+  system = SystemRandom()
+  buffered = BufferedRandom()
+  seeded = BufferedRandom(1234)
+
+  for size in [6, 20, 1000, 125129]:
+    results = [
+      ("SystemRandom.randint (old)", draws_per_second(lambda n: [system.randint(1, size) for _ in range(n)], draws)),
+      ("BufferedRandom.randint", draws_per_second(lambda n: [buffered.randint(1, size) for _ in range(n)], draws)),
+      ("BufferedRandom.randints", draws_per_second(lambda n: buffered.randints(1, size, n), draws)),
+      ("seeded BufferedRandom.randints", draws_per_second(lambda n: seeded.randints(1, size, n), draws))
+    ]
+
+    baseline = results[0][1]
+    print(f"d{size}")
+
+    for [name, rate] in results:
+      print(f"  {name:32} {rate:14,.0f} draws/s  ({rate / baseline:6.1f}x)")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,91 @@
+"""
+Replays a fixed stream of stats traffic (consents, messages, reactions and stats commands)
+against the storage implementations, reporting events per second and the mean latency by kind.
+Run it where the bot runs to choose a storage for the deployment
+
+python -m benchmarks.bench_storage                    (sqlite, and redis if it is reachable)
+python -m benchmarks.bench_storage --backend sqlite
+python -m benchmarks.bench_storage --events 100000
+"""
+from argparse import ArgumentParser
+from os import path
+from redis.exceptions import ConnectionError
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List
+
+from bot.storage import RedisStorage, SqliteStorage, Storage
+
+from .fakes import Event, events
+
+def replay(storage: Storage, stream: List[Event]) -> Dict[str, List[float]]:
+  """
+  Applies every event to a storage, then flushes it
+
+  Returns:
+    the seconds taken by each event, by kind (the final flush is counted as a "flush" event)
+  """
+  seconds: Dict[str, List[float]] = {}
+
+  for event in stream:
+    start = perf_counter()
+
+    if event.kind == "consent":
+      storage.set_consent(event.user, event.guild, True)
+    elif event.kind in ("message", "react"):
+      storage.record_uses(event.user, event.guild, event.emojis)
+    elif event.kind == "unreact":
+      storage.record_uses(event.user, event.guild, event.emojis, -1)
+    elif event.kind == "stats":
+      storage.get_stats(event.user, event.guild)
+    else:
+      storage.get_categories(event.guild)
+
+    seconds.setdefault(event.kind, []).append(perf_counter() - start)
+
+  start = perf_counter()
+  storage.flush()
+  seconds["flush"] = [perf_counter() - start]
+
+  return seconds
+
+def clear(storage: Storage, stream: List[Event]):
+  for [user, guild] in { (event.user, event.guild) for event in stream }:
+    storage.delete_stats(user, guild)
+
+def report(name: str, seconds: Dict[str, List[float]]):
+  total = sum(sum(times) for times in seconds.values())
+  count = sum(len(times) for [kind, times] in seconds.items() if kind != "flush")
+  print(f"{name}: {count / total:,.0f} events/s")
+
+  for [kind, times] in sorted(seconds.items()):
+    print(f"  {kind:12} {len(times):8,} events {sum(times) / len(times) * 1e6:10.1f} us mean")
+
+def main():
+  parser = ArgumentParser(description="Replays stats traffic against the storage implementations")
+  parser.add_argument("--backend", choices=["all", "redis", "sqlite"], default="all")
+  parser.add_argument("--events", type=int, default=20000)
+  args = parser.parse_args()
+
+  stream = events(args.events)
+
+  if args.backend in ("all", "sqlite"):
+    with TemporaryDirectory() as directory:
+      storage = SqliteStorage(path.join(directory, "replay.db"))
+      report("sqlite", replay(storage, stream))
+      storage.close()
+
+  if args.backend in ("all", "redis"):
+    storage = RedisStorage()
+
+    try:
+      clear(storage, stream)
+    except ConnectionError as e:
+      print(f"redis: skipped ({e})")
+      return
+
+    report("redis", replay(storage, stream))
+    clear(storage, stream)
+
+if __name__ == "__main__":
+  main()
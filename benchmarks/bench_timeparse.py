@@ -0,0 +1,65 @@
+"""
+Compares per-parse latency of the time expression parser against the old dateutil path
+
+python -m benchmarks.bench_timeparse
+"""
+from dateutil.parser import parse
+from time import perf_counter
+from typing import Callable, List
+
+from bot.util.timeparse import parse_absolute, parse_absolute_on, parse_fast, zone_abbreviations
+
+corpus = [
+  "3/27/20 15:39 EDT",
+  "3/27/20 15:39:00 UCT+4",
+  "1/1/11 1:11:11 AM EDT",
+  "1/1/11 2:01 pm CST",
+  "01/1/13 13:13:13 UTC-4",
+  "1/01/13 08:27 PST",
+  "12/25/2020 12:00 am AKST",
+  "7/4/21 9:30 PM America/Chicago",
+  # dateutil fallbacks: no zone, and numeric offsets
+  "March 27 2030 3pm",
+  "2030-03-27T15:39+04:00",
+  "3/27/30 15:39 +0530"
+]
+
+def dateutil_path(input: str):
+  try:
+    return parse(input, tzinfos=zone_abbreviations)
+  except ValueError:
+    return None
+
+def uncached_path(input: str):
+  parse_absolute_on.cache_clear()
+  return parse_absolute(input)
+
+def time_per_call(fn: Callable[[str], object], inputs: List[str], rounds: int) -> float:
+  """
+  Returns the average time of a call to fn, in microseconds
+  """
+  start = perf_counter()
+
+  for _ in range(rounds):
+    for input in inputs:
+      fn(input)
+
+  return (perf_counter() - start) / (rounds * len(inputs)) * 1e6
+
+def main():
+  rounds = 2000
+
+  results = [
+    ("dateutil (old get_local_date)", time_per_call(dateutil_path, corpus, rounds // 10)),
+    ("compiled fast path", time_per_call(parse_fast, corpus, rounds)),
+    ("parse_absolute, cold cache", time_per_call(uncached_path, corpus, rounds)),
+    ("parse_absolute, warm cache", time_per_call(parse_absolute, corpus, rounds))
+  ]
+
+  baseline = results[0][1]
+
+  for [name, micros] in results:
+    print(f"{name:32} {micros:9.2f} us/parse  ({baseline / micros:6.1f}x)")
+
+if __name__ == "__main__":
+  main()
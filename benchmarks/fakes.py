@@ -0,0 +1,154 @@
+"""
+Stand-ins for the Discord and Redis objects the hot paths read, and fixed corpora built from a seed
+so every run (and every machine) benchmarks the same inputs
+"""
+from datetime import datetime
+from random import Random
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+__all__ = [
+  "Event", "FakeReaction", "FakeRedis", "categories_hash", "events", "messages", "people", "poll_message", "stats_hash"
+]
+
+SEED = 41
+
+unicode_emojis = [
+  "😀", "😂", "🤣", "😍", "🥺", "😭", "😤", "🤔", "🙃", "😴", "👍", "👎", "🙏", "👀", "🔥",
+  "✨", "🎉", "💯", "❤️", "💀", "🤡", "🍕", "🐸", "🚀", "🌈", "⚡", "🎲", "🏳️‍🌈", "👨‍👩‍👧", "🇺🇸"
+]
+
+words = ["the", "pset", "is", "due", "tonight", "lol", "who", "wants", "food", "at", "simmons",
+  "meeting", "in", "10", "minutes", "anyone", "seen", "my", "charger", "ok", "yes", "no"]
+
+class FakeReaction:
+  """
+  The parts of discord.Reaction read by poll tallying
+  """
+  def __init__(self, emoji: str, count: int):
+    self.emoji = emoji
+    self.count = count
+
+  def __str__(self) -> str:
+    return self.emoji
+
+class FakeRedis:
+  """
+  A dict-backed stand-in for the hash commands used by the stats cog.
+  hgetall returns a fresh dict each time, like a real round trip
+  """
+  def __init__(self):
+    self.hashes: Dict[str, Dict[str, str]] = {}
+
+  def hgetall(self, key: str) -> Dict[str, str]:
+    return dict(self.hashes.get(key, {}))
+
+  def hmset(self, key: str, mapping: Dict[str, object]):
+    self.hashes.setdefault(key, {}).update({ field: str(value) for [field, value] in mapping.items() })
+
+class Event(NamedTuple):
+  # consent, message, react, unreact, stats or categories
+  kind: str
+  user: int
+  guild: int
+  emojis: List[str]
+
+def custom_emoji(index: int, animated: bool = False) -> str:
+  return f"<{'a' if animated else ''}:emoji_{index}:{700000000000000000 + index}>"
+
+def messages(count: int = 500, rng: Optional[Random] = None) -> List[str]:
+  """
+  Chat messages: mostly text, some with unicode and custom emojis, a few emoji-only
+  """
+  rng = rng or Random(SEED)
+  corpus = []
+
+  for _ in range(count):
+    tokens = rng.choices(words, k=rng.randint(0, 25))
+
+    for _ in range(rng.choice([0, 0, 0, 1, 1, 2, 5])):
+      tokens.insert(rng.randint(0, len(tokens)), rng.choice(unicode_emojis))
+
+    for _ in range(rng.choice([0, 0, 0, 1, 3])):
+      tokens.insert(rng.randint(0, len(tokens)), custom_emoji(rng.randint(0, 500), rng.random() < 0.1))
+
+    corpus.append(" ".join(tokens))
+
+  return corpus
+
+def stats_hash(emojis: int = 5000, rng: Optional[Random] = None) -> Dict[str, str]:
+  """
+  A heavy user's stats hash: emoji -> uses (long-tailed), plus the consent field
+  """
+  rng = rng or Random(SEED)
+  stats = { "consent": "1" }
+
+  for index in range(emojis):
+    emoji = unicode_emojis[index] if index < len(unicode_emojis) else custom_emoji(index)
+    stats[emoji] = str(int(rng.paretovariate(1.2)))
+
+  return stats
+
+def categories_hash(categories: int = 20, per_category: int = 50) -> Dict[str, str]:
+  """
+  A guild's categories hash: category -> space-separated emojis
+  """
+  return {
+    f"category{index}": " ".join(custom_emoji(index * per_category + offset) for offset in range(per_category))
+    for index in range(categories)
+  }
+
+def poll_message(options: int = 10, rng: Optional[Random] = None) -> Tuple[str, List[FakeReaction]]:
+  """
+  A finished poll: its text and reactions, including votes with emojis that are not options
+  """
+  from bot.cogs.poll import emojis_order
+
+  rng = rng or Random(SEED)
+  content = "poll by <@1234> (in 1 day): **Where should we eat?**\n\n>>> "
+  # discord strips the trailing newline the poll command sends
+  content += "\n".join(f"{index + 1}. option {index}" for index in range(options))
+  reactions = [FakeReaction(emoji, rng.randint(1, 40)) for emoji in emojis_order[:options]]
+  reactions += [FakeReaction(emoji, rng.randint(1, 10)) for emoji in unicode_emojis[:10]]
+
+  return (content, reactions)
+
+def people(count: int = 1000, rng: Optional[Random] = None) -> List[Tuple[str, Optional[datetime]]]:
+  """
+  Rows of a birthday sheet, with a few people missing a valid birthday
+  """
+  rng = rng or Random(SEED)
+  rows = []
+
+  for index in range(count):
+    birthday = None if rng.random() < 0.05 else datetime(rng.randint(1990, 2005), rng.randint(1, 12), rng.randint(1, 28))
+    rows.append((f"kerb{index}", birthday))
+
+  return rows
+
+def events(count: int = 20000, users: int = 200, guilds: int = 5, first_guild: int = 800000000000000000,
+           rng: Optional[Random] = None) -> List[Event]:
+  """
+  A replayable stream of the storage traffic of a busy bot: most users consent first, then
+  messages dominate, with reactions added and removed, and the odd stats command
+  """
+  rng = rng or Random(SEED)
+  corpus = messages(500, rng)
+  guild_ids = [first_guild + index for index in range(guilds)]
+  members = [(100000000000000000 + index, rng.choice(guild_ids)) for index in range(users)]
+  stream = [Event("consent", user, guild, []) for [user, guild] in members if rng.random() < 0.8]
+  kinds = ["message"] * 80 + ["react"] * 14 + ["unreact"] * 4 + ["stats"] + ["categories"]
+
+  for _ in range(count - len(stream)):
+    [user, guild] = rng.choice(members)
+    kind = rng.choice(kinds)
+
+    if kind == "message":
+      emojis = [token for token in rng.choice(corpus).split(" ") if token in unicode_emojis or token.startswith("<")]
+    elif kind in ("react", "unreact"):
+      emojis = [rng.choice(unicode_emojis) if rng.random() < 0.7 else custom_emoji(rng.randint(0, 500))]
+    else:
+      emojis = []
+
+    stream.append(Event(kind, user, guild, emojis))
+
+  return stream
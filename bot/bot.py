@@ -1,32 +1,178 @@
+from asyncio import wait
 from datetime import datetime
-from discord import Member, Message, Reaction, Role, TextChannel, User
-from discord.ext.commands import Bot, CommandInvokeError, DefaultHelpCommand, Context, Converter, Greedy
-from emoji import get_emoji_regexp
+from collections import defaultdict
+from discord import Member, Message, RawBulkMessageDeleteEvent, RawMessageDeleteEvent, RawMessageUpdateEvent, Reaction, Role, TextChannel, User
+from discord.ext.commands import Bot, Cog, CommandInvokeError, DefaultHelpCommand, Context, Converter, Greedy
+from discord.ext.tasks import Loop
+from importlib import import_module, reload
 from os import environ
-from re import compile, findall, UNICODE
-from typing import Union
+from re import compile, UNICODE
+from time import perf_counter
+from types import ModuleType
+from typing import Callable, Dict, List, Union
 
-from .cogs import BirthdayManager, EventsManager, ImpersonateManager, PollManager, RolesManager, RollManager, StatsManager, StatusManager
-from .util import redis
+from .cogs import BirthdayManager, DebugManager, EventsManager, ImpersonateManager, PollManager, RetentionManager, RolesManager, RollManager, StatsManager, StatusManager
+from .storage import storage
+from .util import extract_emojis, scheduler
+from .util.memory import register_cache
+from .util.messageemojis import diff, message_emojis
+from .util.metrics import instrument_event
+from .util.trending import record_trending
 
-__all__ = ["bot"]
+__all__ = ["available_cogs", "bot", "enabled_cogs", "reload_cog", "setup_cogs"]
 
 bot = Bot(command_prefix='>', help_command=DefaultHelpCommand(dm_help=True))
 
-bot.add_cog(BirthdayManager(bot))
-bot.add_cog(EventsManager(bot))
-bot.add_cog(ImpersonateManager(bot))
-bot.add_cog(PollManager(bot))
-bot.add_cog(RolesManager(bot))
-bot.add_cog(RollManager(bot))
-bot.add_cog(StatsManager(bot))
-bot.add_cog(StatusManager(bot))
+register_cache("discord guilds", lambda: len(bot.guilds))
+register_cache("discord users", lambda: len(bot.users))
+register_cache("discord members", lambda: sum(len(guild.members) for guild in bot.guilds))
+register_cache("discord messages", lambda: len(bot.cached_messages))
 
-discord_emojis = r'<a?:[a-zA-Z0-9\_]+:[0-9]+>'
+available_cogs = {
+  "birthdays": BirthdayManager,
+  "debug": DebugManager,
+  "events": EventsManager,
+  "impersonate": ImpersonateManager,
+  "poll": PollManager,
+  "retention": RetentionManager,
+  "roles": RolesManager,
+  "roll": RollManager,
+  "stats": StatsManager,
+  "status": StatusManager
+}
 
-unicode_emojis = get_emoji_regexp()
+def enabled_cogs() -> List[str]:
+  """
+  Returns the names of the cogs enabled for this deployment.
+  SAFETY_COGS is a comma-separated list of names from available_cogs (default: all of them)
+
+  Raises:
+    ValueError: if SAFETY_COGS names a cog that does not exist
+  """
+  names = [name.strip() for name in environ.get("SAFETY_COGS", "").split(",") if name.strip()]
+
+  for name in names:
+    if name not in available_cogs:
+      raise ValueError(f"Unknown cog {name} in SAFETY_COGS. Choose from {', '.join(available_cogs)}")
+
+  return names or list(available_cogs)
+
+def setup_cogs(on_cog: Callable[[str, float], None] = lambda name, seconds: None):
+  """
+  Constructs and adds every enabled cog
+
+  Args:
+    on_cog (Callable[[str, float], None]): called with the name of each cog and how long it took to set up
+  """
+  for name in enabled_cogs():
+    start = perf_counter()
+    bot.add_cog(available_cogs[name](bot))
+    on_cog(name, perf_counter() - start)
+
+# how long a reload waits for a cog's background loops to finish the iteration they are running
+RELOAD_TIMEOUT = 30
+
+def cog_loops(cog: Cog) -> List[Loop]:
+  return [value for value in vars(type(cog)).values() if isinstance(value, Loop)]
+
+def loop_busy(loop: Loop) -> bool:
+  """
+  Whether a background loop is running an iteration, rather than sleeping until the next one
+  """
+  task = loop.get_task()
+
+  if task is None or task.done():
+    return False
+
+  awaiting = getattr(task.get_coro(), "cr_await", None)
+  return getattr(awaiting, "cr_code", None) is loop.coro.__code__
+
+async def finish_loops(cog: Cog) -> List[Loop]:
+  """
+  Stops the background loops of a cog that are running an iteration once it finishes
+  (waiting up to RELOAD_TIMEOUT). Sleeping loops are left to be cancelled when the cog unloads
+
+  Returns (List[Loop]):
+    the loops that were stopped
+  """
+  busy = [loop for loop in cog_loops(cog) if loop_busy(loop)]
+
+  for loop in busy:
+    loop.stop()
+
+  if busy:
+    await wait([loop.get_task() for loop in busy], timeout=RELOAD_TIMEOUT)
+
+  return busy
+
+def transfer_jobs(module: ModuleType):
+  """
+  Points scheduled jobs that run a function of a reloaded module at the new function.
+  Jobs in the redis job store already find the new function when they are loaded
+  """
+  for job in scheduler.get_jobs():
+    if getattr(job.func, "__module__", None) != module.__name__:
+      continue
+
+    current = getattr(module, job.func.__name__, None)
+
+    if current is not None and current is not job.func:
+      job.modify(func=current)
+
+async def reload_cog(name: str) -> Cog:
+  """
+  Reloads the module of a cog and swaps the running cog for one built from the new code,
+  keeping the gateway connection. The old cog's loops finish their current iteration,
+  its state (export_state) is handed to the new cog (import_state) before it is added,
+  and scheduled jobs are pointed at the new module. Only the cog's own module is reloaded
+
+  Args:
+    name (str): the name of the cog in available_cogs
+
+  Returns (Cog):
+    the new cog
+
+  Raises:
+    ValueError: if there is no such cog, or it is not loaded
+  """
+  if name not in available_cogs:
+    raise ValueError(f"Unknown cog {name}. Choose from {', '.join(available_cogs)}")
+
+  old_class = available_cogs[name]
+  old = bot.get_cog(old_class.__cog_name__)
+
+  if old is None:
+    raise ValueError(f"The {name} cog is not loaded")
+
+  # a module that fails to import leaves the old cog running
+  module = reload(import_module(old_class.__module__))
+  new_class = getattr(module, old_class.__name__)
+  stopped = await finish_loops(old)
+
+  try:
+    new = new_class(bot)
+  except Exception:
+    for loop in stopped:
+      if loop.get_task().done():
+        loop.start()
+
+    raise
+
+  state = old.export_state() if hasattr(old, "export_state") else {}
+  bot.remove_cog(old.qualified_name)
+
+  if hasattr(new, "import_state"):
+    new.import_state(state)
+
+  bot.add_cog(new)
+  available_cogs[name] = new_class
+  setattr(import_module(".cogs", __package__), new_class.__name__, new_class)
+  transfer_jobs(module)
+
+  return new
 
 @bot.event
+@instrument_event
 async def on_message(message: Message):
   """
   Handles an incoming message. If the command starts with >, it is processed.
@@ -44,30 +190,69 @@ async def on_message(message: Message):
   if message.author.id == bot.user.id:
     pass
   elif isinstance(message.author, Member) and isinstance(message.channel, TextChannel):
-    key = f"{message.author.id}:{message.channel.guild.id}"
-    
-    user_reacts = redis.hgetall(key)
+    emojis = extract_emojis(message.content)
+
+    if emojis:
+      counted = storage.record_uses(message.author.id, message.channel.guild.id, emojis)
+      storage.remember_consent(message.author.id, message.channel.guild.id, counted)
+    else:
+      # remembered too, so emojis added by an edit are counted. A stale consent only remembers a
+      # message needlessly, since the edit's uses are counted with the current consent
+      counted = storage.cached_consent(message.author.id, message.channel.guild.id)
 
-    if user_reacts.get("consent") == "1":
-      unicode_emoji_list = findall(unicode_emojis, message.content)
+    if counted:
+      # so edits and deletes can correct the stats
+      message_emojis.remember(message.id, message.author.id, message.channel.guild.id, emojis)
+      record_trending(message.author.id, message.channel.guild.id, emojis)
 
-      for emoji in unicode_emoji_list:
-        if emoji in user_reacts:
-          user_reacts[emoji] = int(user_reacts[emoji]) + 1
-        else: 
-          user_reacts[emoji] = 1
+@bot.event
+@instrument_event
+async def on_raw_message_edit(payload: RawMessageUpdateEvent):
+  """
+  Corrects the emoji stats of an edited message, from the emojis remembered when it was sent.
+  Raw, so it also runs for messages that are not in discord.py's message cache
+  """
+  if "content" not in payload.data or "guild_id" not in payload.data:
+    return
 
-      discord_emoji_list = findall(discord_emojis, message.content)
+  old = message_emojis.forget(payload.message_id, payload.data["guild_id"])
 
-      for custom_emoji in discord_emoji_list:
-        if custom_emoji in user_reacts:
-          user_reacts[custom_emoji] = int(user_reacts[custom_emoji]) + 1
-        else:
-          user_reacts[custom_emoji] = 1
+  if old is None:
+    return
 
-      redis.hmset(key, user_reacts)
+  new = extract_emojis(payload.data["content"])
+  [added, removed] = diff(old.emojis, new)
+  storage.record_uses(old.author, old.guild, added)
+  storage.record_uses(old.author, old.guild, removed, -1)
+  message_emojis.remember(payload.message_id, old.author, old.guild, new)
 
 @bot.event
+@instrument_event
+async def on_raw_message_delete(payload: RawMessageDeleteEvent):
+  """
+  Removes the emojis of a deleted message from its author's stats
+  """
+  old = message_emojis.forget(payload.message_id, payload.guild_id)
+
+  if old is not None:
+    storage.record_uses(old.author, old.guild, list(old.emojis), -1)
+
+@bot.event
+@instrument_event
+async def on_raw_bulk_message_delete(payload: RawBulkMessageDeleteEvent):
+  """
+  Removes the emojis of deleted messages from their authors' stats, with one update per author
+  """
+  by_author: Dict[int, List[str]] = defaultdict(list)
+
+  for old in message_emojis.forget_many(payload.message_ids, payload.guild_id).values():
+    by_author[old.author].extend(old.emojis)
+
+  for [author, emojis] in by_author.items():
+    storage.record_uses(author, payload.guild_id, emojis, -1)
+
+@bot.event
+@instrument_event
 async def on_reaction_add(react: Reaction, user: Union[Member, User]):
   """
   Handles incrementing emoji stats when a reaction is added.
@@ -76,19 +261,11 @@ async def on_reaction_add(react: Reaction, user: Union[Member, User]):
   AND the user has explicitly consented to stats in that server
   """
   if isinstance(user, Member) and isinstance(react.message.channel, TextChannel):
-    key = f"{user.id}:{react.message.channel.guild.id}"
-    
-    user_reacts = redis.hgetall(key)
-
-    if user_reacts.get("consent") == "1":
-      emoji_str = str(react.emoji)
-
-      if emoji_str in user_reacts:
-        redis.hset(key, emoji_str, int(user_reacts[emoji_str]) + 1)
-      else:
-        redis.hset(key, emoji_str, 1)
+    if storage.record_uses(user.id, react.message.channel.guild.id, [str(react.emoji)]):
+      record_trending(user.id, react.message.channel.guild.id, [str(react.emoji)])
 
 @bot.event
+@instrument_event
 async def on_reaction_remove(react: Reaction, user: Union[Member, User]):
   """
   Handles decrementing emoji stats when a reaction is added.
@@ -97,17 +274,4 @@ async def on_reaction_remove(react: Reaction, user: Union[Member, User]):
   AND the user has explicitly consented to stats in that server
   """
   if isinstance(user, Member) and isinstance(react.message.channel, TextChannel):
-    key = f"{user.id}:{react.message.channel.guild.id}"
-    
-    user_reacts = redis.hgetall(key)
-
-    if user_reacts.get("consent") == "1":
-      emoji_str = str(react.emoji)
-
-      if emoji_str in user_reacts:
-        new_count = int(user_reacts[emoji_str]) - 1
-
-        if new_count == 0:
-          redis.hdel(key, emoji_str)
-        else:
-          redis.hset(key, emoji_str, new_count)
+    storage.record_uses(user.id, react.message.channel.guild.id, [str(react.emoji)], -1)
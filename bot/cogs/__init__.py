@@ -1,7 +1,9 @@
 from .birthdays import BirthdayManager
+from .debug import DebugManager
 from .events import EventsManager
 from .impersonate import ImpersonateManager
 from .poll import PollManager
+from .retention import RetentionManager
 from .roles import RolesManager
 from .roll import RollManager
 from .stats import StatsManager
@@ -9,9 +11,11 @@ from .status import StatusManager
 
 __all__ = [
   "BirthdayManager",
+  "DebugManager",
   "EventsManager",
   "ImpersonateManager",
   "PollManager",
+  "RetentionManager",
   "RolesManager",
   "RollManager",
   "StatsManager",
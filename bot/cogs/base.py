@@ -1,13 +1,40 @@
 from discord.ext.commands import BadArgument, Bot, Cog, Context, CommandError, CommandInvokeError
 from textwrap import dedent
+from time import perf_counter
+from typing import Any, Dict
+
+from ..util.metrics import command_errors, command_seconds
 
 __all__ = ["CustomCog"]
 
 class CustomCog(Cog):
+  def export_state(self) -> Dict[str, Any]:
+    """
+    Returns the in-memory state to hand over to the cog replacing this one when its module is reloaded
+    """
+    return {}
+
+  def import_state(self, state: Dict[str, Any]):
+    """
+    Takes over the state exported by the cog this one replaces. Called before the cog is added
+    """
+
+  async def cog_before_invoke(self, ctx: Context):
+    ctx.started = perf_counter()
+
+  async def cog_after_invoke(self, ctx: Context):
+    """
+    Records the latency of every command that ran
+    """
+    command_seconds.observe(ctx.command.qualified_name, value=perf_counter() - ctx.started)
+
   async def cog_command_error(self, ctx: Context, error: CommandError):
     """
-    Handles errors for custom cogs
+    Handles errors for custom cogs, and counts them. Counted here rather than after invoking, since
+    the after invoke hook does not run when a conversion or check fails
     """
+    command_errors.inc(ctx.command.qualified_name)
+
     if isinstance(error, CommandInvokeError):
       await ctx.send(error.original)
     elif isinstance(error, BadArgument):
@@ -1,23 +1,36 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from asyncio import Lock, sleep
-from datetime import datetime, timedelta
-from discord.ext import tasks, commands
-from discord.ext.commands import Bot, Cog
-from functools import cmp_to_key
-from googleapiclient.discovery import build
+from asyncio import Lock
+from bisect import bisect_left
+from calendar import isleap
+from datetime import date, datetime, timedelta
+from dateutil.tz import tzlocal
+from discord import TextChannel
+from discord.ext import tasks
+from discord.ext.commands import Bot, Context, command, guild_only, has_permissions
+from functools import cmp_to_key, partial
 from os import environ
-from threading import Timer
-from typing import List, Optional, Tuple
-from tzlocal import get_localzone
+from typing import Any, Dict, List, Optional, Tuple
 
-from ..util import get_date, sheets
+from .base import CustomCog
+from ..util import gateway, get_date, record_error, redis, scheduler
+from ..util.keys import birthdays_key
+from ..util.memory import register_cache
+from ..util.sheetgateway import Subscription
+
+import bot
 
 __all__ = ["BirthdayManager"]
 
 date_formats = ["%m/%d/%y", "%m/%d/%Y"]
-seconds_in_year = 60 * 60 * 24 * 365.2425
+
+# the birthday job can run late (e.g. after a restart) as long as it is still the same day
+MISFIRE_GRACE = 60 * 60 * 12
+ANNOUNCED_KEY = "birthdays:announced"
+BIRTHDAY_RANGE = "A2:J500"
 
 Person = Tuple[str, Optional[datetime]]
+MonthDay = Tuple[int, int]
+# (month, day) -> [(name, birth year)], ordered by date
+BirthdayIndex = Dict[MonthDay, List[Tuple[str, int]]]
 
 def compare_people(a: Person, b: Person) -> int:
   """
@@ -41,104 +54,272 @@ def compare_people(a: Person, b: Person) -> int:
 
   if month_diff != 0:
     return month_diff
-  
+
   return a[1].day - b[1].day
 
-def localtime(input: datetime, tz) -> datetime:
+def build_index(people: List[Person]) -> BirthdayIndex:
+  """
+  Groups people by birthday (month, day). People without a valid birthday are dropped
+
+  Args:
+    people (List[Person]): the people to index
+
+  Return (BirthdayIndex):
+    a mapping of (month, day) to names and birth years, with keys in calendar order
   """
-  Converts a datetime with time zone to system local time
+  index: BirthdayIndex = {}
+
+  for [name, birthday] in sorted(people, key=cmp_to_key(compare_people)):
+    if birthday is None:
+      break
 
-  Input:
-    input (datetime): the datetime to be converted
-    tz: time zone metadata (get_localzone)
+    index.setdefault((birthday.month, birthday.day), []).append((name, birthday.year))
 
-  Return (datetime):
-    A datetime object in the system's time zone
+  return index
+
+def celebrated_on(month_day: MonthDay, year: int) -> date:
+  """
+  Returns the date a birthday is celebrated in a given year (Feb 29 is Feb 28 outside of leap years)
   """
-  return tz.normalize(tz.localize(input))
+  if month_day == (2, 29) and not isleap(year):
+    return date(year, 2, 28)
+
+  return date(year, *month_day)
+
+def next_birthday(index: BirthdayIndex, today: date) -> Optional[date]:
+  """
+  Finds the first date on or after today with at least one birthday
+
+  Args:
+    index (BirthdayIndex): the birthdays of a guild
+    today (date): the first date to consider
+
+  Return (Optional[date]):
+    the next date with a birthday, or None if there are no birthdays
+  """
+  if not index:
+    return None
+
+  days = list(index)
+  position = bisect_left(days, (today.month, today.day))
+
+  # Feb 29 sorts after Feb 28, so it needs to be checked on Feb 28 of a non-leap year
+  for month_day in days[position:position + 2]:
+    if celebrated_on(month_day, today.year) >= today:
+      return celebrated_on(month_day, today.year)
 
-class BirthdayManager(Cog):
+  return celebrated_on(days[0], today.year + 1)
+
+def birthdays_on(index: BirthdayIndex, day: date) -> List[Tuple[str, int]]:
+  """
+  Returns everyone whose birthday is celebrated on a date
+  """
+  people = list(index.get((day.month, day.day), []))
+
+  if day.month == 2 and day.day == 28 and not isleap(day.year):
+    people.extend(index.get((2, 29), []))
+
+  return people
+
+async def announce_birthdays():
+  """
+  Scheduled job: announces today's birthdays in every guild, and schedules the next announcement
+  """
+  manager = bot.bot.get_cog("BirthdayManager")
+
+  if manager:
+    await manager.announce()
+
+class BirthdayManager(CustomCog):
+  """
+  Announces birthdays from a google sheet. Each server has its own sheet and channel
+  """
   def __init__(self, bot: Bot):
-    self.birthdays: List[Person] = []
+    self.birthdays: Dict[int, BirthdayIndex] = {}
     self.bot = bot
     self.lock = Lock()
-    self.timer: Optional[Timer] = None
+    self.subscriptions: Dict[int, Subscription] = {}
 
-    self.channel = int(environ.get("SAFETY_ANNOUNCEMENT_CHANNEL"))
-    self.doc = environ.get("SAFETY_GOOGLE_DOCS_LINK")
+    register_cache("birthdays", lambda: sum(len(people) for index in self.birthdays.values()
+      for people in index.values()))
     self.refresh_birthdays.start()
 
-    self.scheduler = AsyncIOScheduler()
-    self.scheduler.add_job(self.schedule_birthday, trigger="cron", hour=0, minute=0, second=0)
-    self.scheduler.start()
-
   def cog_unload(self):
     self.refresh_birthdays.cancel()
-    self.scheduler.remove_all_jobs()
+
+    for subscription in self.subscriptions.values():
+      gateway.unsubscribe(subscription)
+
+  def export_state(self) -> Dict[str, Any]:
+    return { "birthdays": self.birthdays }
+
+  def import_state(self, state: Dict[str, Any]):
+    # the sheets are subscribed to again by the first refresh, which skips fetching them
+    # for guilds that already have an index
+    self.birthdays = state.get("birthdays", {})
+
+  def get_configs(self) -> Dict[int, Dict[str, str]]:
+    """
+    Returns the birthday sheet and channel for every guild that has one.
+
+    The SAFETY_GOOGLE_DOCS_LINK and SAFETY_ANNOUNCEMENT_CHANNEL variables are used
+    for the guild of that channel if it has not been configured with >setBirthdays
+    """
+    legacy_doc = environ.get("SAFETY_GOOGLE_DOCS_LINK")
+    legacy_channel = environ.get("SAFETY_ANNOUNCEMENT_CHANNEL")
+
+    if legacy_doc and legacy_channel and legacy_channel.isdigit():
+      channel = self.bot.get_channel(int(legacy_channel))
+
+      if channel:
+        redis.hsetnx(birthdays_key(channel.guild.id), "doc", legacy_doc)
+        redis.hsetnx(birthdays_key(channel.guild.id), "channel", legacy_channel)
+
+    with redis.pipeline() as pipe:
+      for guild in self.bot.guilds:
+        pipe.hgetall(birthdays_key(guild.id))
+
+      configs = pipe.execute()
+
+    return {
+      guild.id: config for [guild, config] in zip(self.bot.guilds, configs)
+      if config.get("doc") and config.get("channel")
+    }
 
   @tasks.loop(hours=48)
   async def refresh_birthdays(self):
     """
-    Polls for changes from google sheet for birthdays
+    Picks up changes to which sheet each guild uses
+    """
+    await self.refresh()
+
+  @refresh_birthdays.before_loop
+  async def before_refresh(self):
+    await self.bot.wait_until_ready()
+
+  async def refresh(self):
+    """
+    Subscribes to the birthday sheet of every configured guild.
+    The sheets gateway calls update_guild whenever a sheet changes
+    """
+    try:
+      configs = self.get_configs()
+      new_docs = set()
+
+      for guild_id in list(self.subscriptions):
+        if self.subscriptions[guild_id].doc != configs.get(guild_id, {}).get("doc"):
+          gateway.unsubscribe(self.subscriptions.pop(guild_id))
+          self.birthdays.pop(guild_id, None)
+
+      for [guild_id, config] in configs.items():
+        if guild_id not in self.subscriptions:
+          indexed = guild_id in self.birthdays
+          self.subscriptions[guild_id] = await gateway.subscribe(config["doc"], BIRTHDAY_RANGE,
+            partial(self.update_guild, guild_id))
+
+          if not indexed:
+            new_docs.add(config["doc"])
+
+      for doc in new_docs:
+        await gateway.refresh(doc)
+    except Exception as e:
+      record_error("refresh_birthdays", e)
+
+  async def update_guild(self, guild_id: int, data: List[List[str]]):
     """
+    Rebuilds the birthday index of a guild from its sheet, then schedules the next announcement
+    """
+    people: List[Person] = []
+
+    for person in data:
+      if len(person) < 2:
+        continue
+
+      kerberos = person[1]
+      birthday = person[9] if len(person) >= 10 else person[-1]
+      people.append((kerberos, get_date(birthday, date_formats)))
+
     async with self.lock:
-      data = sheets.spreadsheets() \
-        .values() \
-        .get(spreadsheetId=self.doc, range="A2:J500") \
-        .execute() \
-        .get("values", [])
+      self.birthdays[guild_id] = build_index(people)
+      self.schedule_next()
+
+  def schedule_next(self):
+    """
+    Schedules a single job on the shared scheduler for the next date with a birthday in any guild.
+    Dates that have already been announced are skipped
+    """
+    start = datetime.now(tzlocal()).date()
+
+    if redis.get(ANNOUNCED_KEY) == start.isoformat():
+      start += timedelta(days=1)
+
+    upcoming = [next_birthday(index, start) for index in self.birthdays.values()]
+    upcoming = [day for day in upcoming if day is not None]
 
-      self.birthdays.clear()
+    if not upcoming:
+      return
 
-      for person in data:
-        kerberos = person[1]
-        birthday = person[9] if len(person) >= 10 else person[-1]
-        self.birthdays.append((kerberos, get_date(birthday, date_formats)))
+    day = min(upcoming)
+    run_date = datetime(day.year, day.month, day.day, tzinfo=tzlocal())
 
-      self.birthdays.sort(key=cmp_to_key(compare_people))
+    scheduler.add_job(announce_birthdays, 'date', id="birthdays", replace_existing=True,
+      run_date=run_date, misfire_grace_time=MISFIRE_GRACE, coalesce=True)
 
-  async def schedule_birthday(self):
+  async def announce(self):
     """
-    Reviews birthday metadata and sends birthday notice in SAFETY_ANNOUNCEMENT_CHANNEL
-    if someone's birthday is today (server time)
+    Sends a birthday notice in each guild's birthday channel
+    for everyone whose birthday is today (server time)
     """
     try:
-      async with self.lock:
-        tz = get_localzone()
+      if not self.birthdays:
+        # the job fired before the first refresh (e.g. right after a restart)
+        await self.bot.wait_until_ready()
+        await self.refresh()
 
-        now = datetime.now(tz)
-        tomorrow = (now + timedelta(1)) \
-          .replace(hour=0, minute=0, second=0, microsecond=0)
+      async with self.lock:
+        today = datetime.now(tzlocal()).date()
+        configs = self.get_configs()
 
-        people: List[Tuple[str, datetime]] = []
+        for [guild_id, index] in self.birthdays.items():
+          people = birthdays_on(index, today)
 
-        for person in self.birthdays:
-          if person[1] is None:
+          if len(people) == 0 or guild_id not in configs:
             continue
 
-          current_birthday = localtime(person[1].replace(year=now.year), tz)
-          
-          if tomorrow - timedelta(1) <= current_birthday < tomorrow:
-            people.append(person)
+          names = [person[0] for person in people]
+          names_str = ", ".join(names)
+          message = f"Happy birthday to {names_str}!\n"
 
-        if len(people) == 0:
-          return
+          for [name, year] in people:
+            message += f"{name} is {today.year - year} years old\n"
 
-        names = [person[0] for person in people]
-        names_str = ", ".join(names)
-        message = f"Happy birthday to {names_str}!\n"
+          target_channel = self.bot.get_channel(int(configs[guild_id]["channel"]))
 
-        for person in people:
-          difference = tomorrow - localtime(person[1], tz)
-          age = round(difference.total_seconds() / seconds_in_year)
-          message += f"{person[0]} is {age} years old\n"
+          if target_channel:
+            await target_channel.send(message)
 
-        target_channel = self.bot.get_channel(self.channel)
+        redis.set(ANNOUNCED_KEY, today.isoformat())
+        self.schedule_next()
+    except Exception as e:
+      record_error("announce_birthdays", e)
 
-        while target_channel is None:
-          await sleep(5)
-          target_channel = self.bot.get_channel(self.channel)
+  @has_permissions(manage_guild=True)
+  @guild_only()
+  @command()
+  async def setBirthdays(self, ctx: Context, doc: str, channel: Optional[TextChannel] = None):
+    """
+    Sets the google sheet with birthdays for this server, and the channel to announce them in.
+    The sheet needs names in column B and birthdays (mm/dd/yy) in column J.
+    This function is server-only (no DMing).
 
-        await target_channel.send(message)
-    except Exception as e:
-      print(e)
+    Examples:
+    >setBirthdays 1aBcD_sheet_id                 (announce in this channel)
+    >setBirthdays 1aBcD_sheet_id #announcements  (announce in #announcements)
+    """
+    channel = channel or ctx.channel
+
+    redis.hmset(birthdays_key(ctx.guild.id), { "doc": doc, "channel": channel.id })
+
+    await ctx.send(f"{ctx.author.mention} set the birthday sheet for {ctx.guild.name}, announcing in {channel.mention}")
+
+    await self.refresh()
@@ -0,0 +1,164 @@
+from asyncio import Lock, get_event_loop, sleep
+from discord import File
+from discord.ext import tasks
+from discord.ext.commands import Bot, Cog, Context, command, is_owner
+from io import BytesIO
+from os import environ
+from sys import stderr
+from textwrap import dedent
+from time import perf_counter
+from typing import Any, Dict
+
+from ..util import chunk_message, record_error
+from ..util.memory import tracker
+from ..util.messages import MESSAGE_LIMIT
+from ..util.profiler import SamplingProfiler
+from ..util.watchdog import watchdog
+
+__all__ = ["DebugManager"]
+
+MAX_PROFILE_SECONDS = 300
+# minutes between memory reports printed to stderr (0 disables them)
+MEMORY_REPORT_MINUTES = int(environ.get("SAFETY_MEMORY_REPORT_MINUTES", "0"))
+
+class DebugManager(Cog):
+  """
+  Owner-only tools for diagnosing performance problems in the running bot
+  """
+  def __init__(self, bot: Bot):
+    self.bot = bot
+    self.profiling = Lock()
+
+    if MEMORY_REPORT_MINUTES:
+      self.memory_report.change_interval(minutes=MEMORY_REPORT_MINUTES)
+      self.memory_report.start()
+
+  def cog_unload(self):
+    self.memory_report.cancel()
+
+  def export_state(self) -> Dict[str, Any]:
+    return { "profiling": self.profiling }
+
+  def import_state(self, state: Dict[str, Any]):
+    # a profile started before the reload still holds the lock
+    self.profiling = state.get("profiling", self.profiling)
+
+  @tasks.loop(minutes=60)
+  async def memory_report(self):
+    """
+    Periodically prints a memory report, so growth between reports shows up in the logs
+    """
+    report = await get_event_loop().run_in_executor(None, tracker.report)
+    print(report, file=stderr)
+
+  @is_owner()
+  @command()
+  async def memory(self, ctx: Context, action: str = "report"):
+    """
+    DMs a memory report: RSS, the size of each subsystem's caches and, while tracemalloc
+    is running, allocations by cog/module/library with the change since the last report
+
+    >memory
+    >memory start: start tracemalloc (slows allocation down)
+    >memory stop: stop tracemalloc
+
+    Args:
+      action (str): report, start or stop
+    """
+    if action == "start":
+      tracker.start()
+      await ctx.send("Started tracing allocations")
+      return
+
+    if action == "stop":
+      tracker.stop()
+      await ctx.send("Stopped tracing allocations")
+      return
+
+    report = await get_event_loop().run_in_executor(None, tracker.report)
+
+    for chunk in chunk_message("", report.split("\n"), "\n", MESSAGE_LIMIT - len("```\n\n```")):
+      await ctx.author.send(f"```\n{chunk}\n```")
+
+  @is_owner()
+  @command()
+  async def profile(self, ctx: Context, seconds: int = 30):
+    """
+    Samples the stacks of every thread for some seconds and DMs back the result in
+    collapsed-stack format (for flamegraph.pl or speedscope)
+
+    >profile 60
+
+    Args:
+      seconds (int): how long to profile for (at most 300)
+    """
+    if seconds < 1 or seconds > MAX_PROFILE_SECONDS:
+      await ctx.send(f"Profile for between 1 and {MAX_PROFILE_SECONDS} seconds")
+      return
+
+    if self.profiling.locked():
+      await ctx.send("A profile is already running")
+      return
+
+    async with self.profiling:
+      await ctx.send(f"Profiling for {seconds} seconds")
+
+      profiler = SamplingProfiler()
+      profiler.start()
+      await sleep(seconds)
+      await get_event_loop().run_in_executor(None, profiler.stop)
+
+    top = "\n".join(f"{hits:6} {name}" for [name, hits] in profiler.top())
+    summary = dedent(f"""
+    {profiler.samples} samples over {seconds}s. Most frequent innermost frames:
+    """) + f"```\n{top}\n```"
+
+    data = BytesIO(profiler.collapsed().encode())
+    await ctx.author.send(summary, file=File(data, filename="profile.collapsed.txt"))
+
+  @is_owner()
+  @command()
+  async def reload(self, ctx: Context, name: str):
+    """
+    Reloads a cog's module in place, without reconnecting. The cog's in-memory state,
+    background loops and scheduled jobs are handed over to the new code
+
+    >reload birthdays
+
+    Args:
+      name (str): the name of the cog, as in SAFETY_COGS
+    """
+    # bot.bot imports the cogs, so it cannot be imported when this module loads
+    from ..bot import reload_cog
+
+    start = perf_counter()
+
+    try:
+      await reload_cog(name)
+    except Exception as e:
+      record_error("reload", e)
+      await ctx.send(f"Could not reload {name}: {e!r}")
+      return
+
+    await ctx.send(f"Reloaded {name} in {perf_counter() - start:.2f}s")
+
+  @is_owner()
+  @command()
+  async def stalls(self, ctx: Context):
+    """
+    DMs the stacks of the most recent callbacks that blocked the event loop.
+    Requires SAFETY_BLOCKING_THRESHOLD to be set
+    """
+    if not watchdog.running:
+      await ctx.send("The blocking detector is off (set SAFETY_BLOCKING_THRESHOLD)")
+      return
+
+    if not watchdog.history:
+      await ctx.send(f"No callbacks have blocked the loop for more than {watchdog.threshold}s")
+      return
+
+    report = "\n\n".join(f"{stall.when:%Y-%m-%d %H:%M:%S} blocked for over {stall.seconds:.3f}s\n{stall.stack}"
+      for stall in watchdog.history)
+
+    await ctx.author.send(f"{len(watchdog.history)} recent stalls",
+      file=File(BytesIO(report.encode()), filename="stalls.txt"))
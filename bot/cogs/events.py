@@ -1,52 +1,219 @@
-from datetime import datetime, timedelta
+from apscheduler.events import EVENT_JOB_MISSED, JobExecutionEvent
+from apscheduler.job import Job
+from apscheduler.jobstores.base import JobLookupError
+from asyncio import get_event_loop
+from datetime import date, datetime, timedelta
 from dateutil.tz import tzlocal
 from discord.channel import TextChannel
 from discord.ext import commands
 from discord.ext.commands import Bot, Context, guild_only
 from textwrap import dedent
-from typing import List
+from typing import Dict, List, Optional
+from uuid import uuid4
 
 from .base import CustomCog
-from ..util import get_local_date, redlocks, scheduler
+from ..util import Recurrence, get_date, get_local_date, record_error, redis, redlocks, scheduler, send_chunked
+from ..util.keys import guild_of, series_key, signups_key
 
 import bot
 
 __all__ = ["EventsManager"]
 
+# how long signups are kept after an event should have happened
+SIGNUP_GRACE = timedelta(days=1)
+# how late (in seconds) an event is still announced, if the bot was down when it was due
+MISFIRE_GRACE = 3600
+
+date_formats = ["%m/%d/%y", "%m/%d/%Y"]
+signup_policies = ["reset", "carry"]
+
+def event_members(event_id: str, members: List[str], series_id: str="") -> List[str]:
+  """
+  Returns everyone signed up for an event, with the creator first
+
+  Args:
+    event_id (str): the id of the event (job)
+    members (List[str]): the members stored with the job. The creator is first in the list
+    series_id (str): the id of the recurring event this is an occurrence of, if any
+
+  Returns (List[str]):
+    the creator, followed by everyone else who signed up (sorted)
+  """
+  keys = [signups_key(event_id, series_id)]
+
+  if series_id:
+    keys.append(signups_key(series_id))
+
+  creator = members[0]
+  others = redis.sunion(keys).union(members[1:])
+  others.discard(creator)
+
+  return [creator] + sorted(others)
+
+def get_recurrence(series: Dict[str, str]) -> Recurrence:
+  """
+  Builds the recurrence rule stored in a series hash
+  """
+  until = date.fromisoformat(series["until"]) if series.get("until") else None
+  skips = [date.fromisoformat(day) for day in series.get("skips", "").split()]
+
+  return Recurrence(series["rule"], datetime.fromisoformat(series["start"]).astimezone(tzlocal()), until, skips)
+
+def schedule_occurrence(series_id: str, series: Dict[str, str], after: datetime) -> Optional[Job]:
+  """
+  Materializes the next occurrence of a recurring event as a job.
+  If the rule has no further occurrences, the series is removed.
+  Callers should hold the redlock for the series
+
+  Args:
+    series_id (str): the id of the recurring event
+    series (Dict[str, str]): the series hash
+    after (datetime): the next occurrence is strictly after this time
+
+  Returns (Optional[Job]):
+    the job for the next occurrence, or None if the series has ended
+  """
+  run_date = get_recurrence(series).next_after(after)
+
+  if run_date is None:
+    redis.delete(series_key(series_id), signups_key(series_id))
+    return None
+
+  occurrence_id = uuid4().hex
+  time = run_date.strftime("%m/%d/%y %H:%M %Z")
+
+  redis.hmset(series_key(series_id), {
+    "next": occurrence_id,
+    "current": run_date.isoformat()
+  })
+
+  return scheduler.add_job(register_event, 'date', id=occurrence_id, run_date=run_date,
+    misfire_grace_time=MISFIRE_GRACE, coalesce=True, args=[
+      int(series["channel"]), series["event"], time, int(series["author_id"]), [series["author"]],
+      occurrence_id, series_id
+    ])
+
+def advance_series(series_id: str, occurrence_id: str):
+  """
+  Schedules the occurrence after occurrence_id, carrying over signups if the series asks for it
+
+  Args:
+    series_id (str): the id of the recurring event
+    occurrence_id (str): the occurrence that just happened
+  """
+  with redlocks.create_lock(series_id):
+    series = redis.hgetall(series_key(series_id))
+
+    if not series or series.get("next") != occurrence_id:
+      return
+
+    # an occurrence announced late does not schedule the ones that were also missed meanwhile
+    after = max(datetime.fromisoformat(series["current"]), datetime.now(tzlocal()) - timedelta(seconds=MISFIRE_GRACE))
+    job = schedule_occurrence(series_id, series, after)
+
+    if job and series.get("signups") == "carry" and redis.exists(signups_key(occurrence_id, series_id)):
+      with redis.pipeline() as pipe:
+        pipe.sunionstore(signups_key(job.id, series_id), [signups_key(occurrence_id, series_id)])
+        pipe.expireat(signups_key(job.id, series_id), job.next_run_time + SIGNUP_GRACE)
+        pipe.execute()
+
+def reconcile_series() -> int:
+  """
+  Schedules the next occurrence of every recurring event whose scheduled occurrence no longer
+  exists, because it was missed (the bot was down for longer than MISFIRE_GRACE) and so never
+  advanced the series (blocking, run in an executor)
+
+  Returns (int):
+    the number of series rescheduled
+  """
+  rescheduled = 0
+
+  for key in redis.scan_iter(match=series_key("*"), count=1000):
+    series_id = guild_of(key)
+
+    with redlocks.create_lock(series_id):
+      series = redis.hgetall(key)
+
+      if not series or scheduler.get_job(series.get("next", "")) is not None:
+        continue
+
+      schedule_occurrence(series_id, series, datetime.now(tzlocal()))
+      rescheduled += 1
+
+  return rescheduled
+
 async def register_event(channel_id: int, event: str, time: str, \
-                         author_id: str, members: List[str]=[]):
+                         author_id: str, members: List[str]=[], event_id: str="", series_id: str=""):
   """
   Notifies all members in the channel "channel_id" that the event "event" is about to happen.
   Also mentions all members who signed up.
+  If this is an occurrence of a recurring event, the next occurrence is scheduled
 
   Args:
     channel_id (int): the id of the channel the event was created
     event (str): the name of the event
     time (str): a date string representing when the event should happen
     author_id (str): the id of the creator of this event (if a failure occurs)
-    members (List[str]): a list of people who have signed up for this event. The creator is first in the list
+    members (List[str]): the creator of the event (older events may also include signups)
+    event_id (str): the id of this event, used to find everyone who signed up
+    series_id (str): the id of the recurring event this is an occurrence of, if any
   """
   try:
-    message = dedent(f"""
-    Time for **{event}**!
-    {" ".join(members)} 
-    """)
+    if event_id:
+      members = event_members(event_id, members, series_id)
+
+    if series_id:
+      advance_series(series_id, event_id)
+
     channel = bot.bot.get_channel(channel_id)
 
     if channel:
-      await channel.send(message)
+      await send_chunked(channel, f"Time for **{event}**!\n", members)
     else:
       author = bot.bot.get_user(author_id)
 
       if author:
         error_msg = f"Failed to hold event {event}: the channel no longer exists"
         await author.send(error_msg)
+
+    # only once everyone was notified, so a failed send keeps the signups (until they expire)
+    if event_id:
+      redis.delete(signups_key(event_id, series_id))
   except Exception as e:
-    print(e)
+    record_error("register_event", e)
 
 class EventsManager(CustomCog):
   def __init__(self, bot: Bot):
     self.bot = bot
+    self.reconcile_pending = False
+    scheduler.add_listener(self.on_job_missed, EVENT_JOB_MISSED)
+
+  def cog_unload(self):
+    scheduler.remove_listener(self.on_job_missed)
+
+  def on_job_missed(self, event: JobExecutionEvent):
+    """
+    Reconciles the recurring events once a job was missed, since a missed occurrence cannot
+    advance its series. Several misses at once share one reconciliation
+    """
+    if not self.reconcile_pending:
+      self.reconcile_pending = True
+      self.bot.loop.call_soon_threadsafe(lambda: self.bot.loop.create_task(self.reconcile()))
+
+  async def reconcile(self):
+    self.reconcile_pending = False
+
+    try:
+      await get_event_loop().run_in_executor(None, reconcile_series)
+    except Exception as e:
+      record_error("reconcile_series", e)
+
+  @commands.Cog.listener()
+  async def on_ready(self):
+    """
+    Reconciles the recurring events whose occurrences were missed before the cog was set up
+    """
+    await self.reconcile()
 
   @guild_only()
   @commands.command()
@@ -66,7 +233,10 @@ class EventsManager(CustomCog):
     The following time zones have been provided:
     - EDT, EST, CDT, CST, MDT, MST, PDT, PST, AKDT, AKST
 
-    For other time zones, please use UTC offset (e.g. UTC+4 for EDT)
+    You can also use IANA zone names (1/01/13 08:27 America/Los_Angeles),
+    or a UTC offset (e.g. UTC+4 for EDT).
+
+    Relative times are accepted as well: in XdXhXmXs (>schedule "Soon" "in 1h30m")
     """
     scheduled_date = get_local_date(time)
 
@@ -80,10 +250,17 @@ class EventsManager(CustomCog):
       raise ValueError(f"{scheduled_date} ({local_time} is in the past")
 
     wait = (scheduled_date - now)
-    
-    job = scheduler.add_job(register_event, 'date', run_date=scheduled_date, args=[
-      ctx.channel.id, event, time, ctx.message.author.id, [ctx.message.author.mention]
-    ])
+    event_id = uuid4().hex
+
+    with redis.pipeline() as pipe:
+      pipe.sadd(signups_key(event_id), ctx.message.author.mention)
+      pipe.expireat(signups_key(event_id), scheduled_date + SIGNUP_GRACE)
+      pipe.execute()
+
+    job = scheduler.add_job(register_event, 'date', id=event_id, run_date=scheduled_date,
+      misfire_grace_time=MISFIRE_GRACE, coalesce=True, args=[
+        ctx.channel.id, event, time, ctx.message.author.id, [ctx.message.author.mention], event_id
+      ])
     
     msg = dedent(f"""
     **{event}** by {ctx.message.author.mention} for {time} ({local_time}, {wait} from now)
@@ -92,6 +269,91 @@ class EventsManager(CustomCog):
 
     await ctx.send(msg)
 
+  @guild_only()
+  @commands.command()
+  async def recurring(self, ctx: Context, event: str, time: str, rule: str, *options):
+    """
+    Schedule a repeating event. Guild-only.
+
+    >recurring "Game night" "3/27/20 19:00 EDT" weekly
+    >recurring "Standup" "3/30/20 9:00 EDT" "cron 0 9 * * mon-fri" until=6/1/20 skip=4/10/20
+    >recurring "Raid" "3/28/20 20:00 PDT" "every 2 weeks" signups=carry
+
+    The time is the first occurrence, in any format accepted by >schedule.
+    The event repeats at the same server local time.
+
+    Rules:
+    - daily, weekly, biweekly
+    - every N days, every N weeks
+    - cron <minute> <hour> <day of month> <month> <day of week>
+
+    Options:
+    - until=mm/dd/yy: the last date the event can happen on
+    - skip=mm/dd/yy,mm/dd/yy: dates with no event
+    - signups=reset|carry: whether signups for one occurrence carry over to the next (default reset)
+
+    Sign up with the series id to attend every occurrence, or with the occurrence id
+    to attend just that one. Cancelling an occurrence skips it, cancelling the series ends it.
+    """
+    scheduled_date = get_local_date(time)
+
+    if scheduled_date == None:
+      raise ValueError(f"Could not parse {time}")
+
+    series = {
+      "channel": ctx.channel.id,
+      "event": event,
+      "author_id": ctx.message.author.id,
+      "author": ctx.message.author.mention,
+      "rule": rule,
+      "start": scheduled_date.isoformat(),
+      "until": "",
+      "skips": "",
+      "signups": "reset"
+    }
+
+    for option in options:
+      [name, _, value] = option.partition("=")
+
+      if name == "until" or name == "skip":
+        days = [get_date(day, date_formats) for day in value.split(",")]
+
+        if None in days or (name == "until" and len(days) != 1):
+          raise ValueError(f"Could not parse {value}. Dates should look like mm/dd/yy")
+
+        isodays = " ".join(day.date().isoformat() for day in days)
+
+        if name == "until":
+          series["until"] = isodays
+        else:
+          series["skips"] = (series["skips"] + " " + isodays).strip()
+      elif name == "signups" and value in signup_policies:
+        series["signups"] = value
+      else:
+        raise ValueError(f"Unknown option {option}")
+
+    # validates the rule before anything is stored
+    get_recurrence(series)
+
+    series_id = uuid4().hex
+
+    with redlocks.create_lock(series_id):
+      redis.hmset(series_key(series_id), series)
+      job = schedule_occurrence(series_id, series, datetime.now(tzlocal()))
+
+    if job is None:
+      raise ValueError(f"{rule} never happens after {time}")
+
+    local_time = job.next_run_time.strftime("%m/%d/%y %H:%M:%S %p %Z")
+
+    msg = dedent(f"""
+    **{event}** by {ctx.message.author.mention}, repeating {rule}. Next up: {local_time}
+    Sign up for every occurrence with the id **{series_id}**
+    Sign up for the next one only with the id **{job.id}**
+    """)
+
+    await ctx.send(msg)
+
   @commands.command()
   async def signup(self, ctx: Context, event_id: str):
     """
@@ -101,36 +363,61 @@ class EventsManager(CustomCog):
 
     >signup 00000000000000000000000000000000
 
+    You can also sign up for every occurrence of a recurring event with its series id
+
     Args:
       event_id (str): the hex id made when creating an event
     """
-    added = False
-    author = ""
-    channel = None
-    event = ""
-    time = ""
+    series = redis.hgetall(series_key(event_id))
 
-    with redlocks.create_lock(event_id):
-      job = scheduler.get_job(event_id)
+    if series:
+      channel = self.bot.get_channel(int(series["channel"]))
 
-      if job is None:
+      if channel is None or not ctx.message.author in channel.members:
         raise ValueError(f"The job {event_id} does not exist")
 
-      channel = self.bot.get_channel(job.args[0])
+      event = series["event"]
+      author = series["author"]
 
-      if channel is None or not ctx.message.author in channel.members:
-        raise ValueError(f"The job {event_id} does not exist")
+      if redis.sadd(signups_key(event_id), ctx.message.author.mention) == 1:
+        await channel.send(f"{ctx.message.author.mention} has signed up for every {event} by {author}")
+      else:
+        await ctx.message.author.send(f"You have already signed up for every {event} by {author}")
+
+      return
+
+    job = scheduler.get_job(event_id)
+
+    if job is None:
+      raise ValueError(f"The job {event_id} does not exist")
+
+    channel = self.bot.get_channel(job.args[0])
+
+    if channel is None or not ctx.message.author in channel.members:
+      raise ValueError(f"The job {event_id} does not exist")
+
+    if len(job.args) < 6:
+      # events created before signups were kept in a set track signups with the job
+      with redlocks.create_lock(event_id):
+        job = scheduler.get_job(event_id)
 
-      new_member = ctx.message.author.mention
-      author = job.args[4][0]
-      event = job.args[1]
-      time = job.args[2]
+        if job is None:
+          raise ValueError(f"The job {event_id} does not exist")
 
-      if new_member not in job.args[4]:
-        members = job.args[4] + [new_member]
-        new_args = job.args[0:4] + (members,)
-        job.modify(args=new_args)
-        added = True
+        if len(job.args) < 6:
+          redis.sadd(signups_key(event_id), *job.args[4])
+          job.modify(args=job.args[0:5] + (event_id,))
+
+    new_member = ctx.message.author.mention
+    author = job.args[4][0]
+    event = job.args[1]
+    time = job.args[2]
+    series_id = job.args[6] if len(job.args) >= 7 else ""
+
+    with redis.pipeline() as pipe:
+      pipe.sadd(signups_key(event_id, series_id), new_member)
+      pipe.expireat(signups_key(event_id, series_id), job.next_run_time + SIGNUP_GRACE)
+      added = pipe.execute()[0] == 1
     
     if added:
       await channel.send(f"{ctx.message.author.mention} has signed up for {event} at {time} by {author}")
@@ -144,6 +431,9 @@ class EventsManager(CustomCog):
     You must be the creator of an event to cancel it.
     This will notify members in the channel that you have cancelled the event.
 
+    For recurring events, cancelling an occurrence skips just that one,
+    and cancelling the series id ends the event for good.
+
     >cancel 00000000000000000000000000000000
 
     Args:
@@ -151,23 +441,53 @@ class EventsManager(CustomCog):
     """
     args      = []
     author    = ctx.message.author.mention
-    error_msg = ""
+    error_msg = f"Could not find a job {event_id}. Make sure you provided the correct id and are the creator of this job"
+    members   = []
+    suffix    = ""
+
+    if redis.exists(series_key(event_id)):
+      with redlocks.create_lock(event_id):
+        series = redis.hgetall(series_key(event_id))
 
-    with redlocks.create_lock(event_id):
+        if series and series["author"] == author:
+          error_msg = ""
+          args = [int(series["channel"]), series["event"], f"every {series['rule']}"]
+          members = event_members(series["next"], [author], event_id)
+
+          try:
+            scheduler.remove_job(series["next"])
+          except JobLookupError:
+            pass
+
+          redis.delete(series_key(event_id), signups_key(event_id), signups_key(series["next"], event_id))
+    else:
       job = scheduler.get_job(event_id)
+      series_id = job.args[6] if job and len(job.args) >= 7 else ""
 
-      if job:
-        args = job.args
+      with redlocks.create_lock(series_id or event_id):
+        job = scheduler.get_job(event_id)
+
+        if job and job.args[4][0] == author:
+          args = job.args
+          error_msg = ""
 
-        if args[4][0] == author:
           try:
             scheduler.remove_job(event_id)
+            members = event_members(event_id, args[4], series_id)
+            redis.delete(signups_key(event_id, series_id))
+
+            if series_id:
+              series = redis.hgetall(series_key(series_id))
+              skipped = job.next_run_time.date().isoformat()
+              series["skips"] = (series.get("skips", "") + " " + skipped).strip()
+              redis.hset(series_key(series_id), "skips", series["skips"])
+
+              next_job = schedule_occurrence(series_id, series, job.next_run_time)
+
+              if next_job:
+                suffix = f" (the next one is {next_job.args[2]}, sign up with **{next_job.id}**)"
           except:
             error_msg = "An error occurred when trying to cancel your job"
-        else:
-          error_msg = f"Could not find a job {event_id}. Make sure you provided the correct id and are the creator of this job"
-      else:
-        error_msg = f"Could not find a job {event_id}. Make sure you provided the correct id and are the creator of this job"
 
     if error_msg:
       await ctx.send(error_msg)
@@ -177,9 +497,5 @@ class EventsManager(CustomCog):
       if channel is None:
         await ctx.send(f"The channel {args[0]} no longer exists")
       else:
-        msg = dedent(f"""
-        {author} cancelled "**{args[1]}**" for {args[2]}
-        {" ".join(args[4])}
-        """)
-
-        await channel.send(msg)
\ No newline at end of file
+        msg = f"{author} cancelled \"**{args[1]}**\" for {args[2]}{suffix}\n"
+        await send_chunked(channel, msg, members)
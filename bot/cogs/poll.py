@@ -1,17 +1,17 @@
 from asyncio import gather, sleep
 from datetime import datetime, timedelta
 from dateutil.tz import tzlocal
-from discord import Message
+from discord import Message, Reaction
 from discord.ext import commands
 from discord.ext.commands import Bot, Cog, Context, command
 from discord.utils import get
-from re import match
 from textwrap import dedent
 from time import time
-from typing import List, Tuple
+from typing import Any, Dict, List, Tuple
 
 from .base import CustomCog
-from ..util import scheduler
+from ..util.memory import register_cache
+from ..util import parse_duration, record_error, scheduler
 
 import bot
 
@@ -40,8 +40,6 @@ SECONDS_IN_DAY = 24 * SECONDS_IN_HOUR
 def vote_str(count: int) -> str:
   return "vote" if count == 1 else "votes"
 
-pattern = r'(?P<days>\d+d)?(?P<hours>\d+h)?(?P<minutes>\d+m)?(?P<seconds>\d+s)?$'
-
 TimeDuration = Tuple[int, int, int, int]
 
 def parse_time(time: str) -> TimeDuration:
@@ -59,30 +57,7 @@ def parse_time(time: str) -> TimeDuration:
   Raises:
     ValueError: if the input does not match the format, or the time is 0
   """
-  seconds = 0
-
-  try:
-    seconds = SECONDS_IN_MINUTE * int(time)
-  except ValueError:
-    result = match(pattern, time)
-
-    if result is None:
-      raise ValueError(f"{time} is not a valid time string")
-
-    if result.group("seconds"):
-      seconds = int(result.group("seconds")[:-1])
-
-    if result.group("minutes"):
-      minutes = int(result.group("minutes").replace("m", ""))
-      seconds += SECONDS_IN_MINUTE * minutes
-
-    if result.group("hours"):
-      hours = int(result.group("hours")[:-1])
-      seconds += SECONDS_IN_HOUR * hours
-
-    if result.group("days"):
-      days = int(result.group("days")[:-1])
-      seconds += SECONDS_IN_DAY * days
+  seconds = parse_duration(time)
 
   if seconds < 30:
     raise ValueError("You must wait at least 30 seconds for a poll")
@@ -162,6 +137,74 @@ async def alert_author(author_id: str, topic: str, reason=""):
   if author:
     await author.send(f"We could not deliver your poll on {topic}{reason}")
 
+def render_results(content: str, reactions: List[Reaction]) -> str:
+  """
+  Tallies the reactions on a poll message into the results message
+
+  Args:
+    content (str): the text of the poll message
+    reactions (List[Reaction]): the reactions on the poll message
+
+  Return (str):
+    the results, with the winners first
+  """
+  lines = content.split("\n")
+
+  # remove the leading numbers (1., 10.)
+  options = [
+    line[line.index(".") + 2:] for line in lines[2:]
+  ]
+
+  results: List[Tuple[int, str]] = []
+  others: List[Tuple[int, str]] = []
+
+  for reaction in reactions:
+    try:
+      index = emojis_order.index(reaction.emoji)
+
+      if index < len(options):
+        results.append((reaction.count - 1, options[index]))
+      else:
+        others.append((reaction.count, str(reaction)))
+    except ValueError:
+      others.append((reaction.count, str(reaction)))
+  
+  others.sort(reverse=True)
+  results.sort(reverse=True)
+  
+  wins = [results[0][1]]
+  max_count = results[0][0]
+
+  for idx in range(1, len(results)):
+    if results[idx][0] == max_count:
+      wins.append(results[idx][1])
+    else:
+      break
+  
+  wins.sort()
+
+  max_vote_msg = vote_str(max_count)
+  result_msg = f"results of {lines[0]}:\n"
+
+  if len(others) > 0 and others[0][0] > results[0][0]:
+    result_msg += dedent(f""""
+      Your options were crap so {others[0][1]} wins with **{others[0][0]}** votes
+      That being said, other results exist, so here is your actual poll:
+
+    """)
+
+  if len(wins) > 1:
+    joined_str = ", ".join(wins)
+    result_msg += f"**Tie between {joined_str}** ({max_count} {max_vote_msg} each)\n\n>>> "
+  else:
+    result_msg += f"**{wins[0]}** wins! ({max_count} {max_vote_msg})\n\n>>> "
+
+  for idx in range(len(wins), len(results)):
+    vote_msg = vote_str(results[idx][0])
+    result_msg += f"**{results[idx][1]}** ({results[idx][0]} {vote_msg})\n"
+
+  return result_msg
+
 async def poll_result(author_id: str, channel_id: int, msg_id: int, topic: str):
   """
   Handles determining the results of a poll in the channel channel_id with id msg_id
@@ -186,69 +229,21 @@ async def poll_result(author_id: str, channel_id: int, msg_id: int, topic: str):
       await alert_author(author_id, topic, " because the message no longer exists")
       return
       
-    lines = msg.content.split("\n")
-
-    # remove the leading numbers (1., 10.)
-    options = [
-      line[line.index(".") + 2:] for line in lines[2:]
-    ]
-
-    results: List[Tuple[int, str]] = []
-    others: List[Tuple[int, str]] = []
-
-    for reaction in msg.reactions:
-      try:
-        index = emojis_order.index(reaction.emoji)
-
-        if index < len(options):
-          results.append((reaction.count - 1, options[index]))
-        else:
-          others.append((reaction.count, str(reaction)))
-      except ValueError:
-        others.append((reaction.count, str(reaction)))
-    
-    others.sort(reverse=True)
-    results.sort(reverse=True)
-    
-    wins = [results[0][1]]
-    max_count = results[0][0]
-
-    for idx in range(1, len(results)):
-      if results[idx][0] == max_count:
-        wins.append(results[idx][1])
-      else:
-        break
-    
-    wins.sort()
-
-    max_vote_msg = vote_str(max_count)
-    result_msg = f"results of {lines[0]}:\n"
-
-    if len(others) > 0 and others[0][0] > results[0][0]:
-      result_msg += dedent(f""""
-        Your options were crap so {others[0][1]} wins with **{others[0][0]}** votes
-        That being said, other results exist, so here is your actual poll:
-
-      """)
-
-    if len(wins) > 1:
-      joined_str = ", ".join(wins)
-      result_msg += f"**Tie between {joined_str}** ({max_count} {max_vote_msg} each)\n\n>>> "
-    else:
-      result_msg += f"**{wins[0]}** wins! ({max_count} {max_vote_msg})\n\n>>> "
-
-    for idx in range(len(wins), len(results)):
-      vote_msg = vote_str(results[idx][0])
-      result_msg += f"**{results[idx][1]}** ({results[idx][0]} {vote_msg})\n"
-
-    await channel.send(result_msg)
+    await channel.send(render_results(msg.content, msg.reactions))
   except Exception as e:
-    print(e)
+    record_error("poll_result", e)
 
 class PollManager(CustomCog):
   def __init__(self, bot: Bot):
     self.bot = bot
     self.polls: List[Tuple[int, float, Message]] = []
+    register_cache("polls", lambda: len(self.polls))
+
+  def export_state(self) -> Dict[str, Any]:
+    return { "polls": self.polls }
+
+  def import_state(self, state: Dict[str, Any]):
+    self.polls = state.get("polls", [])
     
   @commands.command()
   async def poll(self, ctx: Context, topic: str, timing: str, *options):
@@ -0,0 +1,216 @@
+from asyncio import get_event_loop, sleep
+from datetime import datetime
+from discord import Guild, HTTPException, Member, NotFound
+from discord.ext import commands, tasks
+from discord.ext.commands import Bot, Context, command, is_owner
+from itertools import islice
+from os import environ
+from time import perf_counter, time
+from typing import Any, Dict, NamedTuple, Optional
+
+from .base import CustomCog
+from ..util import record_error, redis
+from ..util.retention import GRACE_SECONDS, GUILD_POLICY, MEMBER_POLICY, apply_policy, cancel_cleanup, \
+classify, due_cleanups, guild_entry, member_entry, queue_cleanups, queued_cleanups, reclaimed_bytes
+
+__all__ = ["RetentionManager"]
+
+SWEEP_MINUTES = float(environ.get("SAFETY_RETENTION_SWEEP_MINUTES", "60"))
+# keys scanned, or cleanups run, between pauses
+SWEEP_BATCH = int(environ.get("SAFETY_RETENTION_BATCH", "200"))
+PAUSE_SECONDS = float(environ.get("SAFETY_RETENTION_PAUSE_SECONDS", "1"))
+
+class Sweep(NamedTuple):
+  finished: datetime
+  seconds: float
+  scanned: int
+  # cleanups queued for guilds and members found gone, and due cleanups run
+  queued: int
+  cleaned: int
+  reclaimed: int
+
+class RetentionManager(CustomCog):
+  """
+  Cleans up after guilds the bot was removed from and members who left, following the
+  retention policies in bot.util.retention
+  """
+  def __init__(self, bot: Bot):
+    self.bot = bot
+    self.last_sweep: Optional[Sweep] = None
+    self.sweep.change_interval(minutes=SWEEP_MINUTES)
+    self.sweep.start()
+
+  def cog_unload(self):
+    self.sweep.cancel()
+
+  def export_state(self) -> Dict[str, Any]:
+    return { "last_sweep": self.last_sweep }
+
+  def import_state(self, state: Dict[str, Any]):
+    self.last_sweep = state.get("last_sweep")
+
+  @commands.Cog.listener()
+  async def on_guild_remove(self, guild: Guild):
+    if GUILD_POLICY != "keep":
+      queue_cleanups([guild_entry(guild.id)])
+
+  @commands.Cog.listener()
+  async def on_guild_join(self, guild: Guild):
+    cancel_cleanup(guild_entry(guild.id))
+
+  @commands.Cog.listener()
+  async def on_member_remove(self, member: Member):
+    if MEMBER_POLICY != "keep":
+      queue_cleanups([member_entry(member.guild.id, member.id)])
+
+  @commands.Cog.listener()
+  async def on_member_join(self, member: Member):
+    cancel_cleanup(member_entry(member.guild.id, member.id))
+
+  def stale_entry(self, key: str) -> Optional[str]:
+    """
+    Returns the cleanup a key is due for if its guild or member is gone, otherwise None.
+    Members are only checked in guilds whose member list is complete (chunked)
+    """
+    owner = classify(key)
+
+    if owner is None:
+      return None
+
+    [guild_id, user_id] = owner
+    guild = self.bot.get_guild(int(guild_id))
+
+    if guild is None:
+      return guild_entry(guild_id) if GUILD_POLICY != "keep" else None
+
+    if user_id and MEMBER_POLICY != "keep" and guild.chunked and guild.get_member(int(user_id)) is None:
+      return member_entry(guild_id, user_id)
+
+    return None
+
+  async def still_gone(self, entry: str) -> bool:
+    """
+    Checks that the guild or member of a due cleanup is still gone. Members of guilds whose
+    member list is incomplete (not chunked) are looked up through the API; if that fails, the
+    member is assumed present, so their data is kept
+    """
+    [kind, _, ids] = entry.partition(":")
+    [guild_id, _, user_id] = ids.partition(":")
+    guild = self.bot.get_guild(int(guild_id))
+
+    if guild is None or kind == "guild":
+      return guild is None
+
+    if guild.get_member(int(user_id)) is not None:
+      return False
+
+    if guild.chunked:
+      return True
+
+    try:
+      await guild.fetch_member(int(user_id))
+      return False
+    except NotFound:
+      return True
+    except HTTPException as e:
+      record_error("retention_fetch_member", e)
+      return False
+
+  async def run_sweep(self) -> Sweep:
+    """
+    Runs the cleanups that are due, then scans every guild's keys in batches to queue cleanups
+    for removals the bot missed (while offline, for example). Pauses between batches so the
+    sweep never holds redis (or the event loop) for long
+    """
+    loop = get_event_loop()
+    started = perf_counter()
+    [cleaned, reclaimed, queued, scanned] = [0, 0, 0, 0]
+
+    while True:
+      entries = await loop.run_in_executor(None, due_cleanups, SWEEP_BATCH)
+
+      for entry in entries:
+        if not await self.still_gone(entry):
+          # rejoined (or re-added the bot) while the bot was offline, so no join event cancelled it
+          await loop.run_in_executor(None, cancel_cleanup, entry)
+          continue
+
+        reclaimed += await loop.run_in_executor(None, apply_policy, entry)
+        cleaned += 1
+
+      if len(entries) < SWEEP_BATCH:
+        break
+
+      await sleep(PAUSE_SECONDS)
+
+    keys = redis.scan_iter(match="{*}:*", count=SWEEP_BATCH)
+
+    while True:
+      batch = await loop.run_in_executor(None, lambda: list(islice(keys, SWEEP_BATCH)))
+
+      if not batch:
+        break
+
+      scanned += len(batch)
+      stale = { entry for entry in map(self.stale_entry, batch) if entry }
+
+      if stale:
+        await loop.run_in_executor(None, queue_cleanups, stale)
+        queued += len(stale)
+
+      await sleep(PAUSE_SECONDS)
+
+    self.last_sweep = Sweep(datetime.now(), perf_counter() - started, scanned, queued, cleaned, reclaimed)
+
+    return self.last_sweep
+
+  @tasks.loop(minutes=60)
+  async def sweep(self):
+    try:
+      await self.run_sweep()
+    except Exception as e:
+      record_error("retention_sweep", e)
+
+  @sweep.before_loop
+  async def before_sweep(self):
+    await self.bot.wait_until_ready()
+
+  @is_owner()
+  @command()
+  async def retention(self, ctx: Context, action: str = "report"):
+    """
+    Reports the retention policies, the queued cleanups and the memory reclaimed (owner only)
+
+    >retention
+    >retention sweep: sweep now instead of waiting for the next sweep
+
+    Args:
+      action (str): report or sweep
+    """
+    if action == "sweep":
+      await ctx.send("Sweeping")
+      await self.run_sweep()
+    elif action != "report":
+      raise ValueError("Choose report or sweep")
+
+    [count, next_due] = await get_event_loop().run_in_executor(None, queued_cleanups)
+    total = sum(reclaimed_bytes.values.values())
+    message = (
+      f">>> Policies: members {MEMBER_POLICY}, guilds {GUILD_POLICY}, "
+      f"after {GRACE_SECONDS / 3600:g} hours\n"
+      f"Queued cleanups: {count}"
+    )
+
+    if next_due is not None:
+      message += f" (next in {max(next_due - time(), 0) / 3600:.1f} hours)"
+
+    message += f"\nReclaimed since start: {total:,.0f} bytes"
+
+    if self.last_sweep:
+      sweep = self.last_sweep
+      message += (
+        f"\nLast sweep {sweep.finished:%Y-%m-%d %H:%M} ({sweep.seconds:.1f}s): scanned {sweep.scanned} keys, "
+        f"queued {sweep.queued} cleanups, ran {sweep.cleaned} reclaiming {sweep.reclaimed:,} bytes"
+      )
+
+    await ctx.send(message)
@@ -1,12 +1,33 @@
-from discord import Member, Role
+from asyncio import Semaphore, gather
+from discord import HTTPException, Member, Message, NotFound, Role
 from discord.ext import commands
-from discord.ext.commands import CommandInvokeError, Context, Greedy
-from typing import Set
+from discord.ext.commands import BadArgument, CommandError, CommandInvokeError, Context, Converter, Greedy, RoleConverter
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Set
+from uuid import uuid4
 
 from .base import CustomCog
+from ..util import get_date, record_error, redis
+from ..util.keys import role_job_key, role_pending_key
+from ..util.metrics import command_errors
 
 __all__ = ["RolesManager"]
 
+# member edits in flight at once per bulk job. discord.py still queues requests per rate limit bucket
+EDIT_CONCURRENCY = 5
+PROGRESS_SECONDS = 3
+
+# the ids of unfinished bulk role jobs
+JOBS_KEY = "role_jobs"
+
+date_formats = ["%m/%d/%y", "%m/%d/%Y", "%Y-%m-%d"]
+
+actions = {
+  "add": "Adding",
+  "remove": "Removing",
+  "set": "Setting"
+}
+
 class NoRolesError(Exception):
   """An exception that is thrown when no valid roles are given"""
   async def handle_error(self, ctx: Context):
@@ -46,18 +67,50 @@ def roles_str(person: Member, roles: commands.Greedy[Role]) -> str:
 
   return f"{message} for {person}: {roleIds}"
 
+class MemberFilter(Converter):
+  """
+  Selects members for bulk role commands:
+  with:<role> matches members who have a role, and after:<date> members who joined after a date
+  """
+  async def convert(self, ctx: Context, argument: str) -> Callable[[Member], bool]:
+    [kind, _, value] = argument.partition(":")
+
+    if kind == "with" and value:
+      role = await RoleConverter().convert(ctx, value)
+      return lambda member: role in member.roles
+
+    if kind == "after" and value:
+      date = get_date(value, date_formats)
+
+      if date is None:
+        raise BadArgument(f"{value} is not a date (use mm/dd/yy or yyyy-mm-dd)")
+
+      return lambda member: member.joined_at is not None and member.joined_at > date
+
+    raise BadArgument(f"{argument} is not a member filter")
+
 class RolesManager(CustomCog):
   """
   Shortcut for managing user roles
   """
   def __init__(self, bot):
     self.bot = bot
+    # ids of bulk jobs running in this process
+    self.running: Set[str] = set()
 
-  async def cog_command_error(self, ctx: Context, error: CommandInvokeError):
+  def export_state(self) -> Dict[str, Any]:
+    return { "running": self.running }
+
+  def import_state(self, state: Dict[str, Any]):
+    # shared with the jobs still running in the old cog, so they are not started twice
+    self.running = state.get("running", set())
+
+  async def cog_command_error(self, ctx: Context, error: CommandError):
     """
     Handles errors for roles commands
     """
-    if isinstance(error.original, NoRolesError):
+    if isinstance(error, CommandInvokeError) and isinstance(error.original, NoRolesError):
+      command_errors.inc(ctx.command.qualified_name)
       await error.original.handle_error(ctx)
     else:
       await super().cog_command_error(ctx, error)
@@ -120,4 +173,240 @@ class RolesManager(CustomCog):
     roles = remove_dupe_roles(roles)
 
     await person.edit(roles=roles)
-    await ctx.send(f"Setting {roles_str(person, roles)}")
\ No newline at end of file
+    await ctx.send(f"Setting {roles_str(person, roles)}")
+
+  async def bulk(self, ctx: Context, action: str, members: List[Member],
+                 filters: List[Callable[[Member], bool]], roles: List[Role]):
+    """
+    Starts a bulk role job for the given members, plus every member matching all filters
+    """
+    roles = remove_dupe_roles(roles)
+    targets = {member.id for member in members}
+
+    if filters:
+      targets.update(member.id for member in ctx.guild.members
+        if all(matches(member) for matches in filters))
+
+    if not targets:
+      raise ValueError("No members match")
+
+    role_names = [role.name for role in roles]
+    progress = await ctx.send(f"{actions[action]} roles {role_names} for {len(targets)} members: 0/{len(targets)}")
+
+    job_id = uuid4().hex
+
+    with redis.pipeline() as pipe:
+      pipe.hmset(role_job_key(job_id), {
+        "action": action,
+        "guild": ctx.guild.id,
+        "channel": ctx.channel.id,
+        "message": progress.id,
+        "roles": " ".join(str(role.id) for role in roles),
+        "total": len(targets),
+        "done": 0,
+        "failed": 0
+      })
+      pipe.sadd(role_pending_key(job_id), *targets)
+      pipe.sadd(JOBS_KEY, job_id)
+      pipe.execute()
+
+    await self.run_job(job_id, progress)
+
+  async def run_job(self, job_id: str, progress: Optional[Message]):
+    """
+    Edits every pending member of a bulk job, with bounded concurrency.
+    Each finished member is removed from the pending set, so a job interrupted
+    by a restart picks up where it left off. If the progress message is deleted,
+    the job keeps going without reporting progress
+    """
+    if job_id in self.running:
+      return
+
+    self.running.add(job_id)
+
+    try:
+      job = redis.hgetall(role_job_key(job_id))
+      guild = self.bot.get_guild(int(job["guild"])) if job else None
+
+      if guild is None:
+        self.remove_job(job_id)
+        return
+
+      roles = [guild.get_role(int(role_id)) for role_id in job["roles"].split()]
+      roles = [role for role in roles if role is not None]
+      action = job["action"]
+      total = int(job["total"])
+      counts = { "done": int(job["done"]), "failed": int(job["failed"]) }
+
+      semaphore = Semaphore(EDIT_CONCURRENCY)
+      last_update = monotonic()
+      role_names = [role.name for role in roles]
+
+      async def report(content: str):
+        nonlocal progress
+
+        if progress is None:
+          return
+
+        try:
+          await progress.edit(content=content)
+        except NotFound:
+          progress = None
+        except HTTPException as e:
+          record_error("bulk_roles_progress", e)
+
+      def status() -> str:
+        failed = f", {counts['failed']} failed" if counts["failed"] else ""
+        return f"{actions[action]} roles {role_names} for {total} members: " + \
+          f"{counts['done'] + counts['failed']}/{total}{failed}"
+
+      async def edit(member_id: str):
+        nonlocal last_update
+
+        async with semaphore:
+          member = guild.get_member(int(member_id))
+          result = "failed"
+
+          try:
+            if member is not None:
+              await self.apply(action, member, roles)
+              result = "done"
+          except HTTPException as e:
+            record_error("bulk_roles", e)
+
+          counts[result] += 1
+
+          with redis.pipeline() as pipe:
+            pipe.srem(role_pending_key(job_id), member_id)
+            pipe.hincrby(role_job_key(job_id), result, 1)
+            pipe.execute()
+
+          if monotonic() - last_update >= PROGRESS_SECONDS:
+            last_update = monotonic()
+            await report(status())
+
+      await gather(*[edit(member_id) for member_id in redis.smembers(role_pending_key(job_id))])
+
+      self.remove_job(job_id)
+      await report(f"{status()} (done)")
+    finally:
+      self.running.discard(job_id)
+
+  def remove_job(self, job_id: str):
+    with redis.pipeline() as pipe:
+      pipe.delete(role_job_key(job_id), role_pending_key(job_id))
+      pipe.srem(JOBS_KEY, job_id)
+      pipe.execute()
+
+  async def apply(self, action: str, member: Member, roles: List[Role]):
+    """
+    Applies a bulk action to one member, skipping members that need no change
+    """
+    if action == "add":
+      missing = [role for role in roles if role not in member.roles]
+
+      if missing:
+        await member.add_roles(*missing)
+    elif action == "remove":
+      present = [role for role in roles if role in member.roles]
+
+      if present:
+        await member.remove_roles(*present)
+    elif {role for role in member.roles if not role.is_default()} != set(roles):
+      await member.edit(roles=roles)
+
+  @commands.Cog.listener()
+  async def on_ready(self):
+    """
+    Resumes bulk role jobs that were interrupted by a restart. A job whose progress message
+    (or its channel) was deleted resumes without reporting progress; jobs of guilds the bot is no
+    longer in are dropped
+    """
+    for job_id in redis.smembers(JOBS_KEY):
+      try:
+        job = redis.hgetall(role_job_key(job_id))
+        guild = self.bot.get_guild(int(job["guild"])) if job else None
+
+        if guild is None:
+          self.remove_job(job_id)
+          continue
+
+        if guild.unavailable:
+          # resumed on the next ready, once the guild is back
+          continue
+
+        channel = guild.get_channel(int(job["channel"]))
+        progress = None
+
+        if channel is not None:
+          try:
+            progress = await channel.fetch_message(int(job["message"]))
+          except NotFound:
+            pass
+
+        self.bot.loop.create_task(self.run_job(job_id, progress))
+      except Exception as e:
+        record_error("resume_role_jobs", e)
+
+  @commands.has_permissions(administrator=True)
+  @commands.guild_only()
+  @commands.command()
+  async def bulkAddRoles(self, ctx: Context, members: Greedy[Member],
+                         filters: Greedy[MemberFilter], roles: Greedy[Role]):
+    """
+    Adds one or more roles to many people: everyone mentioned, plus everyone matching
+    all filters. Filters are with:<role> (has a role) and after:<date> (joined after a date).
+    Progress is shown as it goes, and the job resumes if the bot restarts
+
+    >bulkAddRoles @a @b role1
+    >bulkAddRoles with:cohort-5 after:2020-05-01 role1 role2
+
+    Args:
+      members (Greedy[Member]): people receiving more roles
+      filters (Greedy[MemberFilter]): filters selecting more people
+      roles (Greedy[Role]): a list of roles to be added
+
+    Raises:
+      NoRolesError: if no existing roles are provided
+    """
+    await self.bulk(ctx, "add", members, filters, roles)
+
+  @commands.has_permissions(administrator=True)
+  @commands.guild_only()
+  @commands.command()
+  async def bulkRemoveRoles(self, ctx: Context, members: Greedy[Member],
+                            filters: Greedy[MemberFilter], roles: Greedy[Role]):
+    """
+    Removes one or more roles from many people, selected like bulkAddRoles
+
+    >bulkRemoveRoles with:cohort-4 cohort-4
+
+    Args:
+      members (Greedy[Member]): people losing roles
+      filters (Greedy[MemberFilter]): filters selecting more people
+      roles (Greedy[Role]): a list of roles to be removed
+
+    Raises:
+      NoRolesError: if no existing roles are provided
+    """
+    await self.bulk(ctx, "remove", members, filters, roles)
+
+  @commands.has_permissions(administrator=True)
+  @commands.guild_only()
+  @commands.command()
+  async def bulkSetRoles(self, ctx: Context, members: Greedy[Member],
+                         filters: Greedy[MemberFilter], roles: Greedy[Role]):
+    """
+    Sets the list of roles of many people, selected like bulkAddRoles
+
+    >bulkSetRoles after:5/1/20 newcomer
+
+    Args:
+      members (Greedy[Member]): people whose roles are being set
+      filters (Greedy[MemberFilter]): filters selecting more people
+      roles (Greedy[Role]): a list of roles to be set
+
+    Raises:
+      NoRolesError: if no existing roles are provided
+    """
+    await self.bulk(ctx, "set", members, filters, roles)
@@ -1,17 +1,25 @@
+from asyncio import get_event_loop
 from discord.ext import commands
 from discord.ext.commands import Cog, Context, command, CommandInvokeError
-from random import SystemRandom
-from re import match
 from textwrap import dedent
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from .base import CustomCog
+from ..util import chunk_message, rand, send_chunked
+from ..util.dice import DiceSpec, RollResult, parse_roll, roll_dice
+from ..util.odds import distribution
+from ..util.simulation import Simulation, simulate
+from ..util.workqueue import OFFLOAD, publish, register_handler
 
 __all__ = ["RollManager"]
 
-r = SystemRandom()
-
-pattern = r'(?P<count>\d+)d(?P<size>\d+)((?P<addition>[+-]\d+))?(dl(?P<low>\d*))?(dh(?P<high>\d*))?'
+# rolls with more dice than this are run on the default executor
+OFFLOAD_DICE = 10000
+# dice with at most this many faces show how often each face came up
+FACE_COUNT_LIMIT = 20
+PERCENTILES = [5, 25, 50, 75, 95]
+HISTOGRAM_ROWS = 16
+HISTOGRAM_WIDTH = 30
 
 class RollManager(CustomCog):
   """
@@ -19,90 +27,120 @@ class RollManager(CustomCog):
   """
   def __init__(self, bot):
     self.bot = bot
+    # users with a simulation in progress
+    self.simulating: Set[int] = set()
 
-  def make_roll(self, input: str) -> Tuple[str, List[int], List[int], int]:
-    """
-    Handles a single role
+  def export_state(self) -> Dict[str, Any]:
+    return { "simulating": self.simulating }
 
-    Args
-      input (str): The roll that is being processed. Rolls should match the pattern regex 'pattern'
+  def import_state(self, state: Dict[str, Any]):
+    # shared with the simulations still running in the old cog, which remove themselves when done
+    self.simulating = state.get("simulating", set())
+
+  def parse(self, input: str) -> DiceSpec:
+    """
+    Parses a roll, guessing at a roll for malformed input
 
     Raises:
       ValueError if the input is malformed
     """
-    groups = match(pattern, input)
+    spec = parse_roll(input)
 
-    if groups == None:
+    if spec is None:
       base = max(abs(hash(input)) % 1000, 1)
-      roll = r.randint(1, base)
+      roll = rand.randint(1, base)
 
       raise ValueError(f"Not a valid roll {input}. But here's my best guess for {input} = 1d{base}: **{roll}**")
 
-    count = int(groups.group("count"))
+    return spec
+
+  async def make_roll(self, input: str) -> RollResult:
+    """
+    Handles a single role. Large rolls are made off the event loop
+
+    Args
+      input (str): The roll that is being processed. Rolls should match the pattern regex 'pattern'
 
-    if count == 0:
-      raise ValueError("I *can* roll zero dice, but am morally obligated not to")
+    Raises:
+      ValueError if the input is malformed
+    """
+    spec = self.parse(input)
 
-    size = int(groups.group("size"))
+    if spec.count > OFFLOAD_DICE:
+      return await get_event_loop().run_in_executor(None, roll_dice, spec)
 
-    if size == 0:
-      raise ValueError("I will not roll a d0")
+    return roll_dice(spec)
 
-    addition = 0
+  def pretty_array(self, list: List) -> str:
+    return ', '.join(str(x) for x in list)
 
-    if groups.group("addition") != None:
-      addition = int(groups.group("addition"))
+  def pretty_dropped(self, dropped: List[int]) -> str:
+    if len(dropped) <= 20:
+      return self.pretty_array(dropped)
 
-    low_drop = 0
-    high_drop = 0
+    return f"{len(dropped)} dice, from {dropped[0]} to {dropped[-1]}, totalling {sum(dropped)}"
 
-    if groups.group("low") != None:
-      low = groups.group("low")
-      low_drop = 1 if low == "" else int(low)
+  def describe(self, result: RollResult) -> str:
+    """
+    Formats one roll. Every die is listed for small rolls; large rolls are summarized
+    """
+    roll = result.spec.describe()
+    addition = result.spec.addition
 
-    if groups.group("high") != None:
-      high = groups.group("high")
-      high_drop = 1 if high == "" else int(high)
+    if result.kept == 1 and not result.dropped:
+      return f"\n{roll}: **{result.total}**\n"
 
-    if low_drop + high_drop >= count:
-      raise ValueError(f"You want to drop {low_drop + high_drop} dice but are only rolling {size} (must have at least one)")
+    average = result.total / result.kept
 
-    rolls = []
+    if result.rolls is not None:
+      if result.dropped:
+        kept = result.rolls[result.spec.low:len(result.rolls) - result.spec.high]
 
-    for _ in range(0, count):
-      rolls.append(r.randint(1, size))
+        return dedent(f"""
+        {roll}: **{result.total}**
+        {self.pretty_array(kept)} ({average} avg) + {addition}
+        {self.pretty_dropped(result.dropped)} (dropped)
+        """)
 
-    message = f"{count}d{size}"
+      return dedent(f"""
+      {roll}: **{result.total}**
+      {self.pretty_array(result.rolls)} ({average} avg) + {addition}
+      """)
 
-    if addition != 0:
-      message += f"+{str(addition)}"
+    message = dedent(f"""
+    {roll}: **{result.total}**
+    {result.kept} dice kept, {result.lowest} to {result.highest} ({average:.3f} avg) + {addition}
+    """)
 
-    if low_drop != 0:
-      message += f", drop {low_drop} lowest"
+    if result.counts is not None and result.spec.size <= FACE_COUNT_LIMIT:
+      faces = ", ".join(f"{face}: {result.counts.get(face, 0)}" for face in range(1, result.spec.size + 1))
+      message += f"rolled {faces}\n"
 
-      if high_drop != 0:
-        message += f" and {high_drop} highest"
+    if result.dropped:
+      message += f"{self.pretty_dropped(result.dropped)} (dropped)\n"
 
-    elif high_drop != 0:
-      message += f", drop {high_drop} highest"
+    return message
 
-    rolls.sort()
-    return (message, rolls, rolls[low_drop:len(rolls) - high_drop], addition)
+  def render_rolls(self, mention: str, results: List[RollResult]) -> Tuple[str, List[str]]:
+    """
+    Returns the header and the description of each roll of a >roll reply
+    """
+    total_sum = sum(result.total for result in results)
+    header = f"{mention}, you rolled a total of **{total_sum}**:\n\n>>> "
 
-  def pretty_array(self, list: List) -> str:
-    return ', '.join(str(x) for x in list)
+    return (header, [self.describe(result).strip("\n") for result in results])
 
   @commands.command()
   async def roll(self, ctx, *die_rolls):
     """
     Rolls one or more dice. Dice rolls should be in this general form:
-    
+
     "int"d"int"
     >roll 1d20 2d4
     >roll 3d125129
 
     You can also add modifiers to the roll:
-    +/-"int" 
+    +/-"int"
     >roll 3d8+5
     >roll 2d6-8
 
@@ -113,48 +151,130 @@ class RollManager(CustomCog):
     >roll 8d10dldh: drop lowest and highest
 
     Put together, we have:
-    "int"d"int"+/-"int"dl"int"dh"int" 
+    "int"d"int"+/-"int"dl"int"dh"int"
     >roll 10d20+2dl2dh2: 10 d 20s, +2, drop 2 lowest and highest
 
+    Rolls of more than 100 dice are summarized instead of listing every die.
+    When offloading, rolls of more than 10000 dice in total are made by the workers.
+
     NOTE: you should follow this order exactly
 
     Args:
       args (Tuple[str]]): a list of strings
     """
-    message = ""
+    mention = ctx.message.author.mention
+
+    if OFFLOAD and sum(self.parse(entry).count for entry in die_rolls) > OFFLOAD_DICE:
+      publish("roll", { "rolls": list(die_rolls), "mention": mention }, ctx.channel.id)
+      return
+
+    results = [await self.make_roll(entry) for entry in die_rolls]
+    [header, messages] = self.render_rolls(mention, results)
+
+    await send_chunked(ctx, header, messages, sep="\n\n")
+
+  @commands.command()
+  async def odds(self, ctx, roll: str, target: Optional[int] = None):
+    """
+    Computes the exact odds of a roll: its mean, percentiles and,
+    given a target, the chance of rolling at least that much.
+    Rolls use the same form as >roll
 
-    total_sum = 0
+    >odds 4d6dl
+    >odds 40d20dl5dh5 300
 
-    for entry in die_rolls:
-      [roll, display_result, actual_result, addition] = self.make_roll(entry)
+    Args:
+      roll (str): the roll
+      target (Optional[int]): the total to meet or beat
+    """
+    spec = self.parse(roll)
+    odds = await get_event_loop().run_in_executor(None, distribution, spec)
 
-      result_sum = sum(actual_result) + addition
+    percentiles = ", ".join(f"{p}%: {odds.percentile(p / 100)}" for p in PERCENTILES)
 
-      if len(display_result) != len(actual_result):
-        result_avg = result_sum / len(actual_result)
+    message = dedent(f"""
+    {ctx.message.author.mention}, the odds for {spec.describe()}:
+    >>> mean **{float(odds.mean()):.2f}** (standard deviation {odds.stdev():.2f}), from {odds.minimum} to {odds.maximum}
+    percentiles: {percentiles}
+    """)
 
-        removed_elements = sorted(set(display_result) - set(actual_result))
+    if target is not None:
+      message += f"chance of at least {target}: **{float(odds.at_least(target)) * 100:.4g}%**\n"
 
-        message += dedent(f"""
-        {roll}: **{result_sum}**
-        {self.pretty_array(actual_result)} ({result_avg} avg) + {addition}
-        {self.pretty_array(removed_elements)} (dropped)
-        """)
-      else:
-        if len(display_result) > 1:
-          average = result_sum / len(actual_result)
+    await ctx.send(message)
 
-          message += dedent(f"""
-          {roll}: **{result_sum}**
-          {self.pretty_array(display_result)} ({average} avg) + {addition}
-          """)
-        else:
-          message += f"\n{roll}: **{result_sum}**\n"
+  def histogram(self, simulation: Simulation) -> str:
+    """
+    Draws a simulation's totals as a text histogram of at most HISTOGRAM_ROWS rows
+    """
+    low = min(simulation.histogram)
+    high = max(simulation.histogram)
+    width = -(-(high - low + 1) // HISTOGRAM_ROWS)
+    rows = [0] * (-(-(high - low + 1) // width))
 
-      total_sum += result_sum
+    for [total, count] in simulation.histogram.items():
+      rows[(total - low) // width] += count
 
-    mention = ctx.message.author.mention
-    total_mesg = f"{mention}, you rolled a total of **{total_sum}**:\n\n>>> {message.lstrip()}"
+    tallest = max(rows)
+    lines = []
+
+    for [index, count] in enumerate(rows):
+      start = low + index * width
+      label = str(start) if width == 1 else f"{start}-{start + width - 1}"
+      bar = "#" * round(count / tallest * HISTOGRAM_WIDTH)
+      lines.append(f"{label:>13} {bar:<{HISTOGRAM_WIDTH}} {count / simulation.trials * 100:5.1f}%")
+
+    return "\n".join(lines)
+
+  @commands.command()
+  async def simulate(self, ctx, roll: str, trials: int = 100000, target: Optional[int] = None):
+    """
+    Estimates the odds of a roll by rolling it many times. Rolls use the same form as >roll.
+    You can run one simulation at a time
+
+    >simulate 4d6dl
+    >simulate 40d20dl5dh5 1000000 300
+
+    Args:
+      roll (str): the roll
+      trials (int): how many times to roll it (100000 by default)
+      target (Optional[int]): the total to meet or beat
+    """
+    spec = self.parse(roll)
+    user = ctx.message.author.id
+
+    if user in self.simulating:
+      raise ValueError("You already have a simulation running")
+
+    self.simulating.add(user)
+
+    try:
+      simulation = await simulate(spec, trials)
+    finally:
+      self.simulating.discard(user)
+
+    percentiles = ", ".join(f"{p}%: {simulation.percentile(p / 100)}" for p in PERCENTILES)
+    completed = f"{simulation.trials} trials" if simulation.trials == trials else \
+      f"{simulation.trials} of {trials} trials (out of time)"
+
+    message = dedent(f"""
+    {ctx.message.author.mention}, simulated {spec.describe()} ({completed}, {simulation.seconds:.2f}s):
+    >>> mean **{simulation.mean():.2f}** (standard deviation {simulation.stdev():.2f}), from {min(simulation.histogram)} to {max(simulation.histogram)}
+    percentiles: {percentiles}
+    """)
+
+    if target is not None:
+      message += f"chance of at least {target}: **{simulation.at_least(target) * 100:.4g}%**\n"
+
+    message += f"```\n{self.histogram(simulation)}\n```"
+
+    await ctx.send(message)
+
+def roll_job(payload: Dict[str, Any]) -> List[str]:
+  roller = RollManager(None)
+  results = [roll_dice(roller.parse(entry)) for entry in payload["rolls"]]
+  [header, messages] = roller.render_rolls(payload["mention"], results)
 
-    await ctx.send(total_mesg)
+  return chunk_message(header, messages, "\n\n")
 
+register_handler("roll", roll_job)
@@ -1,26 +1,236 @@
 from discord import Guild, Member, TextChannel, User
 from discord.ext.commands import Bot, Context, command, \
 CommandError, CommandInvokeError, guild_only, has_permissions
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from asyncio import get_event_loop
+from collections import Counter
+from typing import Any, Callable, Counter as TypingCounter, Dict, Iterable, List, Optional, Tuple, Union
 
 from .base import CustomCog
-from ..util import redis, redlocks
+from ..storage import RedisStorage, storage
+from ..util import redis, send_chunked
+from ..util.keys import emoji_ids_key, emoji_names_key, stats_key
+from ..util.redis import KeyMemory, measure_keys
+from ..util.trending import BUCKETS, BUCKET_SECONDS, TOP_K, TRENDING, top_trending
+from ..util.workqueue import OFFLOAD, publish, register_handler
 
 __all__ = ["StatsManager"]
 
 GuildIdOrNumber = Optional[Union[int, str]]
-GuildAndKey = Tuple[str, str]
+GuildAndId = Tuple[str, int]
 
-def get_key_from_context(ctx: Context) -> GuildAndKey:
+# given instead of a guild, for stats or deletion in every guild
+ALL_GUILDS = "all"
+
+def get_guild_from_context(ctx: Context) -> GuildAndId:
   """
-  Returns the guild name, and a string representing the key in the form user:guild
+  Returns the guild name and id of the channel a message was sent in
 
   Args:
     ctx: the context for the message
   Returns:
-    a Tuple with the first entry being the guild name, and the second being a key
+    a Tuple with the first entry being the guild name, and the second being its id
+  """
+  return (ctx.channel.guild.name, ctx.channel.guild.id)
+
+def render_stats(react_stats: Dict[str, str], max_emojis: int) -> str:
+  """
+  Renders a user's most used emojis, grouped by number of uses
+
+  Args:
+    react_stats (Dict[str, str]): the user's stats hash (emoji -> uses, plus consent)
+    max_emojis (int): how many emojis to show (up to 2x this many, if tied)
+
+  Returns:
+    the stats message
+  """
+  if len(react_stats) <= 1:
+    return "You have used no emojis"
+
+  message = ">>> "
+  score_mappings: Dict[int, List[str]] = {}
+
+  for [emoji, count] in react_stats.items():
+    if emoji != "consent":
+      int_score = int(count)
+
+      if int_score in score_mappings:
+        score_mappings[int_score].append(emoji)
+      else:
+        score_mappings[int_score] = [emoji]
+
+  emoji_count = 0
+
+  for count in sorted(score_mappings, reverse=True):
+    emojis = score_mappings[count]
+
+    if len(emojis) + emoji_count >= max_emojis * 2:
+      break
+
+    if count == 1:
+      message += "1 use: "
+    else:
+      message += f"{count} uses: "
+
+    message += " ".join(emojis) + "\n"
+
+    emoji_count += len(emojis)
+
+    if emoji_count >= max_emojis:
+      break
+
+  return message
+
+def merge_stats(stats_by_guild: Iterable[Dict[str, str]]) -> Dict[str, str]:
+  """
+  Adds up a user's stats in several guilds
+
+  Args:
+    stats_by_guild (Iterable[Dict[str, str]]): the user's stats hash in each guild
+
+  Returns:
+    a stats hash with the total uses of each emoji, consenting if the user consented in any guild
+  """
+  totals: TypingCounter[str] = Counter()
+  consents: List[str] = []
+
+  for stats in stats_by_guild:
+    for [emoji, count] in stats.items():
+      if emoji == "consent":
+        consents.append(count)
+      else:
+        totals[emoji] += int(count)
+
+  merged = { emoji: str(count) for [emoji, count] in totals.items() }
+
+  if consents:
+    merged["consent"] = max(consents)
+
+  return merged
+
+def render_categories(react_stats: Dict[str, str], categories: Dict[str, str], max_per_category: int) -> str:
+  """
+  Renders a user's emoji uses by category, with the most used emojis of each category
+
+  Args:
+    react_stats (Dict[str, str]): the user's stats hash (emoji -> uses, plus consent)
+    categories (Dict[str, str]): the guild's categories hash (category -> space-separated emojis)
+    max_per_category (int): how many emojis to show per category (up to 2x this many, if tied)
+
+  Returns:
+    the categories message
   """
-  return (ctx.channel.guild.name, f"{ctx.author.id}:{ctx.channel.guild.id}")
+  if len(react_stats) <= 1 or not categories:
+    return "You have used no emojis"
+
+  message = ">>> "
+  score_mapping_by_category: Dict[Optional[str], Dict[int, List[str]]] = {}
+
+  for [emoji, count] in react_stats.items():
+    if emoji != "consent":
+      category = None
+
+      for [name, emojilist] in categories.items():
+        if emoji in emojilist:
+          category = name
+          break
+
+      category_map = score_mapping_by_category.setdefault(category, {})
+      int_score = int(count)
+
+      if int_score in category_map:
+        category_map[int_score].append(emoji)
+      else:
+        category_map[int_score] = [emoji]
+
+  section_and_top_emojis: List[Tuple[int, List[str], Optional[str]]] = []
+
+  for [category, mapping] in score_mapping_by_category.items():
+    emoji_count = 0
+    top_emojis: List[str] = []
+    total_count = 0
+
+    for count in sorted(mapping, reverse=True):
+      emojis = mapping[count]
+
+      if emoji_count < max_per_category and emoji_count + len(emojis) < max_per_category * 2:
+        top_emojis.append("  ".join(emojis) + f" ({count})")
+
+      emoji_count += len(emojis)
+      total_count += count * len(emojis)
+
+    section_and_top_emojis.append([total_count, top_emojis, category])
+
+  for [total_count, emojis, category] in sorted(section_and_top_emojis, reverse=True):
+    emojis_joined = "  ".join(emojis)
+
+    if category is None:
+      message += "**No category**"
+    else:
+      message += category
+
+    message += f" ({total_count} uses): {emojis_joined}\n"
+
+  return message
+
+def render_uses(react_stats: Dict[str, str], emojis: List[str]) -> str:
+  """
+  Renders how many times a user has used specific emojis
+
+  Args:
+    react_stats (Dict[str, str]): the user's stats hash (emoji -> uses, plus consent)
+    emojis (List[str]): the emojis to show
+
+  Returns:
+    the uses message
+  """
+  if len(react_stats) <= 1:
+    return "You have used no emojis"
+
+  message = ">>> "
+
+  for emoji in emojis:
+    count = react_stats.get(emoji, 0)
+    message += f"{emoji}: {count} use"
+
+    if count != 1:
+      message += "s"
+    message += "\n"
+
+  return message
+
+def stats_memory(guild_id: int) -> Tuple[List[KeyMemory], List[KeyMemory]]:
+  """
+  Measures a guild's emoji stats (blocking, run in an executor)
+
+  Returns:
+    the stats hash of every user, largest first, and the guild's two emoji interning hashes
+  """
+  keys = list(redis.scan_iter(match=stats_key("*", guild_id), count=1000))
+  users = sorted(measure_keys(keys), key=lambda memory: memory.bytes, reverse=True)
+
+  return (users, measure_keys([emoji_ids_key(guild_id), emoji_names_key(guild_id)]))
+
+def stats_job(payload: Dict[str, Any]) -> List[str]:
+  stats = storage.get_stats(payload["user"], payload["guild"])
+  return [f"{render_stats(stats, payload['max_emojis'])} in {payload['guild_name']}"]
+
+def stats_all_job(payload: Dict[str, Any]) -> List[str]:
+  all_stats = storage.get_all_stats(payload["user"])
+  return [f"{render_stats(merge_stats(all_stats.values()), payload['max_emojis'])} in {len(all_stats)} servers"]
+
+def categories_job(payload: Dict[str, Any]) -> List[str]:
+  stats = storage.get_stats(payload["user"], payload["guild"])
+  categories = storage.get_categories(payload["guild"])
+  return [f"{render_categories(stats, categories, payload['max_per_category'])} in {payload['guild_name']}"]
+
+def uses_job(payload: Dict[str, Any]) -> List[str]:
+  stats = storage.get_stats(payload["user"], payload["guild"])
+  return [f"{render_uses(stats, payload['emojis'])} in {payload['guild_name']}"]
+
+register_handler("stats", stats_job)
+register_handler("stats_all", stats_all_job)
+register_handler("categories", categories_job)
+register_handler("uses", uses_job)
 
 class StatsManager(CustomCog):
   """
@@ -48,63 +258,84 @@ class StatsManager(CustomCog):
 
     return None
 
-  def get_guild_key(self, idOrName: Union[int, str], ctx: Context) -> Optional[GuildAndKey]:
+  def get_guild_and_id(self, idOrName: Union[int, str]) -> Optional[GuildAndId]:
     """
-    Function for extracting the guild name and key from user-provided id/name
+    Function for extracting the guild name and id from user-provided id/name
 
     Args:
       idOrName: either a server name or id
-      ctx: the context of the message that was sent
 
     Returns:
-      a Tuple repesenting the guild name and key, if such a guild (name or id) exists
+      a Tuple repesenting the guild name and id, if such a guild (name or id) exists
     """
     user_guild = self.get_guild(idOrName)
 
     if user_guild:
-      key = f"{ctx.author.id}:{user_guild.id}"
-      return [user_guild.name, key]
+      return [user_guild.name, user_guild.id]
     else:
       return None
 
   async def handle_message(self, ctx: Context, idOrName: GuildIdOrNumber, 
-                          handler: Callable[[str], str]): 
+                          handler: Callable[[int], str], job: Optional[Tuple[str, Dict[str, Any]]] = None): 
     """
     Generic function for handling messages from a user
 
     Args: 
       ctx: the context of the message that was sent    
       idOrName: an optional guild id/name (user-provided)
-      handler: a function that is called if we can successfully get guild name and key
+      handler: a function that is called with the guild id if we can successfully get guild name and id
+      job: the kind and payload of a work queue job that does what handler does, for commands
+        that are handed to the workers when offloading (see bot.util.workqueue)
 
     Raises:
       ValueError if the guild could not be found. This happens if sent in a DM
       with no guild id/name provided, or if the guild id/name does not exist
     """
 
-    guildName = ""
-    message = ""
+    data: Optional[GuildAndId] = None
 
     if idOrName:
-      data = self.get_guild_key(idOrName, ctx)
+      data = self.get_guild_and_id(idOrName)
 
-      if data:
-        guildName = data[0]
-        message = handler(data[1])
-      else:
+      if not data:
         raise ValueError(f"Could not find a guild {idOrName}. You must provide a valid guild id/name to consent. Alternatively, you can message in a server channel")      
 
     else:
       if isinstance(ctx.channel, TextChannel):
-        data = get_key_from_context(ctx)
-
-        guildName = data[0]
-        message = handler(data[1])
+        data = get_guild_from_context(ctx)
       else:
         raise ValueError("You must provide a guild id/name to consent. Alternatively, you can message in a server channel")
 
+    [guildName, guildId] = data
+
+    if job and OFFLOAD:
+      [kind, payload] = job
+      channel = ctx.author.dm_channel or await ctx.author.create_dm()
+      publish(kind, { **payload, "user": ctx.author.id, "guild": guildId, "guild_name": guildName }, channel.id)
+      return
+
+    message = handler(guildId)
+
     await ctx.author.send(f"{message} in {guildName}")
 
+  async def handle_all_guilds(self, ctx: Context, handler: Callable[[], str],
+                              job: Optional[Tuple[str, Dict[str, Any]]] = None):
+    """
+    Like handle_message, for commands run on the user's stats in every guild (see Storage.get_guilds)
+
+    Args:
+      ctx: the context of the message that was sent
+      handler: a function returning the message to DM
+      job: the kind and payload of a work queue job that does what handler does
+    """
+    if job and OFFLOAD:
+      [kind, payload] = job
+      channel = ctx.author.dm_channel or await ctx.author.create_dm()
+      publish(kind, { **payload, "user": ctx.author.id }, channel.id)
+      return
+
+    await ctx.author.send(handler())
+
   @command()
   async def categories(self, ctx: Context, max_per_category = 5, \
                        serverIdOrName: GuildIdOrNumber = None):
@@ -125,72 +356,10 @@ class StatsManager(CustomCog):
     >categories 5 000000000000000000   (show top 5 emojis by category using server id)
     >categories 10 "test server"       (show top 10 emojis by category using server name)
     """
-    def handler(key: str):
-      react_stats = redis.hgetall(key)
-
-      guild_id = key[key.index(":") + 1:]
-      categories = redis.hgetall(f"{guild_id}:categories")
-      
-      if len(react_stats) > 1 and categories:
-        message = ">>> "
-
-        score_mapping_by_category: Dict[Optional[str], Dict[int, List[str]]] = {}
-
-        for [emoji, count] in react_stats.items():
-          if emoji != "consent":
-            category = None
-
-            for [key, emojilist] in categories.items():
-              if emoji in emojilist:
-                category = key
-                break
-
-            category_map = score_mapping_by_category.get(category, {})
-
-            int_score = int(count)
+    def handler(guild_id: int):
+      return render_categories(storage.get_stats(ctx.author.id, guild_id), storage.get_categories(guild_id), max_per_category)
 
-            if int_score in category_map:
-              category_map[int_score].append(emoji)
-            else:
-              category_map[int_score] = [emoji]
-
-            score_mapping_by_category[category] = category_map
-
-        section_and_top_emojis: List[Tuple[int, List[str], Optional[str]]] = []
-
-        for [category, mapping] in score_mapping_by_category.items():
-          emoji_count = 0
-          top_emojis: List[str] = []
-          total_count = 0
-
-          for count in sorted(mapping, reverse=True):
-            emojis = mapping[count]
-
-            if emoji_count < max_per_category and emoji_count + len(emojis) < max_per_category * 2:
-              top_emojis.append("  ".join(emojis) + f" ({count})")
-            
-            emoji_count += len(emojis)
-            total_count += count * len(emojis)
-
-          section_and_top_emojis.append([total_count, top_emojis, category])
-
-        for [total_count, emojis, category] in sorted(section_and_top_emojis, reverse=True):
-          emojis_joined = "  ".join(emojis)
-
-          if category is None:
-            message += "**No category**"
-          else:
-            message += category
-
-          message += f" ({total_count} uses): {emojis_joined}\n"
-
-        return message
-      else:
-        message = "You have used no emojis"
-
-      return message
-
-    await self.handle_message(ctx, serverIdOrName, handler)
+    await self.handle_message(ctx, serverIdOrName, handler, ("categories", { "max_per_category": max_per_category }))
 
   @command()
   async def consent(self, ctx: Context, serverIdOrName: GuildIdOrNumber = None):
@@ -205,8 +374,8 @@ class StatsManager(CustomCog):
     >consent "test server"       (consent using server name)
     >consent                     (consent in a server)
     """
-    def handler(key: str):
-      redis.hset(key, "consent", "1")
+    def handler(guild_id: int):
+      storage.set_consent(ctx.author.id, guild_id, True)
 
       return "You have consented to record stats of your reactions"
       
@@ -219,14 +388,24 @@ class StatsManager(CustomCog):
 
     This can be called in a server to deleta all stats in that server, 
     or you can provide a server ID/name to delete all stats via a DM with this bot.
+    Use all to delete your stats in every server.
 
     Examples:
     >delete 000000000000000000  (delete using server id)
     >delete "test server"       (delete using server name)
     >delete                     (delete stats in server channel)
+    >delete all                 (delete stats in every server)
     """
-    def handler(key: str):
-      redis.delete(key)
+    if serverIdOrName == ALL_GUILDS:
+      def delete_all():
+        deleted = storage.delete_all_stats(ctx.author.id)
+        return f"You deleted stats about your reactions in {len(deleted)} servers"
+
+      await self.handle_all_guilds(ctx, delete_all)
+      return
+
+    def handler(guild_id: int):
+      storage.delete_stats(ctx.author.id, guild_id)
 
       return "You deleted stats about your reactions"
       
@@ -251,10 +430,49 @@ class StatsManager(CustomCog):
     if guild is None:
       raise ValueError("This command can only be processed in a server")
 
-    redis.hdel(f"{guild.id}:categories", category)
+    storage.delete_category(guild.id, category)
 
     await ctx.send(f"{ctx.author.mention} deleted category {category}")
 
+  @has_permissions(administrator=True)
+  @guild_only()
+  @command()
+  async def memstats(self, ctx: Context, top: int = 10):
+    """
+    Shows how much redis memory this server's emoji stats use, per user and in total (admins only)
+    This function is server-only (no DMing).
+
+    Examples:
+    >memstats                     (totals, and the 10 largest users)
+    >memstats 25                  (totals, and the 25 largest users)
+    """
+    if not isinstance(storage.resolve(), RedisStorage):
+      raise ValueError("Emoji stats are not stored in redis")
+
+    [users, interning] = await get_event_loop().run_in_executor(None, stats_memory, ctx.guild.id)
+
+    if not users:
+      await ctx.send(f"No emoji stats in {ctx.guild.name}")
+      return
+
+    total = sum(memory.bytes for memory in users)
+    compact = sum(1 for memory in users if memory.encoding in ("listpack", "ziplist"))
+    table = sum(memory.bytes for memory in interning)
+    header = (
+      f">>> Emoji stats in {ctx.guild.name}: {len(users)} users, {total:,} bytes "
+      f"({total // len(users):,} bytes per user), {compact} of {len(users)} hashes compact\n"
+      f"Emoji interning table: {table:,} bytes\n"
+      "Largest users:\n"
+    )
+    lines = []
+
+    for memory in users[:max(top, 0)]:
+      member = ctx.guild.get_member(int(memory.key.rpartition(":")[2]))
+      name = member.display_name if member else memory.key.rpartition(":")[2]
+      lines.append(f"{name}: {memory.bytes:,} bytes ({memory.encoding})")
+
+    await send_chunked(ctx, header, lines, sep="\n")
+
   @command()
   async def revoke(self, ctx: Context, serverIdOrName: GuildIdOrNumber = None):
     """
@@ -268,15 +486,15 @@ class StatsManager(CustomCog):
     >revoke "test server"       (revoke using server name)
     >revoke                     (revoke in server text channel)
     """    
-    def handler(key: str):
-      redis.hset(key, "consent", "0")
+    def handler(guild_id: int):
+      storage.set_consent(ctx.author.id, guild_id, False)
 
       return "You have revoked consent to record stats of your reactions"
       
     await self.handle_message(ctx, serverIdOrName, handler)
 
   @command()
-  async def stats(self, ctx: Context, maxEmojis = 10, serverIdOrName: GuildIdOrNumber = None):
+  async def stats(self, ctx: Context, maxEmojis: GuildIdOrNumber = 10, serverIdOrName: GuildIdOrNumber = None):
     """
     Get stats of your emoji usage in a guild. These stats are DMed
 
@@ -286,57 +504,34 @@ class StatsManager(CustomCog):
     This can be called in a server to get stats for that server, 
     or you can provide a server ID/name via a DM. 
     You have to provide an emoji count in this case.
+    Use all instead of a server to get your stats added up across every server.
 
     Examples:
     >stats                        (stats in server text channel)
     >stats 1000                   (show the top 1000 emojis)
     >stats 10 000000000000000000  (show top 10 emojis using server id)
     >stats 10 "test server"       (show top 10 emojis using server name)
-    """   
-    def handler(key: str):
-      react_stats = redis.hgetall(key)
-      
-      if len(react_stats) > 1:
-        message = ">>> "
-
-        score_mappings: Dict[int, List[str]] = {}
-
-        for [emoji, count] in react_stats.items():
-          if emoji != "consent":
-            int_score = int(count)
-
-            if int_score in score_mappings:
-              score_mappings[int_score].append(emoji)
-            else:
-              score_mappings[int_score] = [emoji]
-
-        emoji_count = 0
-
-        for count in sorted(score_mappings, reverse=True):
-          emojis = score_mappings[count]
-
-          if len(emojis) + emoji_count >= maxEmojis * 2:
-            break
-
-          if count == 1:
-            message += "1 use: "
-          else:
-            message += f"{count} uses: "
-
-          message += " ".join(emojis) + "\n"
+    >stats all                    (show top 10 emojis across every server)
+    >stats 20 all                 (show top 20 emojis across every server)
+    """
+    if maxEmojis == ALL_GUILDS:
+      [maxEmojis, serverIdOrName] = [10, ALL_GUILDS]
 
-          emoji_count += len(emojis)
+    if not isinstance(maxEmojis, int):
+      raise ValueError("The number of emojis must be a number")
 
-          if emoji_count >= maxEmojis:
-            break
+    if serverIdOrName == ALL_GUILDS:
+      def all_handler():
+        all_stats = storage.get_all_stats(ctx.author.id)
+        return f"{render_stats(merge_stats(all_stats.values()), maxEmojis)} in {len(all_stats)} servers"
 
-        return message
-      else:
-        message = "You have used no emojis"
+      await self.handle_all_guilds(ctx, all_handler, ("stats_all", { "max_emojis": maxEmojis }))
+      return
 
-      return message
+    def handler(guild_id: int):
+      return render_stats(storage.get_stats(ctx.author.id, guild_id), maxEmojis)
 
-    await self.handle_message(ctx, serverIdOrName, handler)
+    await self.handle_message(ctx, serverIdOrName, handler, ("stats", { "max_emojis": maxEmojis }))
   
   @has_permissions(manage_emojis=True)
   @guild_only()
@@ -362,22 +557,41 @@ class StatsManager(CustomCog):
     else:
       raise ValueError("This command can only be processed in a server")
 
-    key = f"{guildId}:categories"
+    storage.set_category(guildId, category, list(emojis))
 
-    with redlocks.create_lock(f"{key}:lock"):
-      existing_categories = redis.hgetall(key)
+    await ctx.send(f"{ctx.author.mention} set category {category} to {' '.join(emojis)}")
 
-      for [existing_category, emojilist] in existing_categories.items():
-        if existing_category == category:
-          continue
+  @has_permissions(administrator=True)
+  @guild_only()
+  @command()
+  async def trending(self, ctx: Context, count: int = 10):
+    """
+    Shows this server's most used emojis lately, and about how many people use each (admins only).
+    The numbers are estimates, and only count members who consented to stats.
+    This function is server-only (no DMing).
 
-        for emoji in emojis:
-          if emoji in emojilist:
-            raise ValueError(f"Emoji {emoji} is already used in category {existing_category}")
+    Examples:
+    >trending                     (the 10 most used emojis)
+    >trending 25                  (the 25 most used emojis)
+    """
+    if not TRENDING:
+      raise ValueError("Trending emojis are turned off")
 
-      redis.hmset(key, { category: " ".join(emojis)})
+    emojis = await get_event_loop().run_in_executor(None, top_trending, ctx.guild.id, min(max(count, 1), TOP_K))
+    window = f"{BUCKETS * BUCKET_SECONDS / 3600:g} hours"
 
-    await ctx.send(f"{ctx.author.mention} set category {category} to {' '.join(emojis)}")
+    if not emojis:
+      await ctx.send(f"No emojis used in {ctx.guild.name} in the last {window}")
+      return
+
+    header = f">>> Trending in {ctx.guild.name} over the last {window}:\n"
+    lines = [
+      f"{emoji.emoji}: ~{emoji.uses:,} uses ({emoji.recent:,} in the last {BUCKET_SECONDS / 60:g} minutes), "
+      f"~{emoji.users:,} people"
+      for emoji in emojis
+    ]
+
+    await send_chunked(ctx, header, lines, sep="\n")
 
   @command()
   async def uses(self, ctx: Context, *emojis):
@@ -399,31 +613,14 @@ class StatsManager(CustomCog):
 
     idOrName: Optional[GuildIdOrNumber] = None
 
-    if self.get_guild_key(emojis[-1], ctx):
+    if self.get_guild_and_id(emojis[-1]):
       idOrName = emojis[-1]
       emojis = emojis[:-1]
 
-    def handler(key: str):
-      react_stats = redis.hgetall(key)
-      
-      if len(react_stats) > 1:
-        message = ">>> "
-
-        for emoji in emojis:
-          count = react_stats.get(emoji, 0)
-          message += f"{emoji}: {count} use"
-
-          if count != 1:
-            message += "s"
-          message += "\n"
-
-        return message
-      else:
-        message = "You have used no emojis"
-
-      return message
+    def handler(guild_id: int):
+      return render_uses(storage.get_stats(ctx.author.id, guild_id), emojis)
 
-    await self.handle_message(ctx, idOrName, handler)
+    await self.handle_message(ctx, idOrName, handler, ("uses", { "emojis": list(emojis) }))
 
   @command()
   async def viewCategories(self, ctx: Context, serverIdOrName: GuildIdOrNumber = None):
@@ -449,7 +646,7 @@ class StatsManager(CustomCog):
     if guild is None:
       raise ValueError(f"Could not find a server {serverIdOrName}. If you are DM-ing, make sure to provide the server name/id as the last argument")
       
-    categories = redis.hgetall(f"{guild.id}:categories")
+    categories = storage.get_categories(guild.id)
 
     if categories:
       message = f">>> Emoji categories in {guild.name}:"
@@ -3,35 +3,61 @@ from discord import Game
 from discord.ext import tasks, commands
 from discord.ext.commands import Bot, Cog, Context
 from os import environ
-from random import SystemRandom
+from typing import Any, Dict, List, Optional
 
-from ..util import sheets
+from ..util import gateway, rand, record_error
+from ..util.sheetgateway import Subscription
 
 __all__ = ["StatusManager"]
 
-rand = SystemRandom()
+GAMES_RANGE = "A2:A100"
 
 class StatusManager(Cog):
   def __init__(self, bot: Bot):
     self.bot = bot
+    self.games: List[List[str]] = []
     self.roles_doc = environ.get("SAFETY_ROLES_GOOGLE_LINK")
+    self.subscription: Optional[Subscription] = None
     self.change_status.start()
 
+  def cog_unload(self):
+    self.change_status.cancel()
+
+    if self.subscription:
+      gateway.unsubscribe(self.subscription)
+
+  def export_state(self) -> Dict[str, Any]:
+    return { "games": self.games }
+
+  def import_state(self, state: Dict[str, Any]):
+    self.games = state.get("games", [])
+
+  async def set_games(self, games: List[List[str]]):
+    """
+    Updates the list of games when the google sheet changes
+    """
+    self.games = [game for game in games if game]
+
   @tasks.loop(minutes=30)
   async def change_status(self):
     """
-    Change the "game" this bot is playing by pulling from a list from google docs
+    Change the "game" this bot is playing by picking from a list from google docs
     """
     try:
-      games = sheets.spreadsheets() \
-        .values() \
-        .get(spreadsheetId=self.roles_doc, range="A2:A100") \
-        .execute() \
-        .get("values", [])
+      if not self.games:
+        return
 
-      next_game = rand.choice(games)
+      next_game = rand.choice(self.games)
       game = Game(name=next_game[0])
       await sleep(10)
       await self.bot.change_presence(activity=game)
     except Exception as e:
-      print(e)
+      record_error("change_status", e)
+
+  @change_status.before_loop
+  async def before_change_status(self):
+    if self.roles_doc:
+      self.subscription = await gateway.subscribe(self.roles_doc, GAMES_RANGE, self.set_games)
+
+      if not self.games:
+        await gateway.refresh(self.roles_doc)
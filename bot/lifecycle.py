@@ -0,0 +1,122 @@
+"""
+The application lifecycle: starts shared services, sets up the enabled cogs, and connects.
+Nothing here runs on import. With profile=True, the time to ready is printed
+broken down by phase
+"""
+from asyncio import gather, get_event_loop
+from emoji import get_emoji_regexp
+from sys import stderr
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
+from .bot import bot, setup_cogs
+from .storage import storage
+from .util import metrics, redis, scheduler, sheets
+from .util.watchdog import watchdog
+
+__all__ = ["StartupProfile", "run"]
+
+class StartupProfile:
+  """
+  Records how long each startup phase took
+  """
+  def __init__(self, start: Optional[float] = None):
+    self.start = start or perf_counter()
+    self.phases: List[Tuple[str, float]] = []
+
+  def record(self, name: str, seconds: float):
+    self.phases.append((name, seconds))
+
+  async def timed(self, name: str, fn: Callable[[], object], optional: bool = False):
+    """
+    Runs a blocking function on the default executor and records its duration.
+    Errors from optional functions are printed instead of raised
+    """
+    start = perf_counter()
+
+    try:
+      await get_event_loop().run_in_executor(None, fn)
+    except Exception as e:
+      if not optional:
+        raise
+
+      print(f"{name} failed: {e}", file=stderr)
+
+    self.record(name, perf_counter() - start)
+
+  def report(self) -> str:
+    lines = [f"  {name:28} {seconds * 1000:9.1f} ms" for [name, seconds] in self.phases]
+    lines.append(f"  {'time to ready':28} {(perf_counter() - self.start) * 1000:9.1f} ms")
+
+    return "Startup profile:\n" + "\n".join(lines)
+
+async def start_services(profile: StartupProfile):
+  """
+  Initializes independent services in parallel: redis (then the scheduler, which loads its jobs
+  from redis), the stats storage, the google sheets client, and the emoji regex
+  """
+  async def redis_then_scheduler():
+    await profile.timed("services: redis", redis.ping)
+
+    start = perf_counter()
+    metrics.watch_scheduler(scheduler)
+    scheduler.start()
+    profile.record("services: scheduler", perf_counter() - start)
+
+  async def metrics_server():
+    start = perf_counter()
+    await metrics.serve()
+    bot.loop.create_task(metrics.watch_loop_lag())
+    profile.record("services: metrics", perf_counter() - start)
+
+  start = perf_counter()
+
+  await gather(
+    redis_then_scheduler(),
+    metrics_server(),
+    # the sheets gateway works from its snapshot until the API is reachable
+    profile.timed("services: storage", storage.resolve),
+    profile.timed("services: google sheets", sheets.resolve, optional=True),
+    profile.timed("services: emoji regex", get_emoji_regexp)
+  )
+
+  profile.record("services (parallel)", perf_counter() - start)
+
+def run(token: str, profile_startup: bool = False, started: Optional[float] = None):
+  """
+  Starts the bot and blocks until it is closed
+
+  Args:
+    token (str): the bot token
+    profile_startup (bool): print the time to ready, by phase, once connected
+    started (Optional[float]): a perf_counter() taken at process start, to include import time
+  """
+  profile = StartupProfile(started)
+
+  if started is not None:
+    profile.record("imports", perf_counter() - started)
+
+  bot.loop.run_until_complete(start_services(profile))
+  watchdog.start(bot.loop)
+
+  start = perf_counter()
+  setup_cogs(lambda name, seconds: profile.record(f"cogs: {name}", seconds))
+  profile.record("cogs", perf_counter() - start)
+
+  connect_start = perf_counter()
+
+  async def report_ready():
+    bot.remove_listener(report_ready, "on_ready")
+    profile.record("login and gateway", perf_counter() - connect_start)
+
+    if profile_startup:
+      print(profile.report(), file=stderr)
+
+  bot.add_listener(report_ready, "on_ready")
+
+  try:
+    bot.run(token)
+  finally:
+    # write any uses the storage is still batching
+    if storage.initialized:
+      storage.close()
@@ -0,0 +1,30 @@
+"""
+The storage behind emoji stats and categories. SAFETY_STORAGE chooses the implementation:
+redis (the default, see bot.util.redis) or sqlite (a local database file, see SqliteStorage)
+"""
+from os import environ
+
+from .base import Storage
+from .redisstorage import RedisStorage
+from .sqlitestorage import SqliteStorage
+from ..util.lazy import Lazy
+
+__all__ = ["RedisStorage", "SqliteStorage", "Storage", "open_storage", "storage"]
+
+backends = {
+  "redis": RedisStorage,
+  "sqlite": SqliteStorage
+}
+
+def open_storage() -> Storage:
+  """
+  Creates the storage configured by SAFETY_STORAGE
+  """
+  name = environ.get("SAFETY_STORAGE", "redis")
+
+  if name not in backends:
+    raise ValueError(f"Unknown storage {name} in SAFETY_STORAGE. Choose from {', '.join(backends)}")
+
+  return backends[name]()
+
+storage = Lazy(open_storage)
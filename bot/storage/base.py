@@ -0,0 +1,170 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from os import environ
+from typing import Dict, List, Tuple
+
+from ..util.keys import Id
+from ..util.memory import register_cache
+
+__all__ = ["Storage"]
+
+CONSENT_CACHE_SIZE = int(environ.get("SAFETY_CONSENT_CACHE", "10000"))
+
+class Storage(ABC):
+  """
+  Where emoji stats and categories are kept. Implementations are called from the event loop,
+  so each call should be quick (a round trip, or a local transaction)
+  """
+  def __init__(self, consent_cache_size: int = CONSENT_CACHE_SIZE):
+    # an LRU of recent consent answers, by user and guild (see cached_consent)
+    self.consents: "OrderedDict[Tuple[int, int], bool]" = OrderedDict()
+    self.consent_cache_size = consent_cache_size
+    register_cache("storage consents", lambda: len(self.consents))
+
+  @abstractmethod
+  def record_uses(self, user_id: Id, guild_id: Id, emojis: List[str], change: int = 1) -> bool:
+    """
+    Adds (or with a negative change, removes) uses of emojis to a user's stats, if they consented.
+    Counts that drop to 0 are removed. Implementations may batch writes; reads see every write before them
+
+    Args:
+      user_id (Id): the user who used the emojis
+      guild_id (Id): the guild they were used in
+      emojis (List[str]): the emojis used, which may repeat
+      change (int): the uses to add per occurrence
+
+    Returns:
+      whether the user consented, so the uses count (False if there were no emojis)
+    """
+
+  @abstractmethod
+  def get_stats(self, user_id: Id, guild_id: Id) -> Dict[str, str]:
+    """
+    Returns a user's stats in a guild: emoji -> uses, plus "consent" if they ever consented or revoked
+    """
+
+  @abstractmethod
+  def has_consent(self, user_id: Id, guild_id: Id) -> bool:
+    """
+    Returns whether a user currently consents to their emoji uses being counted in a guild
+    """
+
+  def cached_consent(self, user_id: Id, guild_id: Id) -> bool:
+    """
+    Returns whether a user consents in a guild (see has_consent), remembering the answer. It is
+    forgotten when this storage changes the consent or deletes the stats, but cleanups writing
+    behind its back may leave it stale, so only use it where a stale answer does no harm
+    """
+    key = (int(user_id), int(guild_id))
+    consent = self.consents.get(key)
+
+    if consent is None:
+      consent = self.has_consent(user_id, guild_id)
+
+    self.remember_consent(user_id, guild_id, consent)
+
+    return consent
+
+  def remember_consent(self, user_id: Id, guild_id: Id, consent: bool):
+    """
+    Remembers a consent answer learned elsewhere, such as from record_uses
+    """
+    key = (int(user_id), int(guild_id))
+    self.consents[key] = consent
+    self.consents.move_to_end(key)
+
+    while len(self.consents) > self.consent_cache_size:
+      self.consents.popitem(last=False)
+
+  def forget_consent(self, user_id: Id, guild_id: Id):
+    self.consents.pop((int(user_id), int(guild_id)), None)
+
+  def forget_all_consent(self, user_id: Id):
+    for key in [key for key in self.consents if key[0] == int(user_id)]:
+      self.consents.pop(key, None)
+
+  @abstractmethod
+  def set_consent(self, user_id: Id, guild_id: Id, consent: bool):
+    """
+    Records whether a user consents to their emoji uses being counted in a guild
+    """
+
+  @abstractmethod
+  def delete_stats(self, user_id: Id, guild_id: Id):
+    """
+    Deletes a user's stats in a guild, including their consent
+    """
+
+  @abstractmethod
+  def get_guilds(self, user_id: Id) -> List[int]:
+    """
+    Returns the ids of the guilds a user has stats (or a consent choice) in, in ascending order
+    """
+
+  def get_all_stats(self, user_id: Id) -> Dict[int, Dict[str, str]]:
+    """
+    Returns a user's stats in every guild they have stats in (see get_stats), by guild id.
+    Implementations read them in one round trip where they can
+    """
+    return { guild_id: self.get_stats(user_id, guild_id) for guild_id in self.get_guilds(user_id) }
+
+  def delete_all_stats(self, user_id: Id) -> List[int]:
+    """
+    Deletes a user's stats in every guild, including their consent
+
+    Returns:
+      the ids of the guilds stats were deleted in
+    """
+    guild_ids = self.get_guilds(user_id)
+
+    for guild_id in guild_ids:
+      self.delete_stats(user_id, guild_id)
+
+    self.forget_all_consent(user_id)
+
+    return guild_ids
+
+  @abstractmethod
+  def get_categories(self, guild_id: Id) -> Dict[str, str]:
+    """
+    Returns a guild's emoji categories: category -> space-separated emojis
+    """
+
+  @abstractmethod
+  def set_category(self, guild_id: Id, category: str, emojis: List[str]):
+    """
+    Sets the emojis of a category, replacing its previous emojis
+
+    Raises:
+      ValueError if an emoji already belongs to another category
+    """
+
+  @abstractmethod
+  def delete_category(self, guild_id: Id, category: str):
+    """
+    Deletes a category (its emojis are then uncategorized)
+    """
+
+  def flush(self):
+    """
+    Writes any batched writes
+    """
+
+  def close(self):
+    """
+    Flushes, then releases the storage's resources
+    """
+    self.flush()
+
+  @staticmethod
+  def check_category(categories: Dict[str, str], category: str, emojis: List[str]):
+    """
+    Raises a ValueError if one of emojis is in a category other than category
+    """
+    for [existing_category, emojilist] in categories.items():
+      if existing_category == category:
+        continue
+
+      for emoji in emojis:
+        if emoji in emojilist.split(" "):
+          raise ValueError(f"Emoji {emoji} is already used in category {existing_category}")
@@ -0,0 +1,185 @@
+"""
+Checks that a storage implementation behaves like every other: the checks run against a fresh
+storage and describe the first difference from the expected behavior.
+Checks use guild ids from CHECK_GUILD up, and delete the stats and categories they wrote
+
+python -m bot.storage.conformance sqlite      (a temporary database)
+python -m bot.storage.conformance redis       (the configured redis)
+"""
+from argparse import ArgumentParser
+from os import path
+from sys import exit
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Optional
+
+from .base import Storage
+from .redisstorage import RedisStorage
+from .sqlitestorage import SqliteStorage
+
+__all__ = ["checks", "run_checks"]
+
+CHECK_GUILD = 900000000000000000
+USER = 100000000000000001
+OTHER_USER = 100000000000000002
+
+GRINNING = "\U0001f600"
+THUMBS_UP_MEDIUM = "\U0001f44d\U0001f3fd"
+PARTY = "<:party:700000000000000000>"
+
+def expect(actual: object, expected: object, what: str):
+  if actual != expected:
+    raise AssertionError(f"{what}: expected {expected!r}, got {actual!r}")
+
+def check_no_stats(storage: Storage, guild: int):
+  expect(storage.get_stats(USER, guild), {}, "stats of a user who never consented")
+
+def check_consent_required(storage: Storage, guild: int):
+  storage.record_uses(USER, guild, [GRINNING])
+  expect(storage.get_stats(USER, guild), {}, "uses before consenting")
+
+  storage.set_consent(USER, guild, True)
+  storage.record_uses(USER, guild, [GRINNING])
+  expect(storage.get_stats(USER, guild), { "consent": "1", GRINNING: "1" }, "uses after consenting")
+
+def check_repeats(storage: Storage, guild: int):
+  storage.set_consent(USER, guild, True)
+  storage.record_uses(USER, guild, [GRINNING, PARTY, GRINNING, THUMBS_UP_MEDIUM])
+  storage.record_uses(USER, guild, [PARTY])
+  expect(storage.get_stats(USER, guild), { "consent": "1", GRINNING: "2", PARTY: "2", THUMBS_UP_MEDIUM: "1" },
+    "repeated uses")
+
+def check_removal(storage: Storage, guild: int):
+  storage.set_consent(USER, guild, True)
+  storage.record_uses(USER, guild, [GRINNING, GRINNING, PARTY])
+  storage.record_uses(USER, guild, [GRINNING], -1)
+  storage.record_uses(USER, guild, [PARTY], -1)
+  storage.record_uses(USER, guild, [THUMBS_UP_MEDIUM], -1)
+  expect(storage.get_stats(USER, guild), { "consent": "1", GRINNING: "1" },
+    "uses after removals (counts at 0 are removed, uncounted emojis stay uncounted)")
+
+def check_revoke(storage: Storage, guild: int):
+  expect(storage.has_consent(USER, guild), False, "consent before consenting")
+  storage.set_consent(USER, guild, True)
+  expect(storage.has_consent(USER, guild), True, "consent after consenting")
+  storage.record_uses(USER, guild, [GRINNING])
+  storage.set_consent(USER, guild, False)
+  expect(storage.has_consent(USER, guild), False, "consent after revoking")
+  storage.record_uses(USER, guild, [GRINNING, PARTY])
+  expect(storage.get_stats(USER, guild), { "consent": "0", GRINNING: "1" }, "uses after revoking")
+
+def check_delete(storage: Storage, guild: int):
+  storage.set_consent(USER, guild, True)
+  storage.record_uses(USER, guild, [GRINNING])
+  storage.delete_stats(USER, guild)
+  expect(storage.get_stats(USER, guild), {}, "stats after deleting")
+
+  storage.record_uses(USER, guild, [GRINNING])
+  expect(storage.get_stats(USER, guild), {}, "uses after deleting (consent is deleted too)")
+
+def check_isolation(storage: Storage, guild: int):
+  other_guild = guild + 1
+  storage.set_consent(USER, guild, True)
+  storage.set_consent(USER, other_guild, True)
+  storage.set_consent(OTHER_USER, guild, True)
+  storage.record_uses(USER, guild, [GRINNING])
+  storage.record_uses(USER, other_guild, [PARTY])
+  storage.record_uses(OTHER_USER, guild, [PARTY, PARTY])
+  expect(storage.get_stats(USER, guild), { "consent": "1", GRINNING: "1" }, "stats in the first guild")
+  expect(storage.get_stats(USER, other_guild), { "consent": "1", PARTY: "1" }, "stats in the second guild")
+  expect(storage.get_stats(OTHER_USER, guild), { "consent": "1", PARTY: "2" }, "stats of another user")
+
+def check_all_guilds(storage: Storage, guild: int):
+  other_guild = guild + 1
+  storage.set_consent(USER, guild, True)
+  storage.set_consent(USER, other_guild, False)
+  storage.set_consent(OTHER_USER, guild, True)
+  storage.record_uses(USER, guild, [GRINNING, GRINNING])
+  expect(storage.get_guilds(USER), [guild, other_guild], "guilds with stats")
+  expect(storage.get_all_stats(USER), { guild: { "consent": "1", GRINNING: "2" }, other_guild: { "consent": "0" } },
+    "stats in every guild")
+  expect(storage.delete_all_stats(USER), [guild, other_guild], "guilds whose stats were deleted")
+  expect(storage.get_all_stats(USER), {}, "stats in every guild after deleting them")
+  expect(storage.get_stats(OTHER_USER, guild), { "consent": "1" }, "stats of another user after deleting")
+
+def check_categories(storage: Storage, guild: int):
+  expect(storage.get_categories(guild), {}, "categories of a new guild")
+
+  storage.set_category(guild, "joy", [GRINNING, PARTY])
+  storage.set_category(guild, "approval", [THUMBS_UP_MEDIUM])
+  expect(storage.get_categories(guild), { "joy": f"{GRINNING} {PARTY}", "approval": THUMBS_UP_MEDIUM }, "categories")
+
+  try:
+    storage.set_category(guild, "approval", [PARTY])
+    raise AssertionError("setting an emoji that is in another category did not raise a ValueError")
+  except ValueError:
+    pass
+
+  storage.set_category(guild, "joy", [GRINNING])
+  storage.delete_category(guild, "approval")
+  expect(storage.get_categories(guild), { "joy": GRINNING }, "categories after replacing and deleting")
+
+def cleanup(storage: Storage, guild: int):
+  for guild_id in (guild, guild + 1):
+    for user in (USER, OTHER_USER):
+      storage.delete_stats(user, guild_id)
+
+    for category in storage.get_categories(guild_id):
+      storage.delete_category(guild_id, category)
+
+checks: List[Callable[[Storage, int], None]] = [
+  check_no_stats,
+  check_consent_required,
+  check_repeats,
+  check_removal,
+  check_revoke,
+  check_delete,
+  check_isolation,
+  check_all_guilds,
+  check_categories
+]
+
+def run_checks(storage: Storage) -> Dict[str, Optional[str]]:
+  """
+  Runs every check against a storage
+
+  Returns:
+    the name of each check, with the problem it found (None if it passed)
+  """
+  results: Dict[str, Optional[str]] = {}
+
+  for [index, check] in enumerate(checks):
+    guild = CHECK_GUILD + index * 2
+    cleanup(storage, guild)
+
+    try:
+      check(storage, guild)
+      results[check.__name__] = None
+    except AssertionError as e:
+      results[check.__name__] = str(e)
+    finally:
+      cleanup(storage, guild)
+
+  return results
+
+def main():
+  parser = ArgumentParser(description="Checks that a storage implementation conforms")
+  parser.add_argument("backend", choices=["redis", "sqlite"])
+  args = parser.parse_args()
+
+  with TemporaryDirectory() as directory:
+    if args.backend == "sqlite":
+      storage: Storage = SqliteStorage(path.join(directory, "conformance.db"))
+    else:
+      storage = RedisStorage()
+
+    results = run_checks(storage)
+    storage.close()
+
+  for [name, problem] in results.items():
+    print(f"{'FAIL' if problem else 'ok  '} {name}" + (f": {problem}" if problem else ""))
+
+  if any(results.values()):
+    exit(1)
+
+if __name__ == "__main__":
+  main()
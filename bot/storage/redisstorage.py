@@ -0,0 +1,81 @@
+from typing import Dict, List
+
+from .base import Storage
+from ..util import read_all_stats, read_stats, record_uses, redis, redlocks
+from ..util.keys import Id, categories_key, stats_key, user_guilds_key
+
+__all__ = ["RedisStorage"]
+
+class RedisStorage(Storage):
+  """
+  Stores stats in the shared redis (see bot.util.redis): a hash of interned emoji ids per user
+  and guild (see bot.util.emojis), and a hash of categories per guild.
+
+  A set per user indexes the guilds they have stats in, so their stats in every guild can be read
+  or deleted without scanning. Stats removed behind the index's back (by retention cleanups) leave
+  stale guilds in it, which are dropped the next time they are read
+  """
+  def record_uses(self, user_id: Id, guild_id: Id, emojis: List[str], change: int = 1) -> bool:
+    return record_uses(user_id, guild_id, emojis, change)
+
+  def get_stats(self, user_id: Id, guild_id: Id) -> Dict[str, str]:
+    return read_stats(stats_key(user_id, guild_id))
+
+  def has_consent(self, user_id: Id, guild_id: Id) -> bool:
+    return redis.hget(stats_key(user_id, guild_id), "consent") == "1"
+
+  def set_consent(self, user_id: Id, guild_id: Id, consent: bool):
+    self.forget_consent(user_id, guild_id)
+
+    # the keys are in different slots, so this is one round trip but not a transaction in a cluster
+    with redis.pipeline(transaction=False) as pipe:
+      pipe.hset(stats_key(user_id, guild_id), "consent", "1" if consent else "0")
+      pipe.sadd(user_guilds_key(user_id), guild_id)
+      pipe.execute()
+
+  def delete_stats(self, user_id: Id, guild_id: Id):
+    self.forget_consent(user_id, guild_id)
+
+    with redis.pipeline(transaction=False) as pipe:
+      pipe.delete(stats_key(user_id, guild_id))
+      pipe.srem(user_guilds_key(user_id), guild_id)
+      pipe.execute()
+
+  def get_guilds(self, user_id: Id) -> List[int]:
+    return sorted(int(guild_id) for guild_id in redis.smembers(user_guilds_key(user_id)))
+
+  def get_all_stats(self, user_id: Id) -> Dict[int, Dict[str, str]]:
+    guild_ids = self.get_guilds(user_id)
+    stats = read_all_stats(user_id, guild_ids)
+    stale = [guild_id for guild_id in guild_ids if not stats[str(guild_id)]]
+
+    if stale:
+      redis.srem(user_guilds_key(user_id), *stale)
+
+    return { guild_id: stats[str(guild_id)] for guild_id in guild_ids if guild_id not in stale }
+
+  def delete_all_stats(self, user_id: Id) -> List[int]:
+    self.forget_all_consent(user_id)
+    guild_ids = self.get_guilds(user_id)
+
+    with redis.pipeline(transaction=False) as pipe:
+      for guild_id in guild_ids:
+        pipe.delete(stats_key(user_id, guild_id))
+
+      pipe.delete(user_guilds_key(user_id))
+      deleted = pipe.execute()[:len(guild_ids)]
+
+    return [guild_id for [guild_id, count] in zip(guild_ids, deleted) if count]
+
+  def get_categories(self, guild_id: Id) -> Dict[str, str]:
+    return redis.hgetall(categories_key(guild_id))
+
+  def set_category(self, guild_id: Id, category: str, emojis: List[str]):
+    key = categories_key(guild_id)
+
+    with redlocks.create_lock(f"{key}:lock"):
+      self.check_category(redis.hgetall(key), category, emojis)
+      redis.hset(key, category, " ".join(emojis))
+
+  def delete_category(self, guild_id: Id, category: str):
+    redis.hdel(categories_key(guild_id), category)
@@ -0,0 +1,255 @@
+"""
+Stats in an embedded SQLite database, for small deployments and tests.
+
+The database runs in WAL mode with synchronous=NORMAL, so reads do not block writes and a commit
+does not wait for an fsync. Emoji uses are buffered and written in one transaction once FLUSH_USES
+calls are pending or FLUSH_SECONDS have passed, and before any other call, so reads see every
+earlier write; a crash loses at most the buffered uses. Statements are constant strings, which
+sqlite3 prepares once and keeps in its statement cache
+"""
+import sqlite3
+
+from asyncio import get_running_loop
+from collections import Counter
+from contextlib import contextmanager
+from os import environ
+from threading import RLock
+from typing import Dict, Iterator, List
+
+from .base import Storage
+from ..util.keys import Id
+
+__all__ = ["SqliteStorage"]
+
+SQLITE_PATH = environ.get("SAFETY_SQLITE_PATH", "safety.db")
+FLUSH_USES = int(environ.get("SAFETY_SQLITE_FLUSH_USES", "256"))
+FLUSH_SECONDS = float(environ.get("SAFETY_SQLITE_FLUSH_SECONDS", "1"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS consent (
+  guild_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  consent INTEGER NOT NULL,
+  PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS emoji_uses (
+  guild_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  emoji TEXT NOT NULL,
+  uses INTEGER NOT NULL,
+  PRIMARY KEY (guild_id, user_id, emoji)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS categories (
+  guild_id INTEGER NOT NULL,
+  category TEXT NOT NULL,
+  emojis TEXT NOT NULL,
+  PRIMARY KEY (guild_id, category)
+) WITHOUT ROWID;
+
+-- a user's stats in every guild (see get_all_stats)
+CREATE INDEX IF NOT EXISTS consent_by_user ON consent (user_id);
+CREATE INDEX IF NOT EXISTS emoji_uses_by_user ON emoji_uses (user_id);
+"""
+
+# only counts uses for users who consented
+ADD_USES = """
+INSERT INTO emoji_uses (guild_id, user_id, emoji, uses)
+SELECT :guild, :user, :emoji, :change
+WHERE EXISTS (SELECT 1 FROM consent WHERE guild_id = :guild AND user_id = :user AND consent = 1)
+ON CONFLICT (guild_id, user_id, emoji) DO UPDATE SET uses = uses + excluded.uses
+"""
+DELETE_UNUSED = "DELETE FROM emoji_uses WHERE guild_id = :guild AND user_id = :user AND emoji = :emoji AND uses <= 0"
+SELECT_CONSENT = "SELECT consent FROM consent WHERE guild_id = ? AND user_id = ?"
+SELECT_USES = "SELECT emoji, uses FROM emoji_uses WHERE guild_id = ? AND user_id = ?"
+UPSERT_CONSENT = """
+INSERT INTO consent (guild_id, user_id, consent) VALUES (?, ?, ?)
+ON CONFLICT (guild_id, user_id) DO UPDATE SET consent = excluded.consent
+"""
+DELETE_CONSENT = "DELETE FROM consent WHERE guild_id = ? AND user_id = ?"
+DELETE_USES = "DELETE FROM emoji_uses WHERE guild_id = ? AND user_id = ?"
+SELECT_GUILDS = "SELECT guild_id FROM consent WHERE user_id = ? ORDER BY guild_id"
+SELECT_ALL_CONSENT = "SELECT guild_id, consent FROM consent WHERE user_id = ? ORDER BY guild_id"
+SELECT_ALL_USES = "SELECT guild_id, emoji, uses FROM emoji_uses WHERE user_id = ?"
+DELETE_ALL_CONSENT = "DELETE FROM consent WHERE user_id = ?"
+DELETE_ALL_USES = "DELETE FROM emoji_uses WHERE user_id = ?"
+SELECT_CATEGORIES = "SELECT category, emojis FROM categories WHERE guild_id = ?"
+UPSERT_CATEGORY = """
+INSERT INTO categories (guild_id, category, emojis) VALUES (?, ?, ?)
+ON CONFLICT (guild_id, category) DO UPDATE SET emojis = excluded.emojis
+"""
+DELETE_CATEGORY = "DELETE FROM categories WHERE guild_id = ? AND category = ?"
+
+class SqliteStorage(Storage):
+  """
+  Stores stats in a SQLite database file
+  """
+  def __init__(self, path: str = SQLITE_PATH, flush_uses: int = FLUSH_USES, flush_seconds: float = FLUSH_SECONDS):
+    super().__init__()
+    # autocommit, with explicit transactions (see transaction)
+    self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=64)
+    self.lock = RLock()
+    self.flush_uses = flush_uses
+    self.flush_seconds = flush_seconds
+    # buffered uses, in order: guild, user, emoji, change
+    self.pending: List[Dict[str, object]] = []
+    self.pending_calls = 0
+    self.flush_scheduled = False
+
+    with self.lock:
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.execute("PRAGMA synchronous=NORMAL")
+      self.connection.executescript(SCHEMA)
+
+  @contextmanager
+  def transaction(self) -> Iterator[sqlite3.Connection]:
+    """
+    Runs the statements in the block in one transaction, committed if the block succeeds
+    """
+    with self.lock:
+      self.connection.execute("BEGIN IMMEDIATE")
+
+      try:
+        yield self.connection
+      except BaseException:
+        self.connection.execute("ROLLBACK")
+        raise
+
+      self.connection.execute("COMMIT")
+
+  def record_uses(self, user_id: Id, guild_id: Id, emojis: List[str], change: int = 1) -> bool:
+    if not emojis:
+      return False
+
+    with self.lock:
+      # consent is written immediately, so it is current even while uses are buffered
+      if not self.has_consent(user_id, guild_id):
+        return False
+
+      for [emoji, count] in Counter(emojis).items():
+        self.pending.append({ "guild": int(guild_id), "user": int(user_id), "emoji": emoji, "change": count * change })
+
+      self.pending_calls += 1
+
+      if self.pending_calls >= self.flush_uses:
+        self.flush()
+      elif not self.flush_scheduled:
+        self.schedule_flush()
+
+    return True
+
+  def schedule_flush(self):
+    """
+    Flushes after flush_seconds, when running in an event loop. Otherwise the uses stay
+    buffered until the next read or write, or until flush_uses are pending
+    """
+    try:
+      loop = get_running_loop()
+    except RuntimeError:
+      return
+
+    self.flush_scheduled = True
+    loop.call_later(self.flush_seconds, self.flush)
+
+  def flush(self):
+    with self.lock:
+      self.flush_scheduled = False
+
+      if not self.pending:
+        return
+
+      with self.transaction() as connection:
+        for row in self.pending:
+          connection.execute(ADD_USES, row)
+
+          if row["change"] < 0:
+            connection.execute(DELETE_UNUSED, row)
+
+      self.pending = []
+      self.pending_calls = 0
+
+  def get_stats(self, user_id: Id, guild_id: Id) -> Dict[str, str]:
+    with self.lock:
+      self.flush()
+      consent = self.connection.execute(SELECT_CONSENT, (int(guild_id), int(user_id))).fetchone()
+      uses = self.connection.execute(SELECT_USES, (int(guild_id), int(user_id))).fetchall()
+
+    stats = { emoji: str(count) for [emoji, count] in uses }
+
+    if consent is not None:
+      stats["consent"] = str(consent[0])
+
+    return stats
+
+  def has_consent(self, user_id: Id, guild_id: Id) -> bool:
+    with self.lock:
+      consent = self.connection.execute(SELECT_CONSENT, (int(guild_id), int(user_id))).fetchone()
+
+    return consent is not None and consent[0] == 1
+
+  def set_consent(self, user_id: Id, guild_id: Id, consent: bool):
+    with self.lock:
+      self.forget_consent(user_id, guild_id)
+      self.flush()
+      self.connection.execute(UPSERT_CONSENT, (int(guild_id), int(user_id), 1 if consent else 0))
+
+  def delete_stats(self, user_id: Id, guild_id: Id):
+    with self.lock:
+      self.forget_consent(user_id, guild_id)
+      self.flush()
+
+      with self.transaction() as connection:
+        connection.execute(DELETE_CONSENT, (int(guild_id), int(user_id)))
+        connection.execute(DELETE_USES, (int(guild_id), int(user_id)))
+
+  def get_guilds(self, user_id: Id) -> List[int]:
+    # uses are only counted with consent, and deleted with it, so consent rows cover every guild
+    with self.lock:
+      return [guild_id for [guild_id] in self.connection.execute(SELECT_GUILDS, (int(user_id),)).fetchall()]
+
+  def get_all_stats(self, user_id: Id) -> Dict[int, Dict[str, str]]:
+    with self.lock:
+      self.flush()
+      consents = self.connection.execute(SELECT_ALL_CONSENT, (int(user_id),)).fetchall()
+      uses = self.connection.execute(SELECT_ALL_USES, (int(user_id),)).fetchall()
+
+    stats: Dict[int, Dict[str, str]] = { guild_id: {} for [guild_id, _] in consents }
+
+    for [guild_id, emoji, count] in uses:
+      stats.setdefault(guild_id, {})[emoji] = str(count)
+
+    for [guild_id, consent] in consents:
+      stats[guild_id]["consent"] = str(consent)
+
+    return stats
+
+  def delete_all_stats(self, user_id: Id) -> List[int]:
+    with self.lock:
+      self.forget_all_consent(user_id)
+      self.flush()
+
+      with self.transaction() as connection:
+        guild_ids = [guild_id for [guild_id] in connection.execute(SELECT_GUILDS, (int(user_id),)).fetchall()]
+        connection.execute(DELETE_ALL_CONSENT, (int(user_id),))
+        connection.execute(DELETE_ALL_USES, (int(user_id),))
+
+    return guild_ids
+
+  def get_categories(self, guild_id: Id) -> Dict[str, str]:
+    with self.lock:
+      return dict(self.connection.execute(SELECT_CATEGORIES, (int(guild_id),)).fetchall())
+
+  def set_category(self, guild_id: Id, category: str, emojis: List[str]):
+    with self.transaction() as connection:
+      self.check_category(dict(connection.execute(SELECT_CATEGORIES, (int(guild_id),)).fetchall()), category, emojis)
+      connection.execute(UPSERT_CATEGORY, (int(guild_id), category, " ".join(emojis)))
+
+  def delete_category(self, guild_id: Id, category: str):
+    with self.lock:
+      self.connection.execute(DELETE_CATEGORY, (int(guild_id), category))
+
+  def close(self):
+    with self.lock:
+      self.flush()
+      self.connection.close()
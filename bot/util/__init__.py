@@ -1,6 +1,13 @@
-from .gsheets import sheets
+from .emojis import extract_emojis, interner, read_all_stats, read_stats, record_uses
+from .gsheets import CircuitOpenError, get_values, sheets
+from .messages import chunk_message, send_chunked
+from .metrics import record_error
+from .rand import rand
+from .recurrence import Recurrence
 from .scheduler import redlocks, scheduler
+from .sheetgateway import gateway
 from .redis import redis
+from .timeparse import parse_datetime, parse_duration, resolve_zone
 from .util import get_date, get_local_date
 
-__all__ = ["get_date", "get_local_date", "redlocks", "scheduler", "sheets"]
\ No newline at end of file
+__all__ = ["CircuitOpenError", "Recurrence", "chunk_message", "extract_emojis", "gateway", "get_date", "get_local_date", "get_values", "interner", "parse_datetime", "parse_duration", "rand", "read_all_stats", "read_stats", "record_error", "record_uses", "redlocks", "resolve_zone", "scheduler", "send_chunked", "sheets"]
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+The dice engine behind >roll.
+
+Dice are drawn in batches from the shared buffered random source instead of one randint call per
+die. Large rolls only keep a count per face (or, for huge dice, the few values that will be
+dropped), so memory does not grow with the number of dice. Dropping the lowest/highest dice
+uses partial selection
+"""
+from collections import Counter
+from heapq import nlargest, nsmallest
+from os import environ
+from re import compile
+from typing import Dict, List, NamedTuple, Optional
+
+from .rand import BufferedRandom, rand
+
+__all__ = ["DiceSpec", "RollResult", "parse_roll", "pattern", "roll_dice"]
+
+pattern = r'(?P<count>\d+)d(?P<size>\d+)((?P<addition>[+-]\d+))?(dl(?P<low>\d*))?(dh(?P<high>\d*))?'
+compiled_pattern = compile(pattern)
+
+# the most dice a single roll may use
+MAX_DICE = int(environ.get("SAFETY_MAX_DICE", 10 ** 7))
+# rolls with at most this many dice list every result
+DISPLAY_LIMIT = 100
+# dice are generated this many at a time
+BATCH_SIZE = 1 << 16
+# dice with at most this many faces are tallied per face instead of kept
+HISTOGRAM_FACES = 1 << 16
+
+class DiceSpec(NamedTuple):
+  count: int
+  size: int
+  addition: int
+  low: int
+  high: int
+
+  def describe(self) -> str:
+    message = f"{self.count}d{self.size}"
+
+    if self.addition != 0:
+      message += f"{self.addition:+d}"
+
+    if self.low != 0:
+      message += f", drop {self.low} lowest"
+
+      if self.high != 0:
+        message += f" and {self.high} highest"
+    elif self.high != 0:
+      message += f", drop {self.high} highest"
+
+    return message
+
+class RollResult(NamedTuple):
+  spec: DiceSpec
+  # sum of the kept dice, without the addition
+  kept_sum: int
+  # the dropped dice, lowest first
+  dropped: List[int]
+  lowest: int
+  highest: int
+  # every die, sorted (only for rolls of at most DISPLAY_LIMIT dice)
+  rolls: Optional[List[int]]
+  # number of dice per face (only for dice with at most HISTOGRAM_FACES faces)
+  counts: Optional[Dict[int, int]]
+
+  @property
+  def total(self) -> int:
+    return self.kept_sum + self.spec.addition
+
+  @property
+  def kept(self) -> int:
+    return self.spec.count - len(self.dropped)
+
+def parse_roll(input: str) -> Optional[DiceSpec]:
+  """
+  Parses a roll matching pattern
+
+  Args:
+    input (str): a roll, such as 8d10+2dl2dh
+
+  Returns (Optional[DiceSpec]):
+    the roll, or None if it does not match pattern
+
+  Raises:
+    ValueError: if the roll matches but cannot be rolled
+  """
+  groups = compiled_pattern.match(input)
+
+  if groups is None:
+    return None
+
+  count = int(groups.group("count"))
+
+  if count == 0:
+    raise ValueError("I *can* roll zero dice, but am morally obligated not to")
+
+  if count > MAX_DICE:
+    raise ValueError(f"I can only roll up to {MAX_DICE} dice at once")
+
+  size = int(groups.group("size"))
+
+  if size == 0:
+    raise ValueError("I will not roll a d0")
+
+  addition = 0
+
+  if groups.group("addition") != None:
+    addition = int(groups.group("addition"))
+
+  low_drop = 0
+  high_drop = 0
+
+  if groups.group("low") != None:
+    low = groups.group("low")
+    low_drop = 1 if low == "" else int(low)
+
+  if groups.group("high") != None:
+    high = groups.group("high")
+    high_drop = 1 if high == "" else int(high)
+
+  if low_drop + high_drop >= count:
+    raise ValueError(f"You want to drop {low_drop + high_drop} dice but are only rolling {count} (must have at least one)")
+
+  return DiceSpec(count, size, addition, low_drop, high_drop)
+
+def roll_dice(spec: DiceSpec, rng: BufferedRandom = rand) -> RollResult:
+  """
+  Rolls dice in batches. Memory stays bounded by the batch size, the number of faces
+  and the number of dropped dice, rather than the number of dice
+
+  Args:
+    spec (DiceSpec): the roll
+    rng (BufferedRandom): the source of randomness
+
+  Returns (RollResult):
+    the result of the roll
+  """
+  tally = spec.size <= HISTOGRAM_FACES
+  counts: Counter = Counter()
+  rolls: Optional[List[int]] = [] if spec.count <= DISPLAY_LIMIT else None
+  lows: List[int] = []
+  highs: List[int] = []
+  total = 0
+  lowest = spec.size
+  highest = 1
+  remaining = spec.count
+
+  while remaining > 0:
+    batch = rng.randints(1, spec.size, min(remaining, BATCH_SIZE))
+    remaining -= len(batch)
+
+    total += sum(batch)
+
+    if rolls is not None:
+      rolls.extend(batch)
+
+    if tally:
+      counts.update(batch)
+    else:
+      lowest = min(lowest, min(batch))
+      highest = max(highest, max(batch))
+
+      if spec.low:
+        lows = nsmallest(spec.low, lows + batch)
+
+      if spec.high:
+        highs = nlargest(spec.high, highs + batch)
+
+  if tally:
+    faces = sorted(counts)
+    lowest = faces[0]
+    highest = faces[-1]
+    lows = take(counts, faces, spec.low)
+    highs = take(counts, reversed(faces), spec.high)
+
+  dropped = sorted(lows + highs)
+
+  if rolls is not None:
+    rolls.sort()
+
+  return RollResult(spec, total - sum(dropped), dropped, lowest, highest, rolls,
+    dict(counts) if tally else None)
+
+def take(counts: Dict[int, int], faces, amount: int) -> List[int]:
+  """
+  Takes the first amount dice from a per-face tally, visiting faces in the given order
+  """
+  taken: List[int] = []
+
+  for face in faces:
+    if len(taken) >= amount:
+      break
+
+    taken.extend([face] * min(counts[face], amount - len(taken)))
+
+  return taken
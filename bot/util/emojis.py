@@ -0,0 +1,225 @@
+"""
+Emoji extraction, and the compact encoding of emoji stats.
+
+A user's stats hash does not use emojis as field names: each guild interns its emojis, giving
+every emoji a small integer id the first time it is counted, and stats hashes map ids to uses.
+Short integer fields keep the hashes in redis' compact (listpack/ziplist) encoding, where a custom
+emoji's name would take 30-60 bytes per field. Ids are dense and never reused, so both directions
+of the table are cached in memory once seen
+"""
+from collections import Counter
+from emoji import get_emoji_regexp
+from re import compile
+from typing import Dict, Iterable, List
+
+from .keys import Id, emoji_ids_key, emoji_names_key, guild_of, stats_key
+from .lazy import Lazy
+from .memory import register_cache
+from .redis import redis
+
+__all__ = ["EmojiInterner", "discord_emojis", "extract_emojis", "interner", "read_all_stats", "read_stats", "record_uses"]
+
+discord_emojis = compile(r'<a?:[a-zA-Z0-9\_]+:[0-9]+>')
+
+# KEYS: the guild's emoji -> id and id -> emoji hashes. ARGV: emojis. Returns their ids, allocating
+# the next free id (the table's size) to emojis seen for the first time
+INTERN_SCRIPT = """
+local ids = {}
+for i, emoji in ipairs(ARGV) do
+  local id = redis.call("HGET", KEYS[1], emoji)
+  if not id then
+    id = tostring(redis.call("HLEN", KEYS[1]))
+    redis.call("HSET", KEYS[1], emoji, id)
+    redis.call("HSET", KEYS[2], id, emoji)
+  end
+  ids[i] = id
+end
+return ids
+"""
+
+# KEYS: a stats hash. ARGV: pairs of id and change. Only counts uses for users who consented,
+# and removes counts that drop to 0. Returns 1 if the uses were counted
+RECORD_SCRIPT = """
+if redis.call("HGET", KEYS[1], "consent") ~= "1" then
+  return 0
+end
+for i = 1, #ARGV, 2 do
+  if redis.call("HINCRBY", KEYS[1], ARGV[i], ARGV[i + 1]) <= 0 then
+    redis.call("HDEL", KEYS[1], ARGV[i])
+  end
+end
+return 1
+"""
+
+intern_script = Lazy(lambda: redis.register_script(INTERN_SCRIPT))
+record_script = Lazy(lambda: redis.register_script(RECORD_SCRIPT))
+
+def extract_emojis(content: str) -> List[str]:
+  """
+  Finds every emoji used in a message: unicode emojis first, then custom discord emojis (<:name:id>)
+
+  Args:
+    content (str): the text of a message
+
+  Returns:
+    the emojis in the message, with repeats
+  """
+  return get_emoji_regexp().findall(content) + discord_emojis.findall(content)
+
+class EmojiInterner:
+  """
+  Maps emojis to their per-guild ids and back, caching every mapping it has seen
+  """
+  def __init__(self):
+    # guild id -> emoji -> id, and guild id -> id -> emoji
+    self.ids: Dict[str, Dict[str, str]] = {}
+    self.emojis: Dict[str, Dict[str, str]] = {}
+
+  def remember(self, guild_id: str, emoji: str, id: str):
+    self.ids.setdefault(guild_id, {})[emoji] = id
+    self.emojis.setdefault(guild_id, {})[id] = emoji
+
+  def intern(self, guild_id: Id, emojis: List[str]) -> List[str]:
+    """
+    Returns the ids of emojis in a guild, allocating ids for new emojis (one round trip for all of them)
+
+    Args:
+      guild_id (Id): the guild the emojis are counted in
+      emojis (List[str]): the emojis, which may repeat
+
+    Returns:
+      the id of each emoji, in order
+    """
+    guild_id = str(guild_id)
+    known = self.ids.get(guild_id, {})
+    missing = list({ emoji for emoji in emojis if emoji not in known })
+
+    if missing:
+      ids = intern_script.resolve()(keys=[emoji_ids_key(guild_id), emoji_names_key(guild_id)], args=missing)
+
+      for [emoji, id] in zip(missing, ids):
+        self.remember(guild_id, emoji, id)
+
+    known = self.ids[guild_id]
+
+    return [known[emoji] for emoji in emojis]
+
+  def lookup(self, guild_id: Id, emoji: str) -> str:
+    """
+    Returns the id of an emoji without allocating one, or "" if the guild has never counted it
+    """
+    guild_id = str(guild_id)
+    id = self.ids.get(guild_id, {}).get(emoji)
+
+    if id is None:
+      id = redis.hget(emoji_ids_key(guild_id), emoji)
+
+      if id is None:
+        return ""
+
+      self.remember(guild_id, emoji, id)
+
+    return id
+
+  def names(self, guild_id: Id, ids: List[str]) -> Dict[str, str]:
+    """
+    Returns the emoji of each id (ids that were never allocated are left out)
+    """
+    return self.names_many({ str(guild_id): ids })[str(guild_id)]
+
+  def names_many(self, ids_by_guild: Dict[str, List[str]]) -> Dict[str, Dict[str, str]]:
+    """
+    Returns the emoji of each id for several guilds, reading every id missing from memory in
+    one round trip
+    """
+    missing = { guild_id: [id for id in ids if id not in self.emojis.get(guild_id, {})]
+                for [guild_id, ids] in ids_by_guild.items() }
+    missing = { guild_id: ids for [guild_id, ids] in missing.items() if ids }
+
+    if missing:
+      with redis.pipeline(transaction=False) as pipe:
+        for [guild_id, ids] in missing.items():
+          pipe.hmget(emoji_names_key(guild_id), ids)
+
+        replies = pipe.execute()
+
+      for [[guild_id, ids], emojis] in zip(missing.items(), replies):
+        for [id, emoji] in zip(ids, emojis):
+          if emoji is not None:
+            self.remember(guild_id, emoji, id)
+
+    names: Dict[str, Dict[str, str]] = {}
+
+    for [guild_id, ids] in ids_by_guild.items():
+      known = self.emojis.get(guild_id, {})
+      names[guild_id] = { id: known[id] for id in ids if id in known }
+
+    return names
+
+  def size(self) -> int:
+    return sum(len(ids) for ids in self.ids.values())
+
+interner = EmojiInterner()
+
+register_cache("emoji ids", interner.size)
+
+def record_uses(user_id: Id, guild_id: Id, emojis: List[str], change: int = 1) -> bool:
+  """
+  Adds (or with a negative change, removes) uses of emojis to a user's stats, if they consented.
+  Takes one round trip, plus one more the first time the guild counts an emoji
+
+  Args:
+    user_id (Id): the user who used the emojis
+    guild_id (Id): the guild they were used in
+    emojis (List[str]): the emojis used, which may repeat
+    change (int): the uses to add per occurrence
+
+  Returns:
+    whether the user consented, so the uses were counted
+  """
+  if not emojis:
+    return False
+
+  args: List[str] = []
+
+  for [id, count] in Counter(interner.intern(guild_id, emojis)).items():
+    args += [id, str(count * change)]
+
+  return record_script.resolve()(keys=[stats_key(user_id, guild_id)], args=args) == 1
+
+def read_stats(key: str) -> Dict[str, str]:
+  """
+  Reads a stats hash, naming emojis instead of ids
+
+  Args:
+    key (str): the stats key (see stats_key)
+
+  Returns:
+    emoji -> uses, plus consent
+  """
+  stats = redis.hgetall(key)
+  names = interner.names(guild_of(key), [field for field in stats if field != "consent"])
+
+  return { names.get(field, field): count for [field, count] in stats.items() }
+
+def read_all_stats(user_id: Id, guild_ids: Iterable[Id]) -> Dict[str, Dict[str, str]]:
+  """
+  Reads a user's stats hashes in several guilds in one pipeline, naming emojis instead of ids
+  (emojis no guild has cached take one more round trip)
+
+  Returns:
+    guild id -> emoji -> uses, plus consent (empty for guilds without stats)
+  """
+  guild_ids = [str(guild_id) for guild_id in guild_ids]
+
+  with redis.pipeline(transaction=False) as pipe:
+    for guild_id in guild_ids:
+      pipe.hgetall(stats_key(user_id, guild_id))
+
+    hashes = pipe.execute()
+
+  names = interner.names_many({ guild_id: [field for field in stats if field != "consent"]
+                                for [guild_id, stats] in zip(guild_ids, hashes) })
+
+  return { guild_id: { names[guild_id].get(field, field): count for [field, count] in stats.items() }
+           for [guild_id, stats] in zip(guild_ids, hashes) }
@@ -1,8 +1,171 @@
+"""
+Google Sheets access that never blocks the event loop.
+Requests run in a small thread pool with a timeout and are retried with jittered backoff.
+A circuit breaker stops calling the API for a while once it keeps failing
+"""
+from asyncio import get_event_loop, sleep, wait_for
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from httplib2 import Http
 from os import environ
+from random import uniform
+from threading import local
+from time import monotonic
+from typing import List
 
-__all__ = ["sheets"]
+from .lazy import Lazy
+from .metrics import sheets_seconds
 
-key = environ.get("SAFETY_GOOGLE_KEY")
-sheets = build("sheets", "v4", developerKey=key)
-    
\ No newline at end of file
+__all__ = ["CircuitOpenError", "batch_get_values", "get_values", "sheets"]
+
+# building the client fetches the API discovery document, so it is deferred until first use
+sheets = Lazy(lambda: build("sheets", "v4", developerKey=environ.get("SAFETY_GOOGLE_KEY")))
+
+MAX_WORKERS = 4
+TIMEOUT = 15
+RETRIES = 3
+BACKOFF = 1
+FAILURE_THRESHOLD = 5
+RESET_AFTER = 60
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="sheets")
+# httplib2 connections are not thread safe, so each worker gets its own
+connections = local()
+
+class CircuitOpenError(Exception):
+  """An exception that is thrown when the Sheets API has been failing and calls are paused"""
+
+class CircuitBreaker:
+  """
+  Opens after a number of consecutive failures, and lets a single trial call through
+  once reset_after seconds have passed. A successful call closes it again
+  """
+  def __init__(self, threshold: int, reset_after: float):
+    self.threshold = threshold
+    self.reset_after = reset_after
+    self.failures = 0
+    self.opened_at = 0.0
+
+  def allow(self) -> bool:
+    if self.failures < self.threshold:
+      return True
+
+    if monotonic() - self.opened_at >= self.reset_after:
+      # half open: allow one trial, and wait another period if it fails
+      self.opened_at = monotonic()
+      return True
+
+    return False
+
+  def success(self):
+    self.failures = 0
+
+  def failure(self):
+    self.failures += 1
+
+    if self.failures >= self.threshold:
+      self.opened_at = monotonic()
+
+breaker = CircuitBreaker(FAILURE_THRESHOLD, RESET_AFTER)
+
+def execute(request) -> dict:
+  """
+  Runs a request on the calling (worker) thread with that thread's connection
+  """
+  if not hasattr(connections, "http"):
+    connections.http = Http(timeout=TIMEOUT)
+
+  return request.execute(http=connections.http)
+
+def retryable(error: Exception) -> bool:
+  """
+  Client errors (other than rate limiting) will not succeed on retry
+  """
+  if isinstance(error, HttpError):
+    return error.resp.status == 429 or error.resp.status >= 500
+
+  return True
+
+async def call(request) -> dict:
+  """
+  Executes a Sheets API request off the event loop
+
+  Args:
+    request: a googleapiclient request (not yet executed)
+
+  Returns (dict):
+    the response body
+
+  Raises:
+    CircuitOpenError: if the API has been failing and calls are paused
+    Exception: the last error if every attempt failed
+  """
+  start = monotonic()
+  outcome = "error"
+
+  try:
+    result = await call_with_retries(request)
+    outcome = "ok"
+    return result
+  finally:
+    sheets_seconds.observe(outcome, value=monotonic() - start)
+
+async def call_with_retries(request) -> dict:
+  """
+  Runs a request on the executor, retrying with jittered backoff while the breaker allows it
+  """
+  loop = get_event_loop()
+
+  for attempt in range(RETRIES):
+    if not breaker.allow():
+      raise CircuitOpenError("The Google Sheets API is unavailable, try again later")
+
+    try:
+      result = await wait_for(loop.run_in_executor(executor, execute, request), TIMEOUT)
+      breaker.success()
+      return result
+    except Exception as e:
+      if not retryable(e):
+        breaker.success()
+        raise
+
+      breaker.failure()
+
+      if attempt + 1 == RETRIES:
+        raise
+
+      # full jitter keeps multiple callers from retrying in lockstep
+      await sleep(uniform(0, BACKOFF * 2 ** attempt))
+
+async def get_values(doc: str, range: str) -> List[List[str]]:
+  """
+  Reads a range of cells from a spreadsheet without blocking the event loop
+
+  Args:
+    doc (str): the spreadsheet id
+    range (str): the range to read, in A1 notation
+
+  Returns (List[List[str]]):
+    the rows in the range (empty trailing cells are omitted)
+  """
+  request = sheets.spreadsheets().values().get(spreadsheetId=doc, range=range)
+  response = await call(request)
+
+  return response.get("values", [])
+
+async def batch_get_values(doc: str, ranges: List[str]) -> List[List[List[str]]]:
+  """
+  Reads several ranges from a spreadsheet in a single request
+
+  Args:
+    doc (str): the spreadsheet id
+    ranges (List[str]): the ranges to read, in A1 notation
+
+  Returns (List[List[List[str]]]):
+    the rows of each range, in the same order as ranges
+  """
+  request = sheets.spreadsheets().values().batchGet(spreadsheetId=doc, ranges=ranges)
+  response = await call(request)
+
+  return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
@@ -0,0 +1,132 @@
+"""
+Names of the redis keys the bot stores data in.
+
+Keys carry a hash tag (the part in braces), so Redis Cluster stores every key with the same tag
+in the same slot: per-guild data is tagged with the guild id, and a recurring event's keys with
+the series id. Commands and scripts that touch several keys only ever touch keys sharing a tag.
+Keys from before tagging are moved over by bot.util.migration
+"""
+from typing import Optional, Union
+
+__all__ = [
+  "birthdays_key",
+  "categories_key",
+  "emoji_ids_key",
+  "emoji_names_key",
+  "emoji_users_key",
+  "guild_of",
+  "message_emojis_key",
+  "role_job_key",
+  "role_pending_key",
+  "series_key",
+  "signups_key",
+  "stats_key",
+  "tag",
+  "trending_key",
+  "trending_top_key",
+  "user_guilds_key"
+]
+
+Id = Union[int, str]
+
+def tag(id: Id) -> str:
+  return f"{{{id}}}"
+
+def guild_of(key: str) -> Optional[str]:
+  """
+  Returns the id in the hash tag of a key, or None if it has none
+  """
+  if not key.startswith("{") or "}" not in key:
+    return None
+
+  return key[1:key.index("}")]
+
+def stats_key(user_id: Id, guild_id: Id) -> str:
+  """
+  The hash of a user's emoji uses in a guild (interned emoji id -> uses, plus their consent)
+  """
+  return f"{tag(guild_id)}:stats:{user_id}"
+
+def user_guilds_key(user_id: Id) -> str:
+  """
+  The set of ids of the guilds a user has stats in. Tagged with the user, not a guild, so it
+  lives in its own slot
+  """
+  return f"{tag(f'user:{user_id}')}:guilds"
+
+def emoji_ids_key(guild_id: Id) -> str:
+  """
+  The hash interning a guild's emojis (emoji -> id), see bot.util.emojis
+  """
+  return f"{tag(guild_id)}:emoji_ids"
+
+def emoji_names_key(guild_id: Id) -> str:
+  """
+  The reverse of emoji_ids_key (id -> emoji)
+  """
+  return f"{tag(guild_id)}:emoji_names"
+
+def trending_key(guild_id: Id, bucket: int) -> str:
+  """
+  The count-min sketch of a guild's emoji uses in one time bucket (see bot.util.trending)
+  """
+  return f"{tag(guild_id)}:trending:{bucket}"
+
+def trending_top_key(guild_id: Id) -> str:
+  """
+  The sorted set of a guild's most used emojis (interned id -> estimated uses) in the trending window
+  """
+  return f"{tag(guild_id)}:trending_top"
+
+def emoji_users_key(guild_id: Id, emoji_id: str) -> str:
+  """
+  The HyperLogLog of the users who used an emoji (by interned id) in a guild
+  """
+  return f"{tag(guild_id)}:emoji_users:{emoji_id}"
+
+def message_emojis_key(guild_id: Id, message_id: Id) -> str:
+  """
+  The emojis of a message whose author consented, spilled from memory (see bot.util.messageemojis)
+  """
+  return f"{tag(guild_id)}:message_emojis:{message_id}"
+
+def categories_key(guild_id: Id) -> str:
+  """
+  The hash of a guild's emoji categories (category -> space-separated emojis)
+  """
+  return f"{tag(guild_id)}:categories"
+
+def birthdays_key(guild_id: Id) -> str:
+  """
+  The hash holding a guild's birthday sheet and announcement channel
+  """
+  return f"{tag(guild_id)}:birthdays"
+
+def series_key(series_id: str) -> str:
+  """
+  The hash describing a recurring event
+  """
+  return f"{tag(series_id)}:series"
+
+def signups_key(event_id: str, series_id: str = "") -> str:
+  """
+  The set of mentions of everyone signed up for an event. An occurrence of a recurring event
+  shares the series' tag, so its signups can be combined with the series' in one command
+
+  Args:
+    event_id (str): the id of the event, occurrence or series
+    series_id (str): the id of the recurring event an occurrence belongs to, if any
+  """
+  return f"{tag(series_id or event_id)}:signups:{event_id}"
+
+def role_job_key(job_id: str) -> str:
+  """
+  The hash describing a bulk role job
+  """
+  return f"{tag(job_id)}:role_job"
+
+def role_pending_key(job_id: str) -> str:
+  """
+  The set of member ids a bulk role job has yet to edit
+  """
+  return f"{tag(job_id)}:pending"
@@ -0,0 +1,40 @@
+"""
+Lazily created service handles. Importing a module that owns a service (redis, google sheets)
+does not create or connect anything; the service is built the first time it is used
+"""
+from threading import Lock
+from typing import Any, Callable
+
+__all__ = ["Lazy"]
+
+class Lazy:
+  """
+  A proxy to an object that is created by factory on first use.
+  Attribute access is forwarded to the object, so a Lazy can be used in its place
+  """
+  def __init__(self, factory: Callable[[], Any]):
+    object.__setattr__(self, "_factory", factory)
+    object.__setattr__(self, "_instance", None)
+    object.__setattr__(self, "_lock", Lock())
+
+  def resolve(self) -> Any:
+    """
+    Returns the underlying object, creating it if needed (thread safe).
+    Not named get, which would hide the get of the object (e.g. the redis GET command)
+    """
+    if self._instance is None:
+      with self._lock:
+        if self._instance is None:
+          object.__setattr__(self, "_instance", self._factory())
+
+    return self._instance
+
+  @property
+  def initialized(self) -> bool:
+    return self._instance is not None
+
+  def __getattr__(self, name: str) -> Any:
+    return getattr(self.resolve(), name)
+
+  def __setattr__(self, name: str, value: Any):
+    setattr(self.resolve(), name, value)
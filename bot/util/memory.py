@@ -0,0 +1,166 @@
+"""
+Memory accounting. Subsystems register a function reporting the size of their caches, and a
+tracemalloc tracker attributes allocations to cogs, modules and libraries, diffing each report
+against the previous one so growth stands out.
+
+tracemalloc only sees allocations made after it starts, and slows allocation down, so it is off
+unless SAFETY_TRACEMALLOC is set (to the number of frames to keep) or started with >memory start
+"""
+import re
+import tracemalloc
+
+from collections import Counter
+from os import environ, path, sep, sysconf
+from resource import RUSAGE_SELF, getrusage
+from sysconfig import get_paths
+from typing import Callable, Dict, List, Optional, Tuple
+
+__all__ = ["MemoryTracker", "cache_sizes", "register_cache", "rss_bytes", "tracker"]
+
+caches: Dict[str, Callable[[], int]] = {}
+
+def register_cache(name: str, size: Callable[[], int]):
+  """
+  Registers a function returning the number of entries in a cache.
+  Registering a name again replaces it (for example when a cog is reloaded)
+  """
+  caches[name] = size
+
+def cache_sizes() -> Dict[str, Optional[int]]:
+  """
+  Returns the size of every registered cache, or None for caches whose size could not be read
+  """
+  sizes: Dict[str, Optional[int]] = {}
+
+  for [name, size] in sorted(caches.items()):
+    try:
+      sizes[name] = size()
+    except Exception:
+      sizes[name] = None
+
+  return sizes
+
+def rss_bytes() -> int:
+  """
+  The current resident set size, falling back to the peak if /proc is unavailable
+  """
+  try:
+    with open("/proc/self/statm") as statm:
+      return int(statm.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError):
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+# compiled patterns cached by the re module (re.match and friends with a pattern string)
+register_cache("re patterns", lambda: len(re._cache))
+
+package_root = path.dirname(path.dirname(path.abspath(__file__)))
+stdlib_root = get_paths()["stdlib"]
+
+def subsystem(filename: str) -> str:
+  """
+  Attributes a source file to a subsystem: a cog, a bot.util module, a library, or the standard library
+  """
+  if filename.startswith(package_root + sep):
+    relative = path.relpath(filename, package_root)
+    parts = relative[:-len(".py")].split(sep)
+
+    if parts[0] == "cogs" and len(parts) > 1:
+      return f"cog {parts[1]}"
+
+    return "bot." + ".".join(parts)
+
+  parts = filename.split(sep)
+
+  if "site-packages" in parts:
+    library = parts[parts.index("site-packages") + 1]
+    return library.split(".")[0].split("-")[0]
+
+  if filename.startswith(stdlib_root + sep):
+    module = path.relpath(filename, stdlib_root).split(sep)[0]
+    return "stdlib " + module[:-len(".py")] if module.endswith(".py") else "stdlib " + module
+
+  return filename
+
+ignored = [
+  tracemalloc.Filter(False, tracemalloc.__file__),
+  tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+  tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+  tracemalloc.Filter(False, "<unknown>")
+]
+
+class MemoryTracker:
+  """
+  Takes tracemalloc snapshots and reports allocations by subsystem, with the change since the last report
+  """
+  def __init__(self):
+    self.previous: Optional[Dict[str, int]] = None
+
+  @property
+  def tracing(self) -> bool:
+    return tracemalloc.is_tracing()
+
+  def start(self, frames: int = 1):
+    if not self.tracing:
+      tracemalloc.start(frames)
+      self.previous = None
+
+  def stop(self):
+    tracemalloc.stop()
+    self.previous = None
+
+  def by_subsystem(self) -> Dict[str, int]:
+    """
+    Bytes currently allocated, by subsystem
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+    sizes: Counter = Counter()
+
+    for stat in snapshot.statistics("filename"):
+      sizes[subsystem(stat.traceback[0].filename)] += stat.size
+
+    return dict(sizes)
+
+  def diff(self, limit: int = 15) -> List[Tuple[str, int, int]]:
+    """
+    Returns the largest subsystems as (name, bytes, change in bytes since the last call),
+    and makes the current snapshot the new baseline
+    """
+    current = self.by_subsystem()
+    previous = self.previous or {}
+    self.previous = current
+
+    rows = [(name, size, size - previous.get(name, 0)) for [name, size] in current.items()]
+    rows.sort(key=lambda row: row[1], reverse=True)
+
+    return rows[:limit]
+
+  def report(self, limit: int = 15) -> str:
+    """
+    A text report of memory use: RSS, cache sizes and, when tracing, allocations by subsystem
+    """
+    lines = [f"RSS: {rss_bytes() / 2 ** 20:.1f} MiB", "", "Cache entries:"]
+
+    for [name, size] in cache_sizes().items():
+      lines.append(f"  {name:32} {'?' if size is None else size:>10}")
+
+    if self.tracing:
+      first = self.previous is None
+      [traced, peak] = tracemalloc.get_traced_memory()
+
+      lines += ["", f"Traced: {traced / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB)"]
+      lines.append("Allocations by subsystem" + ("" if first else " (change since last report)") + ":")
+
+      for [name, size, change] in self.diff(limit):
+        delta = "" if first else f" {change / 1024:+12.1f} KiB"
+        lines.append(f"  {name:32} {size / 1024:12.1f} KiB{delta}")
+    else:
+      lines += ["", "tracemalloc is off (>memory start, or set SAFETY_TRACEMALLOC)"]
+
+    return "\n".join(lines)
+
+tracker = MemoryTracker()
+
+frames = int(environ.get("SAFETY_TRACEMALLOC", "0"))
+
+if frames:
+  tracker.start(frames)
@@ -0,0 +1,112 @@
+"""
+Remembers the emojis of recent messages whose authors consented, so edits and deletes can correct
+the author's stats without fetching the old message from the API.
+
+Messages are kept in an LRU of at most SAFETY_MESSAGE_EMOJIS entries, each the author, guild and
+emojis (with repeats) of a message. When SAFETY_MESSAGE_EMOJIS_SPILL_HOURS is set, messages evicted
+from memory are written to redis with that TTL and looked up there on a miss; otherwise edits and
+deletes of evicted messages leave the stats as they are
+"""
+from collections import Counter, OrderedDict
+from os import environ
+from sys import intern
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .keys import Id, message_emojis_key
+from .memory import register_cache
+from .redis import redis
+
+__all__ = ["Diff", "MessageEmojis", "MessageEmojiCache", "diff", "message_emojis"]
+
+CACHE_SIZE = int(environ.get("SAFETY_MESSAGE_EMOJIS", "20000"))
+SPILL_SECONDS = int(float(environ.get("SAFETY_MESSAGE_EMOJIS_SPILL_HOURS", "0")) * 3600)
+
+class MessageEmojis(NamedTuple):
+  author: int
+  guild: int
+  emojis: Tuple[str, ...]
+
+class Diff(NamedTuple):
+  added: List[str]
+  removed: List[str]
+
+def diff(old: Iterable[str], new: Iterable[str]) -> Diff:
+  """
+  Returns the emojis (with repeats) an edit added and removed
+  """
+  old_counts = Counter(old)
+  new_counts = Counter(new)
+
+  return Diff(list((new_counts - old_counts).elements()), list((old_counts - new_counts).elements()))
+
+class MessageEmojiCache:
+  """
+  An LRU of the emojis of messages, by message id, spilling evicted messages to redis if enabled
+  """
+  def __init__(self, size: int = CACHE_SIZE, spill_seconds: int = SPILL_SECONDS):
+    self.size = size
+    self.spill_seconds = spill_seconds
+    self.messages: "OrderedDict[int, MessageEmojis]" = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self.messages)
+
+  def remember(self, message_id: int, author_id: Id, guild_id: Id, emojis: List[str]):
+    """
+    Remembers the emojis of a message. The emoji strings are interned, so the many copies
+    of popular emojis share one string
+    """
+    self.messages[message_id] = MessageEmojis(int(author_id), int(guild_id), tuple(intern(emoji) for emoji in emojis))
+    self.messages.move_to_end(message_id)
+
+    if len(self.messages) > self.size:
+      [evicted_id, evicted] = self.messages.popitem(last=False)
+      self.spill(evicted_id, evicted)
+
+  def spill(self, message_id: int, message: MessageEmojis):
+    if self.spill_seconds > 0:
+      value = " ".join((str(message.author),) + message.emojis)
+      redis.set(message_emojis_key(message.guild, message_id), value, ex=self.spill_seconds)
+
+  def forget(self, message_id: int, guild_id: Optional[Id]) -> Optional[MessageEmojis]:
+    """
+    Removes a message, returning its emojis if it was remembered (in memory, or spilled to redis)
+    """
+    return self.forget_many([message_id], guild_id).get(message_id)
+
+  def forget_many(self, message_ids: Iterable[int], guild_id: Optional[Id]) -> Dict[int, MessageEmojis]:
+    """
+    Removes messages of a guild, returning the emojis of those that were remembered.
+    Messages spilled to redis are read and deleted in one round trip
+    """
+    found: Dict[int, MessageEmojis] = {}
+    missing: List[int] = []
+
+    for message_id in message_ids:
+      message = self.messages.pop(message_id, None)
+
+      if message is not None:
+        found[message_id] = message
+      else:
+        missing.append(message_id)
+
+    if missing and self.spill_seconds > 0 and guild_id is not None:
+      keys = [message_emojis_key(guild_id, message_id) for message_id in missing]
+
+      with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+          pipe.get(key)
+
+        pipe.delete(*keys)
+        values = pipe.execute()[:len(keys)]
+
+      for [message_id, value] in zip(missing, values):
+        if value:
+          [author, *emojis] = value.split(" ")
+          found[message_id] = MessageEmojis(int(author), int(guild_id), tuple(emojis))
+
+    return found
+
+message_emojis = MessageEmojiCache()
+
+register_cache("message emojis", lambda: len(message_emojis))
@@ -0,0 +1,64 @@
+"""
+Helpers for sending content that may not fit in a single Discord message
+"""
+from asyncio import Semaphore
+from typing import Iterable, List
+
+__all__ = ["MESSAGE_LIMIT", "chunk_message", "send_chunked"]
+
+MESSAGE_LIMIT = 2000
+
+# bounds how many notification messages are in flight at once, across all senders
+sends = Semaphore(4)
+
+def chunk_message(header: str, parts: Iterable[str], sep: str = " ",
+                  limit: int = MESSAGE_LIMIT) -> List[str]:
+  """
+  Packs a header and a list of parts into as few messages as possible,
+  each no longer than limit. The header is only included in the first message
+
+  Args:
+    header (str): text that starts the first message
+    parts (Iterable[str]): pieces that are joined by sep. A piece is never split
+    sep (str): the separator between pieces
+    limit (int): the maximum length of a message
+
+  Returns (List[str]):
+    a list of messages, in order
+  """
+  chunks: List[str] = []
+  current = header
+  has_parts = False
+
+  for part in parts:
+    part = part[:limit]
+    candidate = current + sep + part if has_parts else current + part
+
+    if len(candidate) > limit:
+      chunks.append(current)
+      current = part
+    else:
+      current = candidate
+
+    has_parts = True
+
+  if current:
+    chunks.append(current)
+
+  return chunks
+
+async def send_chunked(destination, header: str, parts: Iterable[str], sep: str = " "):
+  """
+  Sends a header and a list of parts to a channel or user, splitting it into
+  messages under the Discord limit. Messages are sent in order, and the number of
+  concurrent sends across the bot is bounded
+
+  Args:
+    destination (Messageable): a channel or user
+    header (str): text that starts the first message
+    parts (Iterable[str]): pieces (such as mentions) that are joined by sep
+    sep (str): the separator between pieces
+  """
+  for chunk in chunk_message(header, parts, sep):
+    async with sends:
+      await destination.send(chunk)
@@ -0,0 +1,229 @@
+"""
+Instrumentation: counters, gauges and histograms, exposed in the Prometheus text format.
+
+Setting SAFETY_METRICS_PORT serves them at http://127.0.0.1:<port>/metrics (see serve).
+Metrics are cheap to record whether or not they are served
+"""
+from aiohttp import web
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from asyncio import sleep
+from bisect import bisect_left
+from datetime import datetime
+from functools import wraps
+from os import environ
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+__all__ = [
+  "Counter", "Gauge", "Histogram", "command_errors", "command_seconds", "errors", "event_seconds",
+  "instrument_event", "job_lateness", "jobs", "loop_lag", "record_error", "redis_seconds",
+  "registry", "serve", "sheets_seconds", "watch_loop_lag", "watch_scheduler"
+]
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[str, ...]
+
+def escape(value: str) -> str:
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+  pairs = [f'{name}="{escape(value)}"' for [name, value] in zip(names, values)]
+
+  if extra:
+    pairs.append(extra)
+
+  return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+  """
+  A named metric with optional labels. Subclasses define how a value is recorded and rendered
+  """
+  kind = "untyped"
+
+  def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+    self.name = name
+    self.help = help
+    self.labels = tuple(labels)
+    self.lock = Lock()
+    registry.append(self)
+
+  def render(self) -> List[str]:
+    return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+  kind = "counter"
+
+  def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+    super().__init__(name, help, labels)
+    self.values: Dict[Labels, float] = {}
+
+  def inc(self, *labels: str, amount: float = 1):
+    with self.lock:
+      self.values[labels] = self.values.get(labels, 0) + amount
+
+  def render(self) -> List[str]:
+    lines = super().render()
+
+    for [labels, value] in sorted(self.values.items()):
+      lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+
+    return lines
+
+class Gauge(Counter):
+  kind = "gauge"
+
+  def set(self, *labels: str, value: float):
+    with self.lock:
+      self.values[labels] = value
+
+class Histogram(Metric):
+  kind = "histogram"
+
+  def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+               buckets: Sequence[float] = DEFAULT_BUCKETS):
+    super().__init__(name, help, labels)
+    self.buckets = tuple(buckets)
+    # labels -> (count per bucket, with a final +Inf bucket; sum; count)
+    self.values: Dict[Labels, Tuple[List[int], float, int]] = {}
+
+  def observe(self, *labels: str, value: float):
+    index = bisect_left(self.buckets, value)
+
+    with self.lock:
+      [counts, total, count] = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+      counts[index] += 1
+      self.values[labels] = (counts, total + value, count + 1)
+
+  def time(self, *labels: str):
+    """
+    A context manager recording how long its body takes
+    """
+    return Timer(self, labels)
+
+  def render(self) -> List[str]:
+    lines = super().render()
+
+    for [labels, [counts, total, count]] in sorted(self.values.items()):
+      cumulative = 0
+
+      for [bound, hits] in zip(self.buckets + ("+Inf",), counts):
+        cumulative += hits
+        le = 'le="' + str(bound) + '"'
+        lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+
+      lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+      lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+
+    return lines
+
+class Timer:
+  def __init__(self, histogram: Histogram, labels: Labels):
+    self.histogram = histogram
+    self.labels = labels
+
+  def __enter__(self):
+    self.start = perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.histogram.observe(*self.labels, value=perf_counter() - self.start)
+
+registry: List[Metric] = []
+
+command_seconds = Histogram("safety_command_seconds", "Time to run a command", ["command"])
+command_errors = Counter("safety_command_errors_total", "Commands that raised an error", ["command"])
+event_seconds = Histogram("safety_event_seconds", "Time to handle a gateway event", ["event"])
+redis_seconds = Histogram("safety_redis_seconds", "Time per redis command (or pipeline)", ["command"])
+sheets_seconds = Histogram("safety_sheets_seconds", "Time per Google Sheets request, including retries", ["outcome"])
+errors = Counter("safety_errors_total", "Errors in background tasks and jobs", ["source"])
+loop_lag = Histogram("safety_event_loop_lag_seconds", "How late the event loop runs a scheduled callback")
+job_lateness = Histogram("safety_job_lateness_seconds", "How late scheduled jobs start")
+jobs = Counter("safety_jobs_total", "Scheduled jobs by outcome", ["outcome"])
+
+def render() -> str:
+  lines: List[str] = []
+
+  for metric in registry:
+    lines.extend(metric.render())
+
+  return "\n".join(lines) + "\n"
+
+def record_error(source: str, error: Exception):
+  """
+  Reports an error from a background task: prints it and counts it under source
+  """
+  print(error)
+  errors.inc(source)
+
+def instrument_event(handler: Callable) -> Callable:
+  """
+  Wraps a gateway event handler (such as on_message) to record its latency.
+  The wrapper keeps the handler's name, so it can be registered with bot.event
+  """
+  @wraps(handler)
+  async def wrapper(*args, **kwargs):
+    with event_seconds.time(handler.__name__):
+      try:
+        return await handler(*args, **kwargs)
+      except Exception:
+        errors.inc(handler.__name__)
+        raise
+
+  return wrapper
+
+async def watch_loop_lag(interval: float = 1):
+  """
+  Measures event loop lag forever: how much later than asked a sleep returns
+  """
+  while True:
+    start = perf_counter()
+    await sleep(interval)
+    loop_lag.observe(value=max(0.0, perf_counter() - start - interval))
+
+def watch_scheduler(scheduler):
+  """
+  Records job lateness and outcomes from an APScheduler scheduler
+  """
+  outcomes = {
+    EVENT_JOB_EXECUTED: "executed",
+    EVENT_JOB_ERROR: "error",
+    EVENT_JOB_MISSED: "missed"
+  }
+
+  def listener(event):
+    if event.code == EVENT_JOB_SUBMITTED:
+      for run_time in event.scheduled_run_times:
+        job_lateness.observe(value=max(0.0, (datetime.now(run_time.tzinfo) - run_time).total_seconds()))
+    else:
+      jobs.inc(outcomes[event.code])
+
+  scheduler.add_listener(listener, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+async def serve(port: Optional[int] = None, host: str = "127.0.0.1") -> Optional[web.AppRunner]:
+  """
+  Serves the metrics in the Prometheus text format at /metrics.
+  Does nothing unless a port is given or SAFETY_METRICS_PORT is set
+
+  Returns (Optional[web.AppRunner]):
+    the running server, to clean up on shutdown
+  """
+  port = port or int(environ.get("SAFETY_METRICS_PORT", "0"))
+
+  if not port:
+    return None
+
+  async def metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={
+      "Content-Type": "text/plain; version=0.0.4; charset=utf-8"
+    })
+
+  app = web.Application()
+  app.router.add_get("/metrics", metrics)
+
+  runner = web.AppRunner(app)
+  await runner.setup()
+  await web.TCPSite(runner, host, port).start()
+
+  return runner
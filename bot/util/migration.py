@@ -0,0 +1,201 @@
+"""
+Moves keys from the flat names used before keys were hash-tagged (user:guild, guild:categories, ...)
+to the names in bot.util.keys, optionally from a standalone redis into a Redis Cluster.
+
+Keys are copied with DUMP/RESTORE, keeping their TTL, so the source and the target (the redis the
+bot is configured for, see bot.util.redis) can be different servers. Running it again is safe.
+Stats hashes that still count emojis by name are then rewritten to count interned emoji ids
+(see bot.util.emojis), and every user's index of the guilds they have stats in is rebuilt.
+Stop the bot while migrating
+
+python -m bot.util.migration --dry-run                    (list what would move)
+python -m bot.util.migration                              (copy, keeping the old keys)
+python -m bot.util.migration --delete                     (move)
+python -m bot.util.migration --source old-host:6379       (copy from another server)
+"""
+from argparse import ArgumentParser
+from itertools import islice
+from re import compile
+from redis import Redis
+from typing import Callable, Dict, List, Match, Optional, Pattern, Tuple
+
+from .emojis import interner
+from .keys import birthdays_key, categories_key, guild_of, role_job_key, role_pending_key, series_key, signups_key, stats_key, \
+user_guilds_key
+from .redis import HOST, PORT, connect, redis
+from .scheduler import JOBS_KEY, RUN_TIMES_KEY
+
+__all__ = ["index_user_guilds", "intern_stats", "migrate", "new_name", "plan"]
+
+# ids of events, series and bulk role jobs (uuid4().hex)
+ID = r"[0-9a-f]{32}"
+
+# old name -> new name, given the series of each recurring event occurrence
+rules: List[Tuple[Pattern, Callable[[Match, Dict[str, str]], str]]] = [
+  (compile(r"^(\d+):(\d+)$"), lambda match, series_of: stats_key(match[1], match[2])),
+  (compile(r"^(\d+):categories$"), lambda match, series_of: categories_key(match[1])),
+  (compile(r"^(\d+):birthdays$"), lambda match, series_of: birthdays_key(match[1])),
+  (compile(rf"^({ID}):series$"), lambda match, series_of: series_key(match[1])),
+  (compile(rf"^({ID}):signups$"), lambda match, series_of: signups_key(match[1], series_of.get(match[1], ""))),
+  (compile(rf"^({ID}):role_job$"), lambda match, series_of: role_job_key(match[1])),
+  (compile(rf"^({ID}):pending$"), lambda match, series_of: role_pending_key(match[1])),
+  (compile(r"^apscheduler\.jobs$"), lambda match, series_of: JOBS_KEY),
+  (compile(r"^apscheduler\.run_times$"), lambda match, series_of: RUN_TIMES_KEY)
+]
+
+def new_name(key: str, series_of: Dict[str, str]) -> Optional[str]:
+  """
+  Returns the tagged name of a key with an old name, or None for keys that keep their name
+  """
+  for [pattern, rename] in rules:
+    match = pattern.match(key)
+
+    if match:
+      return rename(match, series_of)
+
+  return None
+
+def plan(source: Redis) -> List[Tuple[str, str]]:
+  """
+  Lists the (old name, new name) of every key in source that needs to move
+  """
+  keys = [key.decode() for key in source.scan_iter(count=1000)]
+  series_of: Dict[str, str] = {}
+
+  # an occurrence's signups move next to its series, which names the occurrence it is waiting for
+  for key in keys:
+    if key.endswith(":series"):
+      occurrence = source.hget(key, "next")
+
+      if occurrence:
+        series_of[occurrence.decode()] = key[:-len(":series")]
+
+  moves = []
+
+  for key in keys:
+    name = new_name(key, series_of)
+
+    if name is not None:
+      moves.append((key, name))
+
+  return moves
+
+def migrate(source: Redis, target: Redis, delete: bool = False, dry_run: bool = False) -> int:
+  """
+  Copies (or with delete, moves) every key with an old name in source to its new name in target
+
+  Returns (int):
+    the number of keys moved
+  """
+  moved = 0
+
+  for [old, new] in plan(source):
+    if dry_run:
+      print(f"{old} -> {new}")
+      moved += 1
+      continue
+
+    data = source.dump(old)
+
+    if data is None:
+      # expired or deleted since the scan
+      continue
+
+    ttl = source.pttl(old)
+    target.restore(new, max(ttl, 0), data, replace=True)
+
+    if delete:
+      source.delete(old)
+
+    moved += 1
+
+  return moved
+
+def intern_stats(dry_run: bool = False) -> int:
+  """
+  Rewrites the stats hashes in the configured redis that name emojis, so they count interned ids.
+  Hashes already using ids are left alone
+
+  Returns (int):
+    the number of hashes rewritten
+  """
+  rewritten = 0
+
+  for key in redis.scan_iter(match=stats_key("*", "*"), count=1000):
+    named = { field: int(count) for [field, count] in redis.hgetall(key).items()
+              if field != "consent" and not field.isdigit() }
+
+    if not named:
+      continue
+
+    rewritten += 1
+
+    if dry_run:
+      continue
+
+    emojis = list(named)
+    ids = interner.intern(guild_of(key), emojis)
+
+    with redis.pipeline() as pipe:
+      pipe.hdel(key, *emojis)
+
+      for [id, emoji] in zip(ids, emojis):
+        pipe.hincrby(key, id, named[emoji])
+
+      pipe.execute()
+
+  return rewritten
+
+def index_user_guilds(dry_run: bool = False) -> int:
+  """
+  Adds the guild of every stats hash in the configured redis to its user's index of guilds
+  (see user_guilds_key)
+
+  Returns (int):
+    the number of stats hashes indexed
+  """
+  indexed = 0
+  keys = redis.scan_iter(match=stats_key("*", "*"), count=1000)
+
+  while True:
+    batch = list(islice(keys, 1000))
+
+    if not batch:
+      break
+
+    indexed += len(batch)
+
+    if dry_run:
+      continue
+
+    with redis.pipeline(transaction=False) as pipe:
+      for key in batch:
+        pipe.sadd(user_guilds_key(key.rpartition(":")[2]), guild_of(key))
+
+      pipe.execute()
+
+  return indexed
+
+def main():
+  parser = ArgumentParser(description="Moves redis keys to their hash-tagged names")
+  parser.add_argument("--source", default=f"{HOST}:{PORT}", help="host:port of the redis to move keys from")
+  parser.add_argument("--delete", action="store_true", help="delete each old key once it is copied")
+  parser.add_argument("--dry-run", action="store_true", help="only list the keys that would move")
+  args = parser.parse_args()
+
+  [host, _, port] = args.source.rpartition(":")
+  source = Redis(host=host or "localhost", port=int(port))
+  moved = migrate(source, connect(decode_responses=False), args.delete, args.dry_run)
+
+  print(f"{'Would move' if args.dry_run else 'Moved'} {moved} keys")
+
+  interned = intern_stats(args.dry_run)
+
+  print(f"{'Would intern' if args.dry_run else 'Interned'} emojis in {interned} stats hashes")
+
+  indexed = index_user_guilds(args.dry_run)
+
+  print(f"{'Would index' if args.dry_run else 'Indexed'} the guilds of {indexed} stats hashes")
+
+if __name__ == "__main__":
+  main()
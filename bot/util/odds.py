@@ -0,0 +1,206 @@
+"""
+Exact probability distributions of dice rolls.
+
+A distribution is a list of outcome counts: counts[i] is the number of ways (out of size ** count)
+to roll offset + i. Plain sums are powers of the polynomial x + x^2 + ... + x^size, multiplied by
+packing coefficients into big integers (Kronecker substitution) so that CPython's big integer
+multiplication does the convolution. Dropping the lowest/highest dice is a dynamic program over
+faces: each face takes some of the remaining dice, and only the dice that land in the kept
+positions of the sorted roll add to the sum. Partial results are memoized
+"""
+from fractions import Fraction
+from functools import lru_cache
+from math import sqrt
+from typing import List, NamedTuple, Sequence, Tuple
+
+from .dice import DiceSpec
+from .memory import register_cache
+
+__all__ = ["Distribution", "distribution", "feasible"]
+
+# rough cost limits that keep a single distribution around a second of CPU:
+# the size in bits of the packed polynomial for plain sums,
+# and count^4 * size^2 * log2(size) for the drop dynamic program
+MAX_SUM_BITS = 6 * 10 ** 6
+MAX_DROP_WORK = 6 * 10 ** 10
+
+def byte_width(bound: int) -> int:
+  """
+  The number of bytes needed to hold any integer in [0, bound]
+  """
+  return max(1, (bound.bit_length() + 7) // 8)
+
+def pack(coefficients: Sequence[int], width: int) -> int:
+  return int.from_bytes(b"".join(c.to_bytes(width, "little") for c in coefficients), "little")
+
+def unpack(value: int, width: int, length: int) -> List[int]:
+  data = value.to_bytes(width * length, "little")
+  return [int.from_bytes(data[i:i + width], "little") for i in range(0, len(data), width)]
+
+def multiply(a: Sequence[int], b: Sequence[int]) -> List[int]:
+  """
+  Multiplies two polynomials given by their coefficients, lowest power first
+  """
+  width = byte_width(max(a) * max(b) * min(len(a), len(b)))
+  return unpack(pack(a, width) * pack(b, width), width, len(a) + len(b) - 1)
+
+@lru_cache(maxsize=128)
+def sum_counts(count: int, size: int) -> Tuple[int, ...]:
+  """
+  Outcome counts of the sum of count dice with size faces, for sums count to count * size
+  """
+  if count == 1:
+    return (1,) * size
+
+  half = sum_counts(count // 2, size)
+  result = multiply(half, half)
+
+  if count % 2 == 1:
+    result = multiply(result, sum_counts(1, size))
+
+  return tuple(result)
+
+@lru_cache(maxsize=128)
+def binomials(n: int) -> Tuple[int, ...]:
+  """
+  The row C(n, 0) ... C(n, n) of Pascal's triangle
+  """
+  row = [1]
+
+  for k in range(n):
+    row.append(row[-1] * (n - k) // (k + 1))
+
+  return tuple(row)
+
+@lru_cache(maxsize=128)
+def drop_counts(count: int, size: int, low: int, high: int) -> Tuple[int, Tuple[int, ...]]:
+  """
+  Outcome counts of the sum of count dice with size faces, after dropping the low lowest
+  and high highest dice
+
+  Returns (Tuple[int, Tuple[int, ...]]):
+    the smallest possible sum, and the counts from that sum up
+  """
+  keep = count - low - high
+  width = byte_width(size ** count)
+  bits = width * 8
+
+  # states[i]: packed polynomial in the kept sum, over ways to place i dice on the faces seen so far
+  states = [0] * (count + 1)
+  states[0] = 1
+
+  for face in range(1, size + 1):
+    updated = [0] * (count + 1)
+
+    for [placed, polynomial] in enumerate(states):
+      if not polynomial:
+        continue
+
+      remaining = count - placed
+      ways = binomials(remaining)
+      # the last face takes every remaining die
+      first = remaining if face == size else 0
+
+      for dice in range(first, remaining + 1):
+        # the dice on this face occupy sorted positions [placed, placed + dice)
+        kept = max(0, min(placed + dice, low + keep) - max(placed, low))
+        updated[placed + dice] += (ways[dice] * polynomial) << (face * kept * bits)
+
+    states = updated
+
+  counts = unpack(states[count], width, keep * size + 1)[keep:]
+
+  while counts and counts[-1] == 0:
+    counts.pop()
+
+  return (keep, tuple(counts))
+
+class Distribution(NamedTuple):
+  # the smallest possible result
+  offset: int
+  # counts[i] is the number of ways to roll offset + i
+  counts: Tuple[int, ...]
+  # the number of equally likely outcomes
+  total: int
+
+  @property
+  def minimum(self) -> int:
+    return self.offset
+
+  @property
+  def maximum(self) -> int:
+    return self.offset + len(self.counts) - 1
+
+  def mean(self) -> Fraction:
+    return Fraction(sum(i * c for [i, c] in enumerate(self.counts)), self.total) + self.offset
+
+  def stdev(self) -> float:
+    mean = self.mean() - self.offset
+    variance = Fraction(sum(i * i * c for [i, c] in enumerate(self.counts)), self.total) - mean * mean
+    return sqrt(variance)
+
+  def percentile(self, fraction: float) -> int:
+    """
+    The smallest result r such that P(roll <= r) >= fraction
+    """
+    needed = Fraction(fraction) * self.total
+    seen = 0
+
+    for [i, count] in enumerate(self.counts):
+      seen += count
+
+      if seen >= needed:
+        return self.offset + i
+
+    return self.maximum
+
+  def at_least(self, target: int) -> Fraction:
+    """
+    The probability of rolling target or more
+    """
+    start = max(0, target - self.offset)
+    return Fraction(sum(self.counts[start:]), self.total)
+
+def feasible(spec: DiceSpec) -> bool:
+  """
+  Whether the exact distribution of a roll can be computed in reasonable time
+  """
+  bits = spec.size.bit_length()
+
+  if spec.size == 1:
+    return True
+
+  if spec.low or spec.high:
+    return spec.count ** 4 * spec.size ** 2 * bits <= MAX_DROP_WORK
+
+  return spec.count ** 2 * spec.size * bits <= MAX_SUM_BITS
+
+def distribution(spec: DiceSpec) -> Distribution:
+  """
+  Computes the exact distribution of a roll
+
+  Args:
+    spec (DiceSpec): the roll
+
+  Returns (Distribution):
+    the distribution of the roll's total, including its addition
+
+  Raises:
+    ValueError: if the roll is too large to compute exactly
+  """
+  if not feasible(spec):
+    raise ValueError(f"{spec.describe()} has too many outcomes to compute exactly")
+
+  total = spec.size ** spec.count
+
+  if spec.size == 1:
+    [offset, counts] = (spec.count - spec.low - spec.high, (1,))
+  elif spec.low or spec.high:
+    [offset, counts] = drop_counts(spec.count, spec.size, spec.low, spec.high)
+  else:
+    [offset, counts] = (spec.count, sum_counts(spec.count, spec.size))
+
+  return Distribution(offset + spec.addition, counts, total)
+
+register_cache("odds sums", lambda: sum_counts.cache_info().currsize)
+register_cache("odds drops", lambda: drop_counts.cache_info().currsize)
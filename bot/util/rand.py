@@ -0,0 +1,126 @@
+"""
+A shared source of randomness. SystemRandom makes one os.urandom call per draw; BufferedRandom
+reads entropy in large blocks and hands out slices of it, and draws many unbiased integers at once.
+Seeding it switches to a deterministic generator, for tests and benchmarks
+"""
+from os import environ, register_at_fork, urandom
+from random import Random
+from threading import local
+from typing import List, Optional
+
+__all__ = ["BufferedRandom", "rand"]
+
+BLOCK_SIZE = 1 << 16
+
+word_formats = [(1, "B"), (2, "H"), (4, "I"), (8, "Q")]
+
+class BufferedRandom(Random):
+  """
+  A Random whose bits come from a buffer of entropy. By default the buffer is filled from
+  os.urandom; once seeded, it is filled from a Mersenne Twister with that seed instead.
+  Safe to share between threads: every thread has its own buffer, so no lock is needed
+  """
+  def __init__(self, seed: Optional[int] = None, block_size: int = BLOCK_SIZE):
+    self.block_size = block_size
+    self.generator: Optional[Random] = None
+    self.buffers = local()
+    super().__init__(seed)
+
+  def seed(self, a=None, version=2):
+    """
+    With a seed, draws become deterministic (within one thread). Without one,
+    they come from the system's entropy
+    """
+    self.generator = None if a is None else Random(a)
+    self.reset()
+
+  def fill(self, size: int) -> bytes:
+    if self.generator is None:
+      return urandom(size)
+
+    return self.generator.getrandbits(size * 8).to_bytes(size, "little")
+
+  def randbytes(self, size: int) -> bytes:
+    """
+    Returns size random bytes, from the buffer when possible
+    """
+    if size > self.block_size:
+      return self.fill(size)
+
+    buffers = self.buffers
+    start = getattr(buffers, "position", self.block_size)
+
+    if start + size > self.block_size:
+      buffers.buffer = self.fill(self.block_size)
+      start = 0
+
+    buffers.position = start + size
+
+    return buffers.buffer[start:start + size]
+
+  def reset(self):
+    """
+    Discards buffered entropy, so that a forked process does not reuse its parent's bytes
+    """
+    self.buffers = local()
+
+  def getrandbits(self, k: int) -> int:
+    if k <= 0:
+      return 0
+
+    size = (k + 7) // 8
+    return int.from_bytes(self.randbytes(size), "little") >> (size * 8 - k)
+
+  def random(self) -> float:
+    return (int.from_bytes(self.randbytes(7), "little") >> 3) * 2 ** -53
+
+  def randints(self, low: int, high: int, count: int) -> List[int]:
+    """
+    Draws count uniform integers in [low, high]. Each value is read from the buffer as a 1, 2,
+    4 or 8 byte word, and words that would bias the result are rejected
+
+    Args:
+      low (int): the smallest value
+      high (int): the largest value
+      count (int): how many values to draw
+
+    Returns (List[int]):
+      the values
+    """
+    size = high - low + 1
+
+    if size == 1:
+      return [low] * count
+
+    for [width, format] in word_formats:
+      span = 1 << (8 * width)
+
+      if size <= span:
+        break
+    else:
+      return [self.randint(low, high) for _ in range(count)]
+
+    limit = span - span % size
+    values: List[int] = []
+
+    while len(values) < count:
+      # ask for a little extra so one block is usually enough
+      needed = count - len(values)
+      words = min(needed + needed * (span - limit) // limit + 8, self.block_size // width)
+      block = memoryview(self.randbytes(words * width)).cast(format)
+      values.extend(word % size + low for word in block if word < limit)
+
+    del values[count:]
+    return values
+
+  def getstate(self):
+    raise NotImplementedError("BufferedRandom has no state to save")
+
+  def setstate(self, state):
+    raise NotImplementedError("BufferedRandom has no state to restore")
+
+seed = environ.get("SAFETY_RANDOM_SEED")
+
+rand = BufferedRandom(int(seed) if seed else None)
+
+register_at_fork(after_in_child=rand.reset)
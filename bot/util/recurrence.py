@@ -0,0 +1,121 @@
+"""
+Recurrence rules for repeating events.
+A rule is stored as a single string and only expanded one occurrence at a time
+"""
+from croniter import croniter
+from datetime import date, datetime, timedelta
+from re import compile, IGNORECASE
+from typing import Iterable, Optional
+
+__all__ = ["Recurrence"]
+
+interval_rules = {
+  "daily": timedelta(days=1),
+  "weekly": timedelta(weeks=1),
+  "biweekly": timedelta(weeks=2)
+}
+
+every_pattern = compile(r'every (?P<count>\d+) (?P<unit>day|week)s?$', IGNORECASE)
+
+# never look further than this many occurrences ahead when skipping dates
+MAX_LOOKAHEAD = 1000
+
+class Recurrence:
+  """
+  A rule describing when a repeating event happens.
+
+  Supported rules:
+  - daily, weekly, biweekly
+  - every N days, every N weeks
+  - cron <minute> <hour> <day of month> <month> <day of week> (e.g. "cron 0 19 * * fri")
+
+  Occurrences are computed in the time zone of the start date, so an event at 19:00
+  stays at 19:00 across daylight savings changes
+  """
+  def __init__(self, rule: str, start: datetime, until: Optional[date] = None,
+               skips: Iterable[date] = ()):
+    """
+    Args:
+      rule (str): the recurrence rule (see class docs)
+      start (datetime): the first occurrence (time zone aware)
+      until (Optional[date]): the last date an occurrence may happen on (inclusive)
+      skips (Iterable[date]): dates on which there is no occurrence
+
+    Raises:
+      ValueError: if the rule is not valid
+    """
+    self.rule = rule.strip()
+    self.start = start
+    self.until = until
+    self.skips = set(skips)
+
+    self.interval: Optional[timedelta] = None
+    self.cron: Optional[str] = None
+
+    lowered = self.rule.lower()
+    every = every_pattern.match(self.rule)
+
+    if lowered in interval_rules:
+      self.interval = interval_rules[lowered]
+    elif every:
+      count = int(every.group("count"))
+
+      if count == 0:
+        raise ValueError("An event cannot repeat every 0 days")
+
+      if every.group("unit").lower() == "day":
+        self.interval = timedelta(days=count)
+      else:
+        self.interval = timedelta(weeks=count)
+    elif lowered.startswith("cron "):
+      self.cron = self.rule[5:].strip()
+
+      if not croniter.is_valid(self.cron):
+        raise ValueError(f"{self.cron} is not a valid cron expression")
+    else:
+      raise ValueError(f"{rule} is not a valid rule. Try daily, weekly, every 3 days or cron 0 19 * * fri")
+
+  def _following(self, current: datetime) -> datetime:
+    """
+    Returns the occurrence right after current, ignoring skips and the end date
+    """
+    wall = current.astimezone(self.start.tzinfo).replace(tzinfo=None)
+
+    if self.cron:
+      wall = croniter(self.cron, wall).get_next(datetime)
+    else:
+      wall = wall + self.interval
+
+    return wall.replace(tzinfo=self.start.tzinfo)
+
+  def next_after(self, after: datetime) -> Optional[datetime]:
+    """
+    Returns the first occurrence strictly after a time
+
+    Args:
+      after (datetime): a time zone aware datetime
+
+    Returns (Optional[datetime]):
+      the next occurrence, or None if the rule has ended
+    """
+    if self.cron is None and after < self.start:
+      current = self.start
+    elif self.cron is None:
+      # jump straight to the last occurrence before "after" instead of stepping
+      wall_start = self.start.replace(tzinfo=None)
+      wall_after = after.astimezone(self.start.tzinfo).replace(tzinfo=None)
+      steps = (wall_after - wall_start) // self.interval
+      current = self._following((wall_start + steps * self.interval).replace(tzinfo=self.start.tzinfo))
+    else:
+      current = self._following(max(after, self.start - timedelta(minutes=1)))
+
+    for _ in range(MAX_LOOKAHEAD):
+      if self.until and current.date() > self.until:
+        return None
+
+      if current > after and current.date() not in self.skips:
+        return current
+
+      current = self._following(current)
+
+    return None
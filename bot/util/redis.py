@@ -1,5 +1,169 @@
+"""
+The shared redis client. By default it talks to a single redis at SAFETY_REDIS_HOST:SAFETY_REDIS_PORT
+(localhost:6379). Setting SAFETY_REDIS_CLUSTER to a comma-separated list of host:port startup nodes
+talks to a Redis Cluster instead.
+
+In a cluster, pipelines are split by node and are not transactions. Commands that use several keys
+must use keys that share a hash tag (see bot.util.keys)
+"""
+from os import environ
 from redis import Redis
+from redis.client import Pipeline, list_or_args
+from rediscluster import RedisCluster
+from rediscluster.pipeline import ClusterPipeline
+from typing import Dict, Iterable, List, NamedTuple, Union
+
+from .lazy import Lazy
+from .metrics import redis_seconds
+
+__all__ = ["InstrumentedRedis", "InstrumentedRedisCluster", "KeyMemory", "binary", "connect", "measure_keys", "redis"]
+
+HOST = environ.get("SAFETY_REDIS_HOST", "localhost")
+PORT = int(environ.get("SAFETY_REDIS_PORT", "6379"))
+CLUSTER_NODES = environ.get("SAFETY_REDIS_CLUSTER", "")
+# keys measured per pipeline by measure_keys
+MEMORY_BATCH = 500
+
+class InstrumentedPipeline(Pipeline):
+  def execute(self, raise_on_error=True):
+    with redis_seconds.time("pipeline"):
+      return super().execute(raise_on_error)
+
+class InstrumentedRedis(Redis):
+  """
+  A Redis client that records the latency of every command
+  """
+  def execute_command(self, *args, **options):
+    with redis_seconds.time(str(args[0]).lower()):
+      return super().execute_command(*args, **options)
+
+  def pipeline(self, transaction=True, shard_hint=None):
+    return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+class SameSlotCommands:
+  """
+  Sends multi-key commands to the cluster as a single command when all their keys share a slot.
+  rediscluster otherwise runs them key by key (or refuses them in pipelines), which takes more
+  round trips and is not atomic
+  """
+  def same_slot(self, keys: Iterable[str]) -> bool:
+    return len({ self.connection_pool.nodes.keyslot(key) for key in keys }) == 1
+
+  def delete(self, *names):
+    if len(names) > 1 and self.same_slot(names):
+      return self.execute_command("DEL", *names)
+
+    return super().delete(*names)
+
+  def sunion(self, keys, *args):
+    keys = list_or_args(keys, args)
+
+    if self.same_slot(keys):
+      return self.execute_command("SUNION", *keys)
+
+    return super().sunion(keys)
+
+  def sunionstore(self, dest, keys, *args):
+    keys = list_or_args(keys, args)
+
+    if self.same_slot([dest] + keys):
+      return self.execute_command("SUNIONSTORE", dest, *keys)
+
+    return super().sunionstore(dest, keys)
+
+class InstrumentedClusterPipeline(SameSlotCommands, ClusterPipeline):
+  def execute(self, raise_on_error=True):
+    with redis_seconds.time("pipeline"):
+      return super().execute(raise_on_error)
+
+  def multi(self):
+    """
+    Accepted so code written for single-node pipelines runs unchanged. Commands are still
+    buffered and sent in order, but a cluster pipeline is not a transaction
+    """
+
+class InstrumentedRedisCluster(SameSlotCommands, RedisCluster):
+  """
+  A Redis Cluster client that records the latency of every command
+  """
+  def execute_command(self, *args, **kwargs):
+    with redis_seconds.time(str(args[0]).lower()):
+      return super().execute_command(*args, **kwargs)
+
+  def pipeline(self, transaction=None, shard_hint=None, read_from_replicas=False):
+    """
+    Returns a pipeline that sends each node its commands in one round trip.
+    transaction is accepted so callers work with either client, but a cluster pipeline is never a transaction
+    """
+    return InstrumentedClusterPipeline(
+      connection_pool=self.connection_pool,
+      startup_nodes=self.connection_pool.nodes.startup_nodes,
+      result_callbacks=self.result_callbacks,
+      response_callbacks=self.response_callbacks,
+      cluster_down_retry_attempts=self.cluster_down_retry_attempts,
+      read_from_replicas=read_from_replicas
+    )
+
+def startup_nodes(nodes: str) -> List[Dict[str, str]]:
+  """
+  Parses a comma-separated list of host:port
+  """
+  parsed = []
+
+  for node in nodes.split(","):
+    [host, _, port] = node.strip().rpartition(":")
+    parsed.append({ "host": host or "localhost", "port": port })
+
+  return parsed
+
+def connect(decode_responses: bool = True) -> Union[InstrumentedRedis, InstrumentedRedisCluster]:
+  """
+  Creates a client for the configured redis: the cluster in SAFETY_REDIS_CLUSTER if set, otherwise a single node
+
+  Args:
+    decode_responses (bool): whether replies are decoded to str (binary replies such as DUMP need False)
+  """
+  if CLUSTER_NODES:
+    return InstrumentedRedisCluster(startup_nodes=startup_nodes(CLUSTER_NODES), decode_responses=decode_responses)
+
+  return InstrumentedRedis(host=HOST, port=PORT, decode_responses=decode_responses)
+
+redis = Lazy(connect)
+# for replies that are bytes: DUMP payloads, and the scheduler's pickled jobs
+binary = Lazy(lambda: connect(decode_responses=False))
+
+class KeyMemory(NamedTuple):
+  key: str
+  bytes: int
+  # the key's redis encoding: for hashes, listpack/ziplist are compact and hashtable is not
+  encoding: str
+
+def measure_keys(keys: List[str]) -> List[KeyMemory]:
+  """
+  Measures the memory (MEMORY USAGE) and encoding of keys, pipelined in batches
+
+  Args:
+    keys (List[str]): the keys to measure
+
+  Returns:
+    the memory of each key that still exists
+  """
+  measured = []
+
+  for start in range(0, len(keys), MEMORY_BATCH):
+    batch = keys[start:start + MEMORY_BATCH]
+
+    with redis.pipeline(transaction=False) as pipe:
+      for key in batch:
+        pipe.memory_usage(key)
+        pipe.execute_command("OBJECT ENCODING", key)
+
+      replies = pipe.execute(raise_on_error=False)
+
+    for [index, key] in enumerate(batch):
+      [size, encoding] = replies[index * 2:index * 2 + 2]
 
-__all__ = ["redis"]
+      if isinstance(size, int):
+        measured.append(KeyMemory(key, size, encoding if isinstance(encoding, str) else "?"))
 
-redis = Redis(host="localhost", port=6379, decode_responses=True)
\ No newline at end of file
+  return measured
@@ -0,0 +1,232 @@
+"""
+Retention of the data of guilds the bot was removed from, and of members who left a guild.
+
+Removals queue a cleanup in a sorted set, scored by when it is due: after a grace period, so a
+member who rejoins (or a guild that adds the bot back) keeps their data. Due cleanups apply the
+configured policy to the keys involved:
+  delete: the keys are deleted
+  archive: the keys are appended (DUMP, base64 in gzip-compressed JSON lines) to a file in
+    SAFETY_RETENTION_ARCHIVE, then deleted. They can be restored with RESTORE
+  keep: nothing is removed
+
+A guild's emoji interning table is never cleaned up, since interned ids are cached by every process
+and must keep naming the same emoji.
+
+SAFETY_RETENTION_MEMBERS and SAFETY_RETENTION_GUILDS set the policy (default archive) for members'
+stats and for everything stored for a guild. SAFETY_RETENTION_GRACE_HOURS sets the grace period
+
+python -m bot.util.retention --restore archive/retention-2020-06-01.jsonl.gz
+"""
+import gzip
+import json
+
+from argparse import ArgumentParser
+from base64 import b64decode, b64encode
+from datetime import date
+from os import environ, makedirs, path
+from re import compile
+from time import time
+from typing import Iterable, List, Optional, Tuple
+
+from .keys import Id, stats_key, tag, user_guilds_key
+from .metrics import Counter
+from .redis import binary, measure_keys, redis
+
+__all__ = [
+  "GUILD_POLICY", "MEMBER_POLICY", "apply_policy", "archive_keys", "cancel_cleanup", "classify",
+  "due_cleanups", "entry_keys", "guild_entry", "member_entry", "queue_cleanups", "queued_cleanups",
+  "reclaimed_bytes", "restore_archive"
+]
+
+POLICIES = ("delete", "archive", "keep")
+
+def policy_setting(name: str) -> str:
+  policy = environ.get(name, "archive")
+
+  if policy not in POLICIES:
+    raise ValueError(f"Unknown retention policy {policy} in {name}. Choose from {', '.join(POLICIES)}")
+
+  return policy
+
+MEMBER_POLICY = policy_setting("SAFETY_RETENTION_MEMBERS")
+GUILD_POLICY = policy_setting("SAFETY_RETENTION_GUILDS")
+GRACE_SECONDS = float(environ.get("SAFETY_RETENTION_GRACE_HOURS", "168")) * 3600
+ARCHIVE_DIR = environ.get("SAFETY_RETENTION_ARCHIVE", "archive")
+
+# cleanups waiting for their grace period: entry (see guild_entry, member_entry) -> due time
+QUEUE_KEY = "{retention}:queue"
+# keys deleted per command
+DELETE_BATCH = 500
+
+# the keys that belong to a guild: its users' stats, categories, birthdays and trending emojis.
+# The emoji interning tables (emoji_ids, emoji_names) are kept: every process caches them and ids
+# must never be reused, so a guild that adds the bot back keeps its ids (see bot.util.emojis)
+guild_key = compile(r"^\{(\d+)\}:(?:stats:(\d+)|categories|birthdays|trending:\d+|trending_top|emoji_users:\d+)$")
+
+reclaimed_bytes = Counter("safety_retention_reclaimed_bytes_total", "Redis memory freed by retention policies", ["policy"])
+removed_keys = Counter("safety_retention_keys_total", "Keys removed by retention policies", ["policy"])
+
+def guild_entry(guild_id: Id) -> str:
+  return f"guild:{guild_id}"
+
+def member_entry(guild_id: Id, user_id: Id) -> str:
+  return f"member:{guild_id}:{user_id}"
+
+def classify(key: str) -> Optional[Tuple[str, Optional[str]]]:
+  """
+  Returns the (guild id, user id) a key belongs to (the user id is None for guild-wide keys),
+  or None for keys that do not belong to a guild
+  """
+  match = guild_key.match(key)
+
+  if match is None:
+    return None
+
+  return (match[1], match[2])
+
+def queue_cleanups(entries: Iterable[str], delay: float = GRACE_SECONDS):
+  """
+  Queues cleanups to run after delay seconds. Queueing an entry again does not postpone it
+  """
+  due = time() + delay
+  mapping = { entry: due for entry in entries }
+
+  if mapping:
+    redis.zadd(QUEUE_KEY, mapping, nx=True)
+
+def cancel_cleanup(entry: str):
+  redis.zrem(QUEUE_KEY, entry)
+
+def due_cleanups(limit: int) -> List[str]:
+  """
+  Returns up to limit queued cleanups whose grace period is over, oldest first
+  """
+  return redis.zrangebyscore(QUEUE_KEY, 0, time(), start=0, num=limit)
+
+def queued_cleanups() -> Tuple[int, Optional[float]]:
+  """
+  Returns the number of queued cleanups, and when the next one is due (None if there are none)
+  """
+  with redis.pipeline(transaction=False) as pipe:
+    pipe.zcard(QUEUE_KEY)
+    pipe.zrange(QUEUE_KEY, 0, 0, withscores=True)
+    [count, first] = pipe.execute()
+
+  return (count, first[0][1] if first else None)
+
+def entry_keys(entry: str) -> Tuple[str, List[str]]:
+  """
+  Returns the policy of a queued cleanup, and the keys it covers
+  """
+  [kind, _, ids] = entry.partition(":")
+
+  if kind == "guild":
+    keys = [key for key in redis.scan_iter(match=f"{tag(ids)}:*", count=1000) if classify(key)]
+    return (GUILD_POLICY, keys)
+
+  [guild_id, _, user_id] = ids.partition(":")
+
+  return (MEMBER_POLICY, [stats_key(user_id, guild_id)])
+
+def archive_keys(keys: List[str], reason: str) -> List[str]:
+  """
+  Appends keys to today's archive file
+
+  Args:
+    keys (List[str]): the keys to archive
+    reason (str): why they are archived (the queue entry), stored with each key
+
+  Returns:
+    the keys that were archived (keys that no longer exist are skipped)
+  """
+  with binary.pipeline(transaction=False) as pipe:
+    for key in keys:
+      pipe.dump(key)
+      pipe.pttl(key)
+
+    replies = pipe.execute()
+
+  makedirs(ARCHIVE_DIR, exist_ok=True)
+  archived = []
+
+  # appending to a gzip file adds a member to the stream, which gzip readers read through
+  with gzip.open(path.join(ARCHIVE_DIR, f"retention-{date.today().isoformat()}.jsonl.gz"), "at") as file:
+    for [index, key] in enumerate(keys):
+      [data, ttl] = replies[index * 2:index * 2 + 2]
+
+      if data is None:
+        continue
+
+      record = { "key": key, "reason": reason, "ttl": max(ttl, 0), "dump": b64encode(data).decode(), "at": time() }
+      file.write(json.dumps(record) + "\n")
+      archived.append(key)
+
+  return archived
+
+def apply_policy(entry: str) -> int:
+  """
+  Runs a queued cleanup and removes it from the queue (blocking, run in an executor)
+
+  Returns:
+    the bytes of redis memory reclaimed
+  """
+  [policy, keys] = entry_keys(entry)
+  reclaimed = 0
+
+  if policy != "keep" and keys:
+    reclaimed = sum(memory.bytes for memory in measure_keys(keys))
+
+    if policy == "archive":
+      keys = archive_keys(keys, entry)
+
+    # a cleanup's keys share the guild's hash tag, so each batch is a single DEL
+    for start in range(0, len(keys), DELETE_BATCH):
+      redis.delete(*keys[start:start + DELETE_BATCH])
+
+    reclaimed_bytes.inc(policy, amount=reclaimed)
+    removed_keys.inc(policy, amount=len(keys))
+
+  cancel_cleanup(entry)
+
+  return reclaimed
+
+def restore_archive(file_name: str, replace: bool = False) -> int:
+  """
+  Restores every key in an archive file
+
+  Args:
+    file_name (str): the archive file
+    replace (bool): whether to overwrite keys that exist again
+
+  Returns:
+    the number of keys restored
+  """
+  restored = 0
+
+  with gzip.open(file_name, "rt") as file:
+    for line in file:
+      record = json.loads(line)
+
+      if not replace and binary.exists(record["key"]):
+        continue
+
+      binary.restore(record["key"], record["ttl"], b64decode(record["dump"]), replace=replace)
+      restored += 1
+      owner = classify(record["key"])
+
+      # restored stats are indexed again, so >stats all and >delete all see them
+      if owner is not None and owner[1] is not None:
+        redis.sadd(user_guilds_key(owner[1]), owner[0])
+
+  return restored
+
+def main():
+  parser = ArgumentParser(description="Restores keys archived by the retention sweeper")
+  parser.add_argument("--restore", required=True, help="the archive file to restore")
+  parser.add_argument("--replace", action="store_true", help="overwrite keys that exist again")
+  args = parser.parse_args()
+
+  print(f"Restored {restore_archive(args.restore, args.replace)} keys")
+
+if __name__ == "__main__":
+  main()
@@ -1,18 +1,37 @@
 """
 Represents our shared scheduler and distributed locks
-The scheduler is backed by redis, meaning that jobs can be restored after a restart
+The scheduler is backed by redis, meaning that jobs can be restored after a restart.
+It is started by the application lifecycle (see bot.lifecycle), not on import
 """
+from apscheduler.jobstores.redis import RedisJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from redlock import RedLockFactory
 
-__all__ = ["redlocks", "scheduler"]
+from .lazy import Lazy
+from .memory import register_cache
+from .redis import binary
 
-scheduler = AsyncIOScheduler()
-scheduler.add_jobstore("redis")
+__all__ = ["SharedRedisJobStore", "redlocks", "scheduler"]
+
+# the job store's keys share a hash tag, so its transactions touch a single cluster slot
+JOBS_KEY = "{apscheduler}.jobs"
+RUN_TIMES_KEY = "{apscheduler}.run_times"
 
-redlocks = RedLockFactory([{
-  "host": "127.0.0.1"
-}])
+class SharedRedisJobStore(RedisJobStore):
+  """
+  A redis job store that uses the bot's shared binary client (a single node or a cluster)
+  instead of opening its own connection to localhost. Jobs are stored pickled, so replies
+  must not be decoded
+  """
+  def __init__(self):
+    super().__init__(jobs_key=JOBS_KEY, run_times_key=RUN_TIMES_KEY)
+    self.redis = binary
+
+scheduler = AsyncIOScheduler()
+scheduler.add_jobstore(SharedRedisJobStore())
 
+register_cache("scheduler jobs", lambda: len(scheduler.get_jobs()))
 
-scheduler.start()
\ No newline at end of file
+# a lock lives on the node that owns its key, which is the single-instance case of the redlock
+# algorithm; lock keys named after data keys land on the same node as the data
+redlocks = Lazy(lambda: RedLockFactory([binary.resolve()]))
@@ -0,0 +1,233 @@
+"""
+A shared gateway for spreadsheet data.
+
+Cogs subscribe to (spreadsheet, range) pairs. Every refresh reads all subscribed ranges of a
+spreadsheet in one batchGet, and only notifies subscribers of ranges whose contents changed.
+The last good data is persisted to redis, so the bot starts warm and keeps working while the
+Sheets API is down.
+
+Setting SAFETY_SHEETS_LOCAL to a directory reads spreadsheets from local files instead:
+<dir>/<spreadsheet id>.json (an object mapping ranges to rows) or <dir>/<spreadsheet id>.csv
+"""
+from csv import reader
+from discord.ext import tasks
+from hashlib import sha1
+from json import dumps, load, loads
+from os import environ, path
+from re import compile
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .gsheets import batch_get_values
+from .memory import register_cache
+from .metrics import record_error
+from .redis import redis
+
+__all__ = ["LocalSource", "SheetsGateway", "SheetsSource", "Subscription", "gateway"]
+
+Rows = List[List[str]]
+Callback = Callable[[Rows], Awaitable[None]]
+
+SNAPSHOT_KEY = "sheets:snapshot"
+REFRESH_MINUTES = int(environ.get("SAFETY_SHEETS_REFRESH_MINUTES", "30"))
+
+a1_pattern = compile(r'(?:.*!)?(?P<start_col>[A-Z]+)(?P<start_row>\d+)?(?::(?P<end_col>[A-Z]+)(?P<end_row>\d+)?)?$')
+
+def column_index(column: str) -> int:
+  """
+  Converts a column name (A, Z, AA) to a zero-based index
+  """
+  index = 0
+
+  for letter in column:
+    index = index * 26 + ord(letter) - ord("A") + 1
+
+  return index - 1
+
+def slice_range(rows: Rows, range: str) -> Rows:
+  """
+  Selects an A1 range (e.g. A2:J500) from a full sheet, dropping empty trailing cells and rows
+  like the Sheets API does
+  """
+  result = a1_pattern.match(range)
+
+  if result is None:
+    raise ValueError(f"{range} is not a valid A1 range")
+
+  first_row = int(result.group("start_row") or 1) - 1
+  last_row = int(result.group("end_row")) if result.group("end_row") else len(rows)
+  first_col = column_index(result.group("start_col"))
+  last_col = column_index(result.group("end_col") or result.group("start_col")) + 1
+
+  selected = [row[first_col:last_col] for row in rows[first_row:last_row]]
+
+  for row in selected:
+    while row and row[-1] == "":
+      row.pop()
+
+  while selected and not selected[-1]:
+    selected.pop()
+
+  return selected
+
+class SheetsSource:
+  """
+  Reads ranges from the Google Sheets API
+  """
+  async def batch_get(self, doc: str, ranges: List[str]) -> List[Rows]:
+    return await batch_get_values(doc, ranges)
+
+class LocalSource:
+  """
+  Reads ranges from local JSON or CSV files, for offline testing
+  """
+  def __init__(self, directory: str):
+    self.directory = directory
+
+  async def batch_get(self, doc: str, ranges: List[str]) -> List[Rows]:
+    json_file = path.join(self.directory, f"{doc}.json")
+
+    if path.exists(json_file):
+      with open(json_file) as file:
+        data = load(file)
+
+      return [data.get(range, []) for range in ranges]
+
+    with open(path.join(self.directory, f"{doc}.csv"), newline="") as file:
+      rows = list(reader(file))
+
+    return [slice_range(rows, range) for range in ranges]
+
+class Subscription:
+  """
+  A callback for the contents of a range. Returned by SheetsGateway.subscribe
+  """
+  def __init__(self, doc: str, range: str, callback: Callback):
+    self.doc = doc
+    self.range = range
+    self.callback = callback
+
+class SheetsGateway:
+  """
+  Batches, deduplicates and caches spreadsheet reads for every cog
+  """
+  def __init__(self, source):
+    self.source = source
+    self.subscriptions: List[Subscription] = []
+    # (doc, range) -> (hash, rows) of the last good read
+    self.snapshot: Dict[Tuple[str, str], Tuple[str, Rows]] = {}
+    self.loaded = False
+
+  def load_snapshot(self):
+    """
+    Loads the persisted snapshot from redis (once)
+    """
+    if self.loaded:
+      return
+
+    for [field, value] in redis.hgetall(SNAPSHOT_KEY).items():
+      [doc, _, range] = field.partition(" ")
+      entry = loads(value)
+      self.snapshot[(doc, range)] = (entry["hash"], entry["values"])
+
+    self.loaded = True
+
+  def get(self, doc: str, range: str) -> Optional[Rows]:
+    """
+    Returns the last good contents of a range, or None if it was never read
+    """
+    self.load_snapshot()
+    entry = self.snapshot.get((doc, range))
+
+    return entry[1] if entry else None
+
+  async def subscribe(self, doc: str, range: str, callback: Callback) -> Subscription:
+    """
+    Registers a callback for the contents of a range. If a snapshot of the range exists,
+    the callback is called with it immediately. It is then called after every refresh
+    in which the range changed
+
+    Args:
+      doc (str): the spreadsheet id
+      range (str): the range, in A1 notation
+      callback (Callback): a coroutine function taking the rows of the range
+
+    Returns (Subscription):
+      a handle that can be passed to unsubscribe
+    """
+    subscription = Subscription(doc, range, callback)
+    self.subscriptions.append(subscription)
+
+    task = self.poll.get_task()
+
+    if task is None or task.done():
+      self.poll.start()
+
+    rows = self.get(doc, range)
+
+    if rows is not None:
+      await callback(rows)
+
+    return subscription
+
+  def unsubscribe(self, subscription: Subscription):
+    if subscription in self.subscriptions:
+      self.subscriptions.remove(subscription)
+
+  async def refresh(self, doc: Optional[str] = None):
+    """
+    Reads every subscribed range (of one spreadsheet, or all of them) with one request
+    per spreadsheet, and notifies subscribers of ranges that changed.
+    A failing spreadsheet keeps its last good data
+
+    Args:
+      doc (Optional[str]): only refresh this spreadsheet
+    """
+    self.load_snapshot()
+
+    ranges_by_doc: Dict[str, List[str]] = {}
+
+    for subscription in self.subscriptions:
+      if doc is None or subscription.doc == doc:
+        ranges = ranges_by_doc.setdefault(subscription.doc, [])
+
+        if subscription.range not in ranges:
+          ranges.append(subscription.range)
+
+    for [sheet, ranges] in ranges_by_doc.items():
+      try:
+        results = await self.source.batch_get(sheet, ranges)
+      except Exception as e:
+        record_error("sheets_refresh", e)
+        continue
+
+      changed: Dict[str, str] = {}
+
+      for [range, rows] in zip(ranges, results):
+        digest = sha1(dumps(rows).encode()).hexdigest()
+        previous = self.snapshot.get((sheet, range))
+
+        if previous and previous[0] == digest:
+          continue
+
+        self.snapshot[(sheet, range)] = (digest, rows)
+        changed[f"{sheet} {range}"] = dumps({ "hash": digest, "values": rows })
+
+      if changed:
+        redis.hmset(SNAPSHOT_KEY, changed)
+
+      for subscription in list(self.subscriptions):
+        if subscription.doc == sheet and f"{sheet} {subscription.range}" in changed:
+          try:
+            await subscription.callback(self.snapshot[(sheet, subscription.range)][1])
+          except Exception as e:
+            record_error("sheets_subscriber", e)
+
+  @tasks.loop(minutes=REFRESH_MINUTES)
+  async def poll(self):
+    await self.refresh()
+
+local_directory = environ.get("SAFETY_SHEETS_LOCAL")
+
+gateway = SheetsGateway(LocalSource(local_directory) if local_directory else SheetsSource())
+
+register_cache("sheets snapshot ranges", lambda: len(gateway.snapshot))
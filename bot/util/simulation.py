@@ -0,0 +1,155 @@
+"""
+Monte Carlo simulation of dice rolls on a process pool.
+
+Trials are split into chunks, and every chunk runs in a worker process with its own generator,
+seeded from the shared random source, so chunks are independent streams. Each simulation has a
+trial budget, a dice budget (trials times dice per trial) and a time budget; a simulation that
+runs out of time reports the trials it finished. Completed simulations are cached
+"""
+from asyncio import gather, get_event_loop
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, sqrt
+from os import environ
+from time import perf_counter, time
+from typing import Dict, NamedTuple, Tuple
+
+from .dice import BATCH_SIZE, DiceSpec, roll_dice
+from .lazy import Lazy
+from .memory import register_cache
+from .rand import BufferedRandom, rand
+
+__all__ = ["MAX_TRIALS", "Simulation", "simulate"]
+
+MAX_TRIALS = int(environ.get("SAFETY_MAX_TRIALS", 5 * 10 ** 6))
+# the most dice a single simulation may roll, across all trials
+MAX_SIMULATED_DICE = int(environ.get("SAFETY_MAX_SIMULATED_DICE", 10 ** 8))
+SIMULATION_SECONDS = float(environ.get("SAFETY_SIMULATION_SECONDS", 10))
+WORKERS = int(environ.get("SAFETY_SIMULATION_WORKERS", 2))
+CHUNKS_PER_WORKER = 4
+CACHE_SIZE = 64
+
+pool = Lazy(lambda: ProcessPoolExecutor(max_workers=WORKERS))
+cache: "OrderedDict[Tuple[DiceSpec, int], Simulation]" = OrderedDict()
+
+register_cache("simulations", lambda: len(cache))
+
+class Simulation(NamedTuple):
+  spec: DiceSpec
+  # the number of trials asked for, and the number run before the time budget ran out
+  requested: int
+  trials: int
+  # total -> number of trials with that total
+  histogram: Dict[int, int]
+  seconds: float
+
+  def mean(self) -> float:
+    return sum(total * count for [total, count] in self.histogram.items()) / self.trials
+
+  def stdev(self) -> float:
+    mean = self.mean()
+    return sqrt(sum(count * (total - mean) ** 2 for [total, count] in self.histogram.items()) / self.trials)
+
+  def percentile(self, fraction: float) -> int:
+    """
+    The smallest total t such that at least fraction of the trials rolled t or less
+    """
+    needed = fraction * self.trials
+    seen = 0
+
+    for total in sorted(self.histogram):
+      seen += self.histogram[total]
+
+      if seen >= needed:
+        return total
+
+    return max(self.histogram)
+
+  def at_least(self, target: int) -> float:
+    return sum(count for [total, count] in self.histogram.items() if total >= target) / self.trials
+
+def simulate_chunk(spec: DiceSpec, trials: int, seed: int, deadline: float) -> Tuple[int, Dict[int, int]]:
+  """
+  Runs trials of a roll in a worker process, stopping early at deadline (a time.time())
+
+  Returns (Tuple[int, Dict[int, int]]):
+    the number of trials run, and a histogram of their totals
+  """
+  rng = BufferedRandom(seed)
+  histogram: Counter = Counter()
+  done = 0
+  count = spec.count
+  end = count - spec.high
+  per_batch = max(1, BATCH_SIZE // count)
+
+  # every chunk runs at least one batch, so a simulation always has results
+  while done < trials and (done == 0 or time() < deadline):
+    batch = min(per_batch, trials - done)
+
+    if count > BATCH_SIZE:
+      totals = [roll_dice(spec, rng).kept_sum]
+    else:
+      dice = rng.randints(1, spec.size, count * batch)
+
+      if spec.low or spec.high:
+        totals = [sum(sorted(dice[i:i + count])[spec.low:end]) for i in range(0, len(dice), count)]
+      else:
+        totals = [sum(dice[i:i + count]) for i in range(0, len(dice), count)]
+
+    histogram.update(totals)
+    done += batch
+
+  return (done, { total + spec.addition: hits for [total, hits] in histogram.items() })
+
+async def simulate(spec: DiceSpec, trials: int) -> Simulation:
+  """
+  Simulates a roll, splitting the trials across the process pool
+
+  Args:
+    spec (DiceSpec): the roll
+    trials (int): how many times to roll it
+
+  Returns (Simulation):
+    the results (possibly from the cache)
+
+  Raises:
+    ValueError: if the simulation is over the trial or dice budget
+  """
+  if trials < 1 or trials > MAX_TRIALS:
+    raise ValueError(f"You can simulate between 1 and {MAX_TRIALS} trials")
+
+  if trials * spec.count > MAX_SIMULATED_DICE:
+    raise ValueError(f"That would roll {trials * spec.count} dice; the limit is {MAX_SIMULATED_DICE}")
+
+  key = (spec, trials)
+
+  if key in cache:
+    cache.move_to_end(key)
+    return cache[key]
+
+  start = perf_counter()
+  deadline = time() + SIMULATION_SECONDS
+  chunk = ceil(trials / (WORKERS * CHUNKS_PER_WORKER))
+  loop = get_event_loop()
+
+  results = await gather(*[
+    loop.run_in_executor(pool.resolve(), simulate_chunk, spec, min(chunk, trials - offset),
+      rand.getrandbits(64), deadline)
+    for offset in range(0, trials, chunk)
+  ])
+
+  histogram: Counter = Counter()
+
+  for [_, counts] in results:
+    histogram.update(counts)
+
+  done = sum(result[0] for result in results)
+  simulation = Simulation(spec, trials, done, dict(histogram), perf_counter() - start)
+
+  if done == trials:
+    cache[key] = simulation
+
+    if len(cache) > CACHE_SIZE:
+      cache.popitem(last=False)
+
+  return simulation
@@ -0,0 +1,249 @@
+"""
+Parses time expressions used by scheduling commands: absolute dates with a time zone
+("3/27/20 15:39 EDT", "3/27/20 7:00 pm America/Chicago") and relative durations ("1d3h", "in 2h30m").
+
+The documented >schedule formats are handled by a compiled regex. Anything else falls back
+to dateutil's fuzzy parser. Zone lookups and absolute parses are memoized; absolute parses per day,
+since dates missing from the input, and the century of two-digit years, come from today
+"""
+from datetime import date, datetime, time, timedelta, tzinfo
+from dateutil.parser import parse
+from dateutil.tz import gettz, tzoffset, tzstr, tzutc
+from functools import lru_cache
+from re import compile, IGNORECASE, VERBOSE
+from typing import Optional, Union
+
+from .memory import register_cache
+
+__all__ = ["parse_datetime", "parse_duration", "resolve_zone", "zone_abbreviations"]
+
+zone_abbreviations = {
+  "EDT": -14400,
+  "EST": tzstr("EST5EDT"),
+  "CDT": -18000,
+  "CST": tzstr("CST6CDT"),
+  "MDT": -21600,
+  "MST": tzstr("MST7MDT"),
+  "PDT": -25200,
+  "PST": tzstr("PST8PDT"),
+  "AKDT": -28800,
+  "AKST": tzstr("AKST9AKDT")
+}
+
+utc_names = {"UTC", "UCT", "GMT", "Z"}
+
+SECONDS_IN_MINUTE = 60
+SECONDS_IN_HOUR = 60 * SECONDS_IN_MINUTE
+SECONDS_IN_DAY = 24 * SECONDS_IN_HOUR
+
+duration_pattern = compile(r'(?:(?P<days>\d+)d)?(?:(?P<hours>\d+)h)?(?:(?P<minutes>\d+)m)?(?:(?P<seconds>\d+)s)?$')
+relative_pattern = compile(r'in\s+(?P<duration>\S+)$', IGNORECASE)
+
+date_pattern = compile(r"""
+  (?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4}|\d{2})\s+
+  (?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?\s*
+  (?:(?P<meridiem>[ap])\.?m\.?(?![a-z/]))?\s*
+  (?P<zone>[A-Za-z_]+(?:/[A-Za-z_\-]+)*)?
+  (?P<offset>[+-]\d{1,2}(?::?\d{2})?)?$
+""", IGNORECASE | VERBOSE)
+
+@lru_cache(maxsize=256)
+def resolve_zone(name: str) -> Optional[tzinfo]:
+  """
+  Finds a time zone by abbreviation (EDT, PST, UTC) or IANA name (America/New_York).
+  Results are memoized
+
+  Args:
+    name (str): the name of the zone
+
+  Returns (Optional[tzinfo]):
+    the time zone, or None if the name is unknown
+  """
+  upper = name.upper()
+
+  if upper in utc_names:
+    return tzutc()
+
+  if upper in zone_abbreviations:
+    zone: Union[int, tzinfo] = zone_abbreviations[upper]
+    return tzoffset(upper, zone) if isinstance(zone, int) else zone
+
+  if "/" not in name:
+    return None
+
+  return gettz(name)
+
+def tzinfos(name: Optional[str], offset: Optional[int]) -> Optional[tzinfo]:
+  """
+  Time zone lookup for dateutil's parser. dateutil passes no name for numeric offsets
+  ("+04:00") and for inputs without a zone
+  """
+  if name is None:
+    return tzoffset(None, offset) if offset is not None else None
+
+  zone = resolve_zone(name)
+
+  if zone is None and offset is not None:
+    return tzoffset(name, offset)
+
+  return zone
+
+def parse_offset(offset: str) -> int:
+  """
+  Converts an offset such as +4, -04:30 or +0530 into seconds
+  """
+  sign = -1 if offset[0] == "-" else 1
+  digits = offset[1:].replace(":", "")
+
+  if len(digits) <= 2:
+    hours, minutes = int(digits), 0
+  else:
+    hours, minutes = int(digits[:-2]), int(digits[-2:])
+
+  return sign * (hours * SECONDS_IN_HOUR + minutes * SECONDS_IN_MINUTE)
+
+def full_year(year: str, today: Optional[date] = None) -> int:
+  """
+  Expands a two-digit year to the year within 50 years of today (matching dateutil)
+  """
+  value = int(year)
+
+  if len(year) > 2:
+    return value
+
+  this_year = (today or date.today()).year
+  value += this_year // 100 * 100
+
+  if value >= this_year + 50:
+    value -= 100
+  elif value < this_year - 50:
+    value += 100
+
+  return value
+
+def parse_fast(input: str, today: Optional[date] = None) -> Optional[datetime]:
+  """
+  Parses the documented >schedule formats without dateutil, expanding two-digit years around
+  today (defaults to the current date)
+
+  Returns (Optional[datetime]):
+    the parsed time, or None if the input is not in one of the documented formats
+    or uses an unknown zone
+  """
+  result = date_pattern.match(input)
+
+  if result is None:
+    return None
+
+  hour = int(result.group("hour"))
+  meridiem = result.group("meridiem")
+
+  if meridiem:
+    if hour < 1 or hour > 12:
+      return None
+
+    hour = hour % 12 + (12 if meridiem.lower() == "p" else 0)
+
+  zone_name = result.group("zone")
+  offset = result.group("offset")
+  zone: Optional[tzinfo] = None
+
+  if offset and zone_name:
+    # like dateutil, "UTC+4" follows the POSIX TZ convention and means 4 hours *behind* UTC
+    zone = tzoffset(None, -parse_offset(offset))
+  elif offset:
+    zone = tzoffset(None, parse_offset(offset))
+  elif zone_name:
+    zone = resolve_zone(zone_name)
+
+    if zone is None:
+      return None
+
+  try:
+    return datetime(full_year(result.group("year"), today), int(result.group("month")),
+      int(result.group("day")), hour, int(result.group("minute")),
+      int(result.group("second") or 0), tzinfo=zone)
+  except ValueError:
+    return None
+
+def parse_absolute(input: str) -> Optional[datetime]:
+  """
+  Parses an absolute date, trying the fast path before dateutil. Results are memoized for the day
+
+  Returns (Optional[datetime]):
+    the parsed time (naive if no zone was given), or None if it could not be parsed
+  """
+  return parse_absolute_on(input, date.today())
+
+@lru_cache(maxsize=1024)
+def parse_absolute_on(input: str, today: date) -> Optional[datetime]:
+  """
+  Parses an absolute date as of a day: fields missing from the input are taken from it.
+  The day is part of the cache key, so a result never outlives the day it was parsed on
+  """
+  result = parse_fast(input, today)
+
+  if result is not None:
+    return result
+
+  try:
+    return parse(input, default=datetime.combine(today, time()), tzinfos=tzinfos)
+  except (ValueError, OverflowError):
+    return None
+
+@lru_cache(maxsize=1024)
+def parse_duration(input: str) -> int:
+  """
+  Parses a duration in the format XdXhXmXs (each part optional, in that order).
+  A bare number is a number of minutes
+
+  Args:
+    input (str): a duration, such as "10d3h2m30s" or "5"
+
+  Returns (int):
+    the duration in seconds
+
+  Raises:
+    ValueError: if the input is not a valid duration
+  """
+  if input.isdigit():
+    return SECONDS_IN_MINUTE * int(input)
+
+  result = duration_pattern.match(input)
+
+  if result is None or not input:
+    raise ValueError(f"{input} is not a valid time string")
+
+  return int(result.group("days") or 0) * SECONDS_IN_DAY + \
+    int(result.group("hours") or 0) * SECONDS_IN_HOUR + \
+    int(result.group("minutes") or 0) * SECONDS_IN_MINUTE + \
+    int(result.group("seconds") or 0)
+
+def parse_datetime(input: str, now: Optional[datetime] = None) -> Optional[datetime]:
+  """
+  Parses an absolute date ("3/27/20 15:39 EDT") or a relative one ("in 2h30m")
+
+  Args:
+    input (str): the time expression
+    now (Optional[datetime]): the reference for relative times (defaults to the current time)
+
+  Returns (Optional[datetime]):
+    the parsed time, or None if the input could not be parsed.
+    Absolute times without a zone are naive
+  """
+  input = input.strip()
+  relative = relative_pattern.match(input)
+
+  if relative:
+    try:
+      seconds = parse_duration(relative.group("duration"))
+    except ValueError:
+      return None
+
+    return (now or datetime.now(tzutc())) + timedelta(seconds=seconds)
+
+  return parse_absolute(input)
+
+register_cache("timeparse zones", lambda: resolve_zone.cache_info().currsize)
+register_cache("timeparse dates", lambda: parse_absolute_on.cache_info().currsize)
+register_cache("timeparse durations", lambda: parse_duration.cache_info().currsize)
@@ -0,0 +1,182 @@
+"""
+Trending emojis, and how many people use each emoji, per guild, from approximate counters of
+fixed size in redis.
+
+Uses are counted in count-min sketches, one per time bucket of SAFETY_TRENDING_BUCKET_MINUTES:
+DEPTH rows of WIDTH 32 bit counters in a string (BITFIELD), so a bucket takes WIDTH * DEPTH * 4
+bytes however many emojis a guild uses. A sketch only overestimates, by at most about e / WIDTH of
+the uses in the buckets read. The trending window is the last BUCKETS buckets, and each bucket
+expires once it leaves the window. A sorted set keeps the TOP_K emojis with the highest estimates
+in the window (the heavy hitters), updated as uses are counted, so reading the trending emojis
+takes a fixed number of counters however busy the guild is.
+
+The users of each emoji are counted in a HyperLogLog (0.81% standard error; at most 12 KB, and a
+few hundred bytes while sparse), which expires after SAFETY_TRENDING_UNIQUE_DAYS without uses.
+
+Only uses of users who consented to stats are counted. Removed reactions and edited or deleted
+messages are not subtracted, since a HyperLogLog cannot forget a user
+"""
+from collections import Counter
+from functools import lru_cache
+from hashlib import blake2b
+from os import environ
+from time import time
+from typing import List, NamedTuple, Tuple
+
+from .emojis import interner
+from .keys import Id, emoji_users_key, trending_key, trending_top_key
+from .lazy import Lazy
+from .memory import register_cache
+from .redis import redis
+
+__all__ = ["TRENDING", "TrendingEmoji", "cells", "record_trending", "top_trending"]
+
+TRENDING = environ.get("SAFETY_TRENDING", "1") == "1"
+BUCKET_SECONDS = int(float(environ.get("SAFETY_TRENDING_BUCKET_MINUTES", "60")) * 60)
+BUCKETS = int(environ.get("SAFETY_TRENDING_BUCKETS", "24"))
+WIDTH = int(environ.get("SAFETY_TRENDING_WIDTH", "512"))
+DEPTH = 4
+TOP_K = int(environ.get("SAFETY_TRENDING_TOP", "50"))
+UNIQUE_SECONDS = int(float(environ.get("SAFETY_TRENDING_UNIQUE_DAYS", "30")) * 86400)
+
+# KEYS: the guild's sketches, newest bucket first, its top emojis, then the users HyperLogLog of
+# each emoji. ARGV: buckets, depth, top k, the TTLs (ms) of the newest bucket, the top emojis and
+# the HyperLogLogs, the user, then per emoji its id, uses and cells (see cells). Counts the uses in
+# the newest bucket, and rescores each emoji in the top emojis from its estimate over every bucket
+RECORD_SCRIPT = """
+local buckets = tonumber(ARGV[1])
+local depth = tonumber(ARGV[2])
+local top = KEYS[buckets + 1]
+local emoji = 0
+for arg = 8, #ARGV, depth + 2 do
+  emoji = emoji + 1
+  local increments = {"OVERFLOW", "SAT"}
+  local gets = {}
+  for row = 1, depth do
+    local cell = "#" .. ARGV[arg + 1 + row]
+    for _, part in ipairs({"INCRBY", "u32", cell, ARGV[arg + 1]}) do table.insert(increments, part) end
+    for _, part in ipairs({"GET", "u32", cell}) do table.insert(gets, part) end
+  end
+  local sums = redis.call("BITFIELD", KEYS[1], unpack(increments))
+  for bucket = 2, buckets do
+    local counts = redis.call("BITFIELD", KEYS[bucket], unpack(gets))
+    for row = 1, depth do
+      sums[row] = sums[row] + counts[row]
+    end
+  end
+  redis.call("ZADD", top, math.min(unpack(sums)), ARGV[arg])
+  if redis.call("ZCARD", top) > tonumber(ARGV[3]) then
+    redis.call("ZREMRANGEBYRANK", top, 0, 0)
+  end
+  local users = KEYS[buckets + 1 + emoji]
+  redis.call("PFADD", users, ARGV[7])
+  redis.call("PEXPIRE", users, ARGV[6])
+end
+redis.call("PEXPIRE", KEYS[1], ARGV[4])
+redis.call("PEXPIRE", top, ARGV[5])
+"""
+
+record_script = Lazy(lambda: redis.register_script(RECORD_SCRIPT))
+
+class TrendingEmoji(NamedTuple):
+  emoji: str
+  # estimated uses in the trending window, and in its newest bucket
+  uses: int
+  recent: int
+  # estimated number of people who used it
+  users: int
+
+@lru_cache(maxsize=4096)
+def cells(emoji_id: str) -> Tuple[int, ...]:
+  """
+  Returns the counter an emoji (by interned id) is counted in on each row of a sketch, as
+  BITFIELD indexes of 32 bit counters
+  """
+  digest = blake2b(emoji_id.encode(), digest_size=4 * DEPTH).digest()
+
+  return tuple(row * WIDTH + int.from_bytes(digest[row * 4:row * 4 + 4], "little") % WIDTH for row in range(DEPTH))
+
+register_cache("trending cells", lambda: cells.cache_info().currsize)
+
+def bucket_keys(guild_id: Id, now: float) -> List[str]:
+  """
+  The keys of the sketches in the trending window, newest first
+  """
+  bucket = int(now // BUCKET_SECONDS)
+
+  return [trending_key(guild_id, bucket - age) for age in range(BUCKETS)]
+
+def record_trending(user_id: Id, guild_id: Id, emojis: List[str]):
+  """
+  Counts emoji uses towards a guild's trending emojis, in one round trip. Callers only pass uses
+  of users who consented to stats
+
+  Args:
+    user_id (Id): the user who used the emojis
+    guild_id (Id): the guild they were used in
+    emojis (List[str]): the emojis used, which may repeat
+  """
+  if not TRENDING or not emojis:
+    return
+
+  now = time()
+  # the newest bucket leaves the window BUCKETS buckets after it started
+  bucket_ttl = ((int(now // BUCKET_SECONDS) + BUCKETS) * BUCKET_SECONDS - now) * 1000
+  keys = bucket_keys(guild_id, now) + [trending_top_key(guild_id)]
+  args = [BUCKETS, DEPTH, TOP_K, int(bucket_ttl), BUCKETS * BUCKET_SECONDS * 1000, UNIQUE_SECONDS * 1000, user_id]
+
+  for [id, count] in Counter(interner.intern(guild_id, emojis)).items():
+    keys.append(emoji_users_key(guild_id, id))
+    args += [id, count, *cells(id)]
+
+  record_script.resolve()(keys=keys, args=args)
+
+def top_trending(guild_id: Id, count: int) -> List[TrendingEmoji]:
+  """
+  Returns a guild's most used emojis in the trending window, most used first (blocking, run in an
+  executor). Reads the counters of the TOP_K candidates in one pipeline, whatever the traffic, and
+  rescores them so emojis no longer used make room for others
+
+  Args:
+    guild_id (Id): the guild
+    count (int): how many emojis to return, at most TOP_K
+  """
+  top_key = trending_top_key(guild_id)
+  ids = redis.zrevrange(top_key, 0, TOP_K - 1)
+
+  if not ids:
+    return []
+
+  gets: List[str] = []
+
+  for id in ids:
+    for cell in cells(id):
+      gets += ["GET", "u32", f"#{cell}"]
+
+  with redis.pipeline(transaction=False) as pipe:
+    for key in bucket_keys(guild_id, time()):
+      pipe.execute_command("BITFIELD", key, *gets)
+
+    for id in ids:
+      pipe.pfcount(emoji_users_key(guild_id, id))
+
+    replies = pipe.execute()
+
+  [sketches, users] = [replies[:BUCKETS], replies[BUCKETS:]]
+  emojis: List[TrendingEmoji] = []
+  names = interner.names(guild_id, ids)
+
+  with redis.pipeline(transaction=False) as pipe:
+    for [index, id] in enumerate(ids):
+      rows = range(index * DEPTH, (index + 1) * DEPTH)
+      uses = min(sum(sketch[row] for sketch in sketches) for row in rows)
+
+      if uses > 0:
+        pipe.zadd(top_key, { id: uses }, xx=True)
+        emojis.append(TrendingEmoji(names.get(id, id), uses, min(sketches[0][row] for row in rows), users[index]))
+      else:
+        pipe.zrem(top_key, id)
+
+    pipe.execute()
+
+  return sorted(emojis, key=lambda emoji: (emoji.uses, emoji.recent), reverse=True)[:count]
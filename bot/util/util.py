@@ -1,22 +1,10 @@
 from datetime import datetime
-from dateutil.parser import parse
-from dateutil.tz import tzlocal, tzstr
+from dateutil.tz import tzlocal
 from typing import List, Optional
 
-__all__ = ["get_date", "get_local_date"]
+from .timeparse import parse_datetime
 
-us_timezones = {
-  "EDT": -14400,
-  "EST": tzstr("EST5EDT"),
-  "CDT": -18000,
-  "CST": tzstr("CST6CDT"),
-  "MDT": -21600,
-  "MST": tzstr("MST7MDT"),
-  "PDT": -25200,
-  "PST": tzstr("PST6PDT"),
-  "AKDT": -28800,
-  "AKST": tzstr("AKST9AKDT")
-}
+__all__ = ["get_date", "get_local_date"]
 
 def get_date(input: str, formats: List[str]) -> Optional[datetime]:
   """
@@ -44,13 +32,19 @@ def get_local_date(input: str) -> Optional[datetime]:
   If the string cannot be parsed, returns None
 
   Args:
-    input (str): an input string with time zone string (%Z)
+    input (str): an input string with time zone string (%Z), an IANA zone name,
+      or a relative time ("in 2h30m")
 
   Returns:
     a datetime representing the time converted to server local time
     or None if the parse fails
   """
+  parsed = parse_datetime(input)
+
+  if parsed is None:
+    return None
+
   try:
-    return parse(input, tzinfos=us_timezones).astimezone(tzlocal())
-  except:
+    return parsed.astimezone(tzlocal())
+  except (OverflowError, ValueError):
     return None
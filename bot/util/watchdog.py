@@ -0,0 +1,100 @@
+"""
+Detects callbacks that hold the event loop for too long.
+
+A coroutine on the loop records a heartbeat several times per threshold. A separate thread checks
+the heartbeat; when it is older than the threshold, the loop is stuck in some callback, so the
+thread captures the loop thread's current stack. Setting SAFETY_BLOCKING_THRESHOLD (in seconds)
+enables it
+"""
+from asyncio import AbstractEventLoop, sleep
+from collections import deque
+from datetime import datetime
+from os import environ
+from sys import _current_frames, stderr
+from threading import Thread, get_ident
+from time import monotonic, sleep as thread_sleep
+from traceback import format_stack
+from typing import Deque, NamedTuple, Optional
+
+from .metrics import Counter
+
+__all__ = ["Stall", "Watchdog", "watchdog"]
+
+# stacks kept for >stalls
+HISTORY = 20
+# innermost frames kept per stack
+STACK_DEPTH = 25
+
+stalls = Counter("safety_loop_stalls_total", "Times a callback held the event loop past the blocking threshold")
+
+class Stall(NamedTuple):
+  when: datetime
+  # how long the loop had been blocked when the stack was captured
+  seconds: float
+  stack: str
+
+class Watchdog:
+  """
+  Watches an event loop from another thread, capturing the loop's stack when it stalls
+  """
+  def __init__(self):
+    self.threshold: Optional[float] = None
+    self.beat = monotonic()
+    self.loop_thread: Optional[int] = None
+    self.history: Deque[Stall] = deque(maxlen=HISTORY)
+
+  @property
+  def running(self) -> bool:
+    return self.threshold is not None
+
+  def start(self, loop: AbstractEventLoop, threshold: Optional[float] = None):
+    """
+    Starts watching loop. Does nothing unless a threshold is given or SAFETY_BLOCKING_THRESHOLD is set
+
+    Args:
+      loop (AbstractEventLoop): the loop to watch. Must be called from the loop's thread
+      threshold (Optional[float]): how long, in seconds, a callback may hold the loop
+    """
+    threshold = threshold or float(environ.get("SAFETY_BLOCKING_THRESHOLD", "0"))
+
+    if self.running or not threshold:
+      return
+
+    self.threshold = threshold
+    self.loop_thread = get_ident()
+    self.beat = monotonic()
+
+    loop.create_task(self.heartbeat())
+    Thread(target=self.watch, name="watchdog", daemon=True).start()
+
+  async def heartbeat(self):
+    while True:
+      self.beat = monotonic()
+      await sleep(self.threshold / 4)
+
+  def watch(self):
+    # the heartbeat of the stall that was last reported, so a stall is reported once
+    reported = None
+
+    while True:
+      blocked = monotonic() - self.beat
+
+      if blocked > self.threshold and reported != self.beat:
+        reported = self.beat
+        self.capture(blocked)
+
+      thread_sleep(self.threshold / 4)
+
+  def capture(self, blocked: float):
+    frame = _current_frames().get(self.loop_thread)
+
+    if frame is None:
+      return
+
+    stack = "".join(format_stack(frame)[-STACK_DEPTH:])
+    self.history.append(Stall(datetime.now(), blocked, stack))
+    stalls.inc()
+
+    print(f"Event loop blocked for over {blocked:.3f}s:\n{stack}", file=stderr)
+
+watchdog = Watchdog()
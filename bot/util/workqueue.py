@@ -0,0 +1,159 @@
+"""
+A work queue for CPU-heavy commands, on a redis stream.
+
+With SAFETY_OFFLOAD=1 the gateway process publishes such commands as jobs instead of running them
+on its event loop. Worker processes (see bot.worker) read jobs in a consumer group, run the handler
+registered for the job's kind and send the replies through the REST API, then acknowledge the job.
+A job a worker read but never acknowledged (the worker died, or the reply failed) is claimed by
+another worker once it has been idle for CLAIM_IDLE_MS; after MAX_DELIVERIES it is moved to the
+dead letter stream
+"""
+import json
+
+from os import environ
+from redis.exceptions import ResponseError
+from time import monotonic, time
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from .metrics import Counter
+from .redis import redis
+
+__all__ = ["Job", "OFFLOAD", "WorkQueue", "handlers", "publish", "register_handler", "work_jobs"]
+
+OFFLOAD = environ.get("SAFETY_OFFLOAD", "") == "1"
+
+STREAM_KEY = "{work}:jobs"
+DEAD_KEY = "{work}:dead"
+GROUP = "workers"
+# the stream is trimmed to about this many entries
+MAX_LENGTH = 10000
+BATCH = 10
+BLOCK_MS = 5000
+CLAIM_IDLE_MS = int(environ.get("SAFETY_WORK_CLAIM_MS", "60000"))
+MAX_DELIVERIES = 3
+
+work_jobs = Counter("safety_work_jobs_total", "Work queue jobs by outcome", ["outcome"])
+
+class Job(NamedTuple):
+  id: str
+  kind: str
+  # the channel the replies are sent to
+  channel: int
+  payload: Dict[str, Any]
+  published: float
+
+# kind -> a function turning a job's payload into the messages to reply with
+handlers: Dict[str, Callable[[Dict[str, Any]], List[str]]] = {}
+
+def register_handler(kind: str, handler: Callable[[Dict[str, Any]], List[str]]):
+  """
+  Registers the function workers run for jobs of a kind. It may raise a ValueError,
+  whose message is sent as the reply
+  """
+  handlers[kind] = handler
+
+def publish(kind: str, payload: Dict[str, Any], channel_id: int) -> str:
+  """
+  Queues a job
+
+  Args:
+    kind (str): the kind of job (see register_handler)
+    payload (Dict[str, Any]): the job's arguments, which must serialize to JSON
+    channel_id (int): the channel to reply in
+
+  Returns:
+    the id of the job
+  """
+  fields = { "kind": kind, "channel": channel_id, "payload": json.dumps(payload), "published": time() }
+  work_jobs.inc("published")
+
+  return redis.xadd(STREAM_KEY, fields, maxlen=MAX_LENGTH, approximate=True)
+
+def parse_entry(id: str, fields: Dict[str, str]) -> Job:
+  return Job(id, fields["kind"], int(fields["channel"]), json.loads(fields["payload"]), float(fields["published"]))
+
+class WorkQueue:
+  """
+  The consumer side of the queue, for one worker
+  """
+  def __init__(self, consumer: str):
+    self.consumer = consumer
+    self.last_claim = 0.0
+
+  def ensure_group(self):
+    """
+    Creates the stream and the consumer group if they do not exist yet
+    """
+    try:
+      redis.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+      if "BUSYGROUP" not in str(e):
+        raise
+
+  def read(self) -> List[Job]:
+    """
+    Waits up to BLOCK_MS for new jobs
+    """
+    replies = redis.xreadgroup(GROUP, self.consumer, { STREAM_KEY: ">" }, count=BATCH, block=BLOCK_MS)
+    jobs = []
+
+    for [_, entries] in replies or []:
+      for [id, fields] in entries:
+        if fields:
+          jobs.append(parse_entry(id, fields))
+
+    return jobs
+
+  def claim_stale(self) -> List[Job]:
+    """
+    Claims jobs other workers read but did not acknowledge within CLAIM_IDLE_MS, and moves jobs
+    that were delivered MAX_DELIVERIES times to the dead letter stream. Runs at most every quarter
+    of CLAIM_IDLE_MS
+    """
+    if monotonic() - self.last_claim < CLAIM_IDLE_MS / 4000:
+      return []
+
+    self.last_claim = monotonic()
+    stale: List[str] = []
+
+    for pending in redis.xpending_range(STREAM_KEY, GROUP, "-", "+", BATCH * 10):
+      if pending["time_since_delivered"] < CLAIM_IDLE_MS:
+        continue
+
+      if pending["times_delivered"] >= MAX_DELIVERIES:
+        self.dead_letter(pending["message_id"], f"delivered {pending['times_delivered']} times")
+      else:
+        stale.append(pending["message_id"])
+
+    if not stale:
+      return []
+
+    claimed = redis.xclaim(STREAM_KEY, GROUP, self.consumer, CLAIM_IDLE_MS, stale)
+    work_jobs.inc("redelivered", amount=len(claimed))
+
+    # entries trimmed from the stream are claimed without fields
+    return [parse_entry(id, fields) for [id, fields] in claimed if fields]
+
+  def next_jobs(self) -> List[Job]:
+    """
+    Returns stale jobs to retry if there are any, otherwise waits for new jobs (blocking)
+    """
+    return self.claim_stale() or self.read()
+
+  def ack(self, job: Job, outcome: str = "done"):
+    redis.xack(STREAM_KEY, GROUP, job.id)
+    work_jobs.inc(outcome)
+
+  def dead_letter(self, id: str, reason: str):
+    """
+    Copies a job to the dead letter stream with the reason, and acknowledges it
+    """
+    entries = redis.xrange(STREAM_KEY, id, id)
+    fields = entries[0][1] if entries else {}
+
+    with redis.pipeline() as pipe:
+      pipe.xadd(DEAD_KEY, { **fields, "id": id, "reason": reason }, maxlen=MAX_LENGTH, approximate=True)
+      pipe.xack(STREAM_KEY, GROUP, id)
+      pipe.execute()
+
+    work_jobs.inc("dead")
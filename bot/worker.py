@@ -0,0 +1,105 @@
+"""
+Work queue workers (see bot.util.workqueue). Each process consumes jobs and replies through the
+Discord REST API, without connecting to the gateway, so workers can be added or removed while
+the bot runs. Run them next to a bot started with SAFETY_OFFLOAD=1
+
+SAFETY_BOT_TOKEN=... python -m bot.worker --processes 4
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop, new_event_loop, set_event_loop
+from discord import HTTPException
+from discord.http import HTTPClient
+from multiprocessing import get_context
+from os import environ, getpid
+from socket import gethostname
+from sys import exit, stderr
+
+# importing the cogs registers their job handlers
+from . import cogs
+from .storage import storage
+from .util import record_error
+from .util.workqueue import Job, WorkQueue, handlers
+
+__all__ = ["run_job", "work"]
+
+async def run_job(http: HTTPClient, queue: WorkQueue, job: Job):
+  """
+  Runs a job's handler and sends its replies, then acknowledges it. A job whose replies could
+  not be sent is left pending, so another worker retries it
+  """
+  try:
+    if job.kind not in handlers:
+      raise LookupError(f"No handler for {job.kind} jobs")
+
+    replies = handlers[job.kind](job.payload)
+    outcome = "done"
+  except ValueError as e:
+    replies = [str(e)]
+    outcome = "rejected"
+  except Exception as e:
+    record_error(f"worker_{job.kind}", e)
+    queue.dead_letter(job.id, repr(e))
+    return
+
+  try:
+    for reply in replies:
+      await http.send_message(job.channel, reply)
+  except HTTPException as e:
+    record_error("worker_reply", e)
+    return
+
+  queue.ack(job, outcome)
+
+async def work(token: str, consumer: str):
+  """
+  Consumes jobs until the process is stopped
+  """
+  http = HTTPClient()
+  await http.static_login(token, bot=True)
+  queue = WorkQueue(consumer)
+  queue.ensure_group()
+  loop = get_event_loop()
+
+  try:
+    while True:
+      # waiting for jobs blocks, so it runs off the loop while replies are sent
+      for job in await loop.run_in_executor(None, queue.next_jobs):
+        await run_job(http, queue, job)
+  finally:
+    await http.close()
+
+    if storage.initialized:
+      storage.close()
+
+def worker_process(token: str, index: int):
+  loop = new_event_loop()
+  set_event_loop(loop)
+  loop.run_until_complete(work(token, f"{gethostname()}-{getpid()}-{index}"))
+
+def main():
+  parser = ArgumentParser(description="Runs work queue workers")
+  parser.add_argument("--processes", type=int, default=1, help="the number of worker processes")
+  args = parser.parse_args()
+
+  if "SAFETY_BOT_TOKEN" not in environ:
+    print("No Bot token provided", file=stderr)
+    exit(-1)
+
+  token = environ["SAFETY_BOT_TOKEN"]
+
+  if args.processes == 1:
+    worker_process(token, 0)
+    return
+
+  # spawned, so no process inherits the parent's redis connections
+  context = get_context("spawn")
+  processes = [context.Process(target=worker_process, args=(token, index)) for index in range(args.processes)]
+
+  for process in processes:
+    process.start()
+
+  for process in processes:
+    process.join()
+
+if __name__ == "__main__":
+  main()
@@ -1,8 +1,12 @@
-from bot import bot
+from time import perf_counter
+
+started = perf_counter()
+
+from bot import lifecycle
 import os
 
 if "SAFETY_BOT_TOKEN" not in os.environ:
   print("No Bot token provided", file=os.sys.stderr)
   os.sys.exit(-1)
 
-bot.run(os.environ["SAFETY_BOT_TOKEN"])
+lifecycle.run(os.environ["SAFETY_BOT_TOKEN"], profile_startup="--profile-startup" in os.sys.argv, started=started)
\ No newline at end of file